@@ -1,10 +1,404 @@
 ########################### BIBLIOTECAS ##############################
+# Importar este módulo não executa nenhuma etapa: o pipeline corre via main()
+# (python II.py --etapas ...). pycountry e pyodbc são importados só quando usados.
+import argparse
+import functools
+import hashlib
+import inspect
+import io
+import json
+import multiprocessing
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from itertools import repeat
+
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from prefect import flow, task
 import numpy as np
-import pycountry
-from pycountry_convert import country_alpha2_to_continent_code, convert_continent_code_to_continent_name
+
+##########################################################################################################################
+##########################################################################################################################
+##################################################### Instrumentação #####################################################
+##########################################################################################################################
+##########################################################################################################################
+
+# Diagnósticos pesados (describe, listas de valores únicos) só são impressos com --verboso
+VERBOSO = False
+
+# Um registo por execução de cada etapa instrumentada (ver instrumentado)
+REGISTO_ETAPAS = []
+
+
+def configurar_instrumentacao(verboso: bool | None = None):
+    global VERBOSO
+    if verboso is not None:
+        VERBOSO = verboso
+
+
+# Segundos entre amostras da memória residente durante cada etapa
+INTERVALO_MEMORIA = 0.01
+
+
+def _memoria_residente_mb() -> float | None:
+    # Memória residente atual do processo: /proc no Linux; nos outros sistemas o psutil,
+    # se estiver instalado
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+@contextmanager
+def _pico_memoria():
+    # Pico da memória residente durante o bloco, amostrada numa thread a cada
+    # INTERVALO_MEMORIA. O ru_maxrss não serve: é o máximo desde o início do processo,
+    # pelo que cada etapa herdaria o pico das anteriores. Picos mais curtos do que o
+    # intervalo podem escapar.
+    medida = {"pico_mb": _memoria_residente_mb()}
+    if medida["pico_mb"] is None:
+        yield medida
+        return
+    parar = threading.Event()
+
+    def amostrar():
+        while not parar.wait(INTERVALO_MEMORIA):
+            medida["pico_mb"] = max(medida["pico_mb"], _memoria_residente_mb())
+
+    amostrador = threading.Thread(target=amostrar, daemon=True)
+    amostrador.start()
+    try:
+        yield medida
+    finally:
+        parar.set()
+        amostrador.join()
+        medida["pico_mb"] = round(max(medida["pico_mb"], _memoria_residente_mb()), 1)
+
+
+def _contar_linhas(valor) -> int | None:
+    # DataFrame/Series -> linhas; int -> ele próprio (p.ex. linhas escritas/inseridas);
+    # (DataFrame, ...) -> o primeiro; dict -> soma das tabelas; objetos com .linhas
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        return len(valor)
+    if isinstance(valor, (int, np.integer)) and not isinstance(valor, bool):
+        return int(valor)
+    if isinstance(valor, tuple) and valor:
+        return _contar_linhas(valor[0])
+    if isinstance(valor, dict):
+        contagens = [_contar_linhas(v) for v in valor.values() if isinstance(v, (pd.DataFrame, pd.Series))]
+        return sum(contagens) if contagens else None
+    return getattr(valor, "linhas", None)
+
+
+def instrumentado(etapa: str, detalhe: str | None = None):
+    # Regista tempo de relógio, tempo de CPU, pico de memória (durante a chamada) e
+    # linhas de entrada/saída de cada chamada. As linhas de entrada são as do primeiro
+    # DataFrame, DadosCarga ou AgregadosInquerito recebido (não as de outros objetos com
+    # .linhas, como o total já escrito de um EscritorIntermedio); com
+    # detalhe, o valor desse parâmetro (p.ex. o código do indicador) entra no nome.
+    # O tempo de CPU é o do processo: com etapas em threads inclui o das outras.
+    def decorador(funcao):
+        assinatura = inspect.signature(funcao)
+
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            argumentos = assinatura.bind_partial(*args, **kwargs).arguments
+            nome = etapa if detalhe is None else f"{etapa}[{argumentos.get(detalhe)}]"
+            # As classes são do próprio módulo, definidas mais abaixo
+            entrada = next((v for v in argumentos.values()
+                            if isinstance(v, (pd.DataFrame, DadosCarga, AgregadosInquerito))), None)
+
+            inicio, inicio_cpu = time.perf_counter(), time.process_time()
+            with _pico_memoria() as memoria:
+                resultado = funcao(*args, **kwargs)
+            REGISTO_ETAPAS.append({
+                "etapa": nome,
+                "segundos": round(time.perf_counter() - inicio, 4),
+                "cpu_segundos": round(time.process_time() - inicio_cpu, 4),
+                "pico_memoria_mb": memoria["pico_mb"],
+                "linhas_entrada": None if entrada is None else _contar_linhas(entrada),
+                "linhas_saida": _contar_linhas(resultado),
+            })
+            return resultado
+        return envolvida
+    return decorador
+
+
+def guardar_relatorio_etapas(caminho: str) -> str:
+    # Relatório das etapas em JSON (lista de registos) ou CSV, conforme a extensão
+    if caminho.endswith(".csv"):
+        pd.DataFrame(REGISTO_ETAPAS).to_csv(caminho, index=False)
+    else:
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(REGISTO_ETAPAS, f, ensure_ascii=False, indent=2)
+    return caminho
+
+
+##########################################################################################################################
+##########################################################################################################################
+################################################# Armazenamento intermédio ###############################################
+##########################################################################################################################
+##########################################################################################################################
+
+# Formato dos ficheiros passados entre etapas: "parquet" (por omissão), "feather" ou "csv".
+# Parquet/Feather preservam os tipos (categóricos, Int64, floats) e evitam voltar a
+# interpretar texto em cada leitura; o CSV continua disponível como exportação.
+FORMATO_INTERMEDIO = os.environ.get("FORMATO_INTERMEDIO", "parquet")
+EXPORTAR_CSV = False
+EXTENSOES_INTERMEDIO = {"parquet": ".parquet", "feather": ".feather", "csv": ".csv"}
+
+
+def configurar_intermedios(formato: str | None = None, exportar_csv: bool | None = None):
+    global FORMATO_INTERMEDIO, EXPORTAR_CSV
+    if formato is not None:
+        if formato not in EXTENSOES_INTERMEDIO:
+            raise ValueError(f"Formato intermédio desconhecido: {formato}")
+        FORMATO_INTERMEDIO = formato
+    if exportar_csv is not None:
+        EXPORTAR_CSV = exportar_csv
+
+
+def _formato(formato: str | None = None) -> str:
+    formato = formato or FORMATO_INTERMEDIO
+    if formato != "csv":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print(f"Aviso: pyarrow não está instalado; a usar CSV em vez de {formato}.")
+            return "csv"
+    return formato
+
+
+def caminho_intermedio(nome: str, formato: str | None = None) -> str:
+    return nome + EXTENSOES_INTERMEDIO[_formato(formato)]
+
+
+@instrumentado("escrita", detalhe="nome")
+def guardar_intermedio(df: pd.DataFrame, nome: str, formato: str | None = None) -> str:
+    # Escreve num ficheiro temporário e substitui o destino no fim: DataFrames lidos
+    # antes com memory-map continuam a apontar para o ficheiro antigo, que não é alterado
+    formato = _formato(formato)
+    caminho = caminho_intermedio(nome, formato)
+    temporario = caminho + ".tmp"
+    if formato == "parquet":
+        df.to_parquet(temporario, index=False)
+    elif formato == "feather":
+        df.reset_index(drop=True).to_feather(temporario)
+    else:
+        df.to_csv(temporario, index=False)
+    os.replace(temporario, caminho)
+
+    if EXPORTAR_CSV and formato != "csv":
+        df.to_csv(nome + ".csv", index=False)
+    return caminho
+
+
+def caminho_leitura(nome: str, formato: str | None = None) -> tuple:
+    # (formato, caminho) do ficheiro que ler_intermedio vai efetivamente ler
+    formato = _formato(formato)
+    caminho = caminho_intermedio(nome, formato)
+    if not os.path.exists(caminho) and os.path.exists(nome + ".csv"):
+        return "csv", nome + ".csv"
+    return formato, caminho
+
+
+def ler_intermedio(nome: str, formato: str | None = None, colunas: list | None = None,
+                   memory_map: bool = True) -> pd.DataFrame:
+    # Parquet e Feather são lidos com memory-map; se o ficheiro no formato pedido não
+    # existir mas houver um CSV de uma execução anterior, é esse o usado
+    formato, caminho = caminho_leitura(nome, formato)
+    if formato == "parquet":
+        return pd.read_parquet(caminho, columns=colunas, memory_map=memory_map)
+    if formato == "feather":
+        from pyarrow import feather
+        return feather.read_table(caminho, columns=colunas, memory_map=memory_map).to_pandas()
+    return pd.read_csv(caminho, usecols=colunas)
+
+
+def ler_intermedio_em_blocos(nome: str, tamanho_bloco: int, formato: str | None = None):
+    # Gerador de blocos de até tamanho_bloco linhas de um ficheiro intermédio, sem o
+    # carregar todo em memória (Parquet e Feather lidos por lotes com memory-map)
+    formato, caminho = caminho_leitura(nome, formato)
+    if formato == "csv":
+        yield from pd.read_csv(caminho, chunksize=tamanho_bloco)
+        return
+
+    import pyarrow as pa
+    if formato == "parquet":
+        import pyarrow.parquet as pq
+        lotes = pq.ParquetFile(caminho, memory_map=True).iter_batches(batch_size=tamanho_bloco)
+    else:
+        leitor = pa.ipc.open_file(pa.memory_map(caminho))
+        lotes = (leitor.get_batch(i) for i in range(leitor.num_record_batches))
+    for lote in lotes:
+        for inicio in range(0, lote.num_rows, tamanho_bloco):
+            yield lote.slice(inicio, tamanho_bloco).to_pandas()
+
+
+def existe_intermedio(nome: str, formato: str | None = None) -> bool:
+    return os.path.exists(caminho_intermedio(nome, formato))
+
+
+class EscritorIntermedio:
+    # Escrita incremental, bloco a bloco, de um ficheiro intermédio. Todos os blocos
+    # são convertidos para o esquema do primeiro.
+    def __init__(self, caminho: str, formato: str | None = None):
+        self.caminho = caminho
+        self.formato = _formato(formato)
+        self.linhas = 0
+        self._escritor = None
+        self._esquema = None
+        self._categorias = {}
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+    def _acumular_categorias(self, bloco: pd.DataFrame) -> pd.DataFrame:
+        # Um ficheiro Feather (IPC) só admite um dicionário por coluna, que pode crescer
+        # (deltas) mas não ser substituído. Cada bloco passa a usar as categorias dos
+        # blocos anteriores seguidas das suas novas, pelo que o dicionário só cresce.
+        novas = {}
+        for coluna in bloco.columns:
+            if not isinstance(bloco[coluna].dtype, pd.CategoricalDtype):
+                continue
+            categorias = bloco[coluna].cat.categories
+            anteriores = self._categorias.get(coluna)
+            if anteriores is not None:
+                categorias = anteriores.append(categorias.difference(anteriores, sort=False))
+            self._categorias[coluna] = categorias
+            novas[coluna] = bloco[coluna].cat.set_categories(categorias)
+        return bloco.assign(**novas) if novas else bloco
+
+    def escrever(self, bloco: pd.DataFrame):
+        if self.formato == "feather":
+            bloco = self._acumular_categorias(bloco)
+        if self.formato == "csv":
+            bloco.to_csv(self.caminho, mode="a", header=self.linhas == 0, index=False)
+        else:
+            import pyarrow as pa
+
+            tabela = pa.Table.from_pandas(bloco, schema=self._esquema, preserve_index=False)
+            if self._escritor is None:
+                self._esquema = tabela.schema
+                if self.formato == "parquet":
+                    import pyarrow.parquet as pq
+                    self._escritor = pq.ParquetWriter(self.caminho, self._esquema)
+                else:
+                    opcoes = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+                    self._escritor = pa.ipc.new_file(self.caminho, self._esquema, options=opcoes)
+            self._escritor.write_table(tabela)
+        self.linhas += len(bloco)
+
+    def fechar(self):
+        if self._escritor is not None:
+            self._escritor.close()
+            self._escritor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+# Cache de etapas (--cache-etapas): pasta e número de chaves guardadas por etapa
+DIR_CACHE_ETAPAS = "cache_etapas"
+MAX_ENTRADAS_CACHE = 3
+
+
+class CacheEtapas:
+    # Memoização das etapas em disco. A chave de uma execução é o hash do conteúdo dos
+    # ficheiros de entrada, da versão do código da etapa e dos parâmetros que mudam o
+    # resultado. Com uma chave já conhecida a etapa é saltada; as saídas guardadas nessa
+    # altura são repostas se entretanto tiverem mudado. Por etapa mantêm-se só as
+    # max_entradas chaves usadas mais recentemente (as outras são apagadas).
+    def __init__(self, diretorio: str = DIR_CACHE_ETAPAS, max_entradas: int = MAX_ENTRADAS_CACHE):
+        self.diretorio = diretorio
+        self.max_entradas = max_entradas
+        self._caminho_indice = os.path.join(diretorio, "indice.json")
+        os.makedirs(diretorio, exist_ok=True)
+        self.indice = {"etapas": {}, "ficheiros": {}}
+        if os.path.exists(self._caminho_indice):
+            with open(self._caminho_indice, encoding="utf-8") as f:
+                self.indice = json.load(f)
+
+    def hash_ficheiro(self, caminho: str) -> str | None:
+        # O ficheiro só volta a ser lido se o tamanho ou a data de modificação mudaram,
+        # por isso uma nova execução sem alterações custa apenas um stat por ficheiro
+        if not os.path.exists(caminho):
+            return None
+        estado = os.stat(caminho)
+        memo = self.indice["ficheiros"].get(os.path.abspath(caminho))
+        if memo and memo[:2] == [estado.st_size, estado.st_mtime_ns]:
+            return memo[2]
+
+        resumo = hashlib.sha256()
+        with open(caminho, "rb") as f:
+            for bloco in iter(lambda: f.read(1 << 20), b""):
+                resumo.update(bloco)
+        self.indice["ficheiros"][os.path.abspath(caminho)] = [estado.st_size, estado.st_mtime_ns, resumo.hexdigest()]
+        return resumo.hexdigest()
+
+    def chave(self, etapa: str, versao: int, entradas: list, parametros: dict | None = None) -> str:
+        conteudo = {
+            "etapa": etapa,
+            "versao": versao,
+            "entradas": {caminho: self.hash_ficheiro(caminho) for caminho in entradas},
+            "parametros": parametros or {},
+        }
+        return hashlib.sha256(json.dumps(conteudo, sort_keys=True).encode()).hexdigest()[:32]
+
+    def _pasta(self, etapa: str, chave: str) -> str:
+        return os.path.join(self.diretorio, etapa.replace(":", "_"), chave)
+
+    def _gravar_indice(self):
+        with open(self._caminho_indice + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.indice, f)
+        os.replace(self._caminho_indice + ".tmp", self._caminho_indice)
+
+    def restaurar(self, etapa: str, chave: str) -> bool:
+        # True se a etapa pode ser saltada (com as saídas já no sítio)
+        registo = self.indice["etapas"].get(etapa, {}).get(chave)
+        if registo is None:
+            return False
+        for caminho, resumo in registo["saidas"].items():
+            if self.hash_ficheiro(caminho) == resumo:
+                continue
+            copia = os.path.join(self._pasta(etapa, chave), os.path.basename(caminho))
+            if not os.path.exists(copia):
+                return False
+            shutil.copyfile(copia, caminho + ".tmp")
+            os.replace(caminho + ".tmp", caminho)
+        registo["usado_em"] = time.time()
+        self._gravar_indice()
+        return True
+
+    def guardar(self, etapa: str, chave: str, saidas: list = ()):
+        pasta = self._pasta(etapa, chave)
+        os.makedirs(pasta, exist_ok=True)
+        registo = {}
+        for caminho in saidas:
+            shutil.copyfile(caminho, os.path.join(pasta, os.path.basename(caminho)))
+            registo[caminho] = self.hash_ficheiro(caminho)
+
+        chaves = self.indice["etapas"].setdefault(etapa, {})
+        chaves[chave] = {"saidas": registo, "usado_em": time.time()}
+        for antiga in sorted(chaves, key=lambda c: chaves[c]["usado_em"])[:-self.max_entradas]:
+            shutil.rmtree(self._pasta(etapa, antiga), ignore_errors=True)
+            del chaves[antiga]
+        self._gravar_indice()
 
 ##########################################################################################################################
 ##########################################################################################################################
@@ -12,16 +406,22 @@ from pycountry_convert import country_alpha2_to_continent_code, convert_continen
 ##########################################################################################################################
 ##########################################################################################################################
 
-# Carregamento do CSV original
-df = pd.read_csv("Impact_of_Remote_Work_on_Mental_Health.csv")
+# Ficheiro original do inquérito sobre trabalho remoto e saúde mental
+CSV_INQUERITO = "Impact_of_Remote_Work_on_Mental_Health.csv"
 
-# Mostrar info geral do dataset
-print("Dimensões:", df.shape)
-print("Colunas:", df.columns.tolist())
-print(df.head())
 
-# Salvar uma amostra para inspeção inicial
-df.head(20).to_csv("amostra_dados.csv", index=False)
+def inspecionar_csv_original(caminho: str = CSV_INQUERITO) -> pd.DataFrame:
+    # Carregamento do CSV original
+    df = pd.read_csv(caminho)
+
+    # Mostrar info geral do dataset
+    print("Dimensões:", df.shape)
+    print("Colunas:", df.columns.tolist())
+    print(df.head())
+
+    # Salvar uma amostra para inspeção inicial
+    df.head(20).to_csv("amostra_dados.csv", index=False)
+    return df
 
 ###########################2.1.1 Script de Extração (incluindo chamada à API)###########################
 
@@ -39,65 +439,719 @@ apis_who = [
 
 @task
 def carregar_csv():
-    return pd.read_csv('Impact_of_Remote_Work_on_Mental_Health.csv')
+    return pd.read_csv(CSV_INQUERITO)
+
+
+# URL base da API GHO (pode ser apontada para um servidor local, p.ex. em testes)
+GHO_BASE_URL = os.environ.get("GHO_BASE_URL", "https://ghoapi.azureedge.net/api")
+
+# Número de registos pedidos por página no modo streaming ($top/$skip)
+TAMANHO_PAGINA_GHO = 5000
+
+# Diretório da cache local das respostas da API GHO (uma entrada por indicador)
+DIR_CACHE_GHO = "cache_who"
+
+# Correspondência entre as colunas do DataFrame e os campos OData da API GHO
+CAMPOS_GHO = {
+    "country": "SpatialDim",
+    "year": "TimeDim",
+    "sex": "Dim1",
+    "dim2": "Dim2",  # Manter outras colunas que possam ser úteis
+    "dim3": "Dim3",  # Manter outras colunas que possam ser úteis
+    "value_type": "ValueType",  # Manter outras colunas que possam ser úteis
+    "source": "DataSourceDim",  # Manter outras colunas que possam ser úteis
+    "value": "Value",  # Coluna original com o texto
+}
+# Colunas tipadas obtidas do texto de "value" durante a extração (ver analisar_valores_who)
+COLUNAS_VALOR_WHO = ["value_num", "value_low", "value_high", "value_bool"]
+COLUNAS_WHO = ["codigo", *CAMPOS_GHO, *COLUNAS_VALOR_WHO]
+
+# Tipos fixos dos dados da WHO, para que todos os blocos/indicadores tenham o mesmo esquema
+TIPOS_WHO = {coluna: "string" for coluna in ["codigo", *CAMPOS_GHO]}
+TIPOS_WHO["year"] = "Int64"
+TIPOS_WHO.update({"value_num": "float64", "value_low": "float64", "value_high": "float64", "value_bool": "boolean"})
+
+# Estimativa pontual, opcionalmente seguida do intervalo: "15.9" ou "15.9 [15.3-16.8]"
+_NUMERO = r"[-+]?\d+(?:\.\d+)?"
+PADRAO_VALOR_WHO = (
+    rf"^\s*(?P<value_num>{_NUMERO})"
+    rf"\s*(?:\[\s*(?P<value_low>{_NUMERO})\s*-\s*(?P<value_high>{_NUMERO})\s*\])?\s*$"
+)
+
+
+def analisar_valores_who(valores: pd.Series) -> pd.DataFrame:
+    # Interpreta o texto de "value" de uma só vez, para todos os indicadores: estimativa,
+    # limites do intervalo e Yes/No (MH_3). Texto que não encaixa fica em falta.
+    texto = valores.astype("string")
+    partes = texto.str.extract(PADRAO_VALOR_WHO).astype("float64")
+    partes["value_bool"] = texto.str.strip().str.lower().map({"yes": True, "no": False}).astype("boolean")
+    return partes
+
+
+def completar_valores_who(df_who: pd.DataFrame) -> pd.DataFrame:
+    # Dados guardados antes de existirem as colunas tipadas: interpretar "value" agora
+    if all(coluna in df_who.columns for coluna in COLUNAS_VALOR_WHO):
+        return df_who.astype({coluna: TIPOS_WHO[coluna] for coluna in COLUNAS_VALOR_WHO})
+    df_who = df_who.drop(columns=COLUNAS_VALOR_WHO, errors="ignore")
+    return pd.concat([df_who, analisar_valores_who(df_who["value"])], axis=1)
+
+
+def criar_sessao_http(tamanho_pool: int = 10) -> requests.Session:
+    # Sessão partilhada com pool de ligações keep-alive para todas as chamadas à API
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=tamanho_pool, pool_maxsize=tamanho_pool)
+    sessao.mount("http://", adaptador)
+    sessao.mount("https://", adaptador)
+    return sessao
+
+
+# Pedidos à API GHO: timeout (ligação, leitura) em segundos, tentativas por pedido, espera
+# base e máxima do backoff exponencial e estados HTTP em que vale a pena repetir
+TIMEOUT_GHO = (10, 120)
+TENTATIVAS_GHO = 5
+ESPERA_BASE_GHO = 0.5
+ESPERA_MAX_GHO = 30.0
+ESTADOS_REPETIR_GHO = {429, 500, 502, 503, 504}
+
+
+class ErroAPIGHO(RuntimeError):
+    # Indicador que não foi possível obter da API (depois de esgotadas as tentativas)
+    pass
+
+
+class BaldeTokens:
+    # Limite de ritmo (token bucket) partilhado pelas threads: em média `taxa` pedidos
+    # por segundo, com rajadas de até `capacidade` pedidos
+    def __init__(self, taxa: float, capacidade: int | None = None):
+        self.taxa = taxa
+        self.capacidade = capacidade or max(1, int(taxa))
+        self._tokens = float(self.capacidade)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.taxa
+            time.sleep(espera)
+
+
+class ClienteGHO:
+    # Cliente partilhado da API GHO: sessão com pool de ligações keep-alive, timeouts,
+    # repetição com backoff exponencial e jitter nos estados 429/5xx e nos erros de
+    # ligação (respeitando o Retry-After), limite de ritmo opcional e a latência de
+    # cada pedido em `metricas`
+    def __init__(self, tamanho_pool: int = 10, timeout=TIMEOUT_GHO, tentativas: int = TENTATIVAS_GHO,
+                 pedidos_por_segundo: float | None = None, espera_base: float = ESPERA_BASE_GHO,
+                 espera_max: float = ESPERA_MAX_GHO):
+        self.sessao = criar_sessao_http(tamanho_pool)
+        self.timeout = timeout
+        self.tentativas = max(1, tentativas)
+        self.espera_base = espera_base
+        self.espera_max = espera_max
+        self.balde = BaldeTokens(pedidos_por_segundo) if pedidos_por_segundo else None
+        self.metricas = []  # um registo por pedido HTTP: url, estado, tentativa, segundos
+        self._lock = threading.Lock()
+
+    def _espera(self, tentativa: int, response) -> float:
+        # Retry-After (em segundos) quando o servidor o indica; senão "full jitter"
+        if response is not None:
+            try:
+                return min(self.espera_max, float(response.headers.get("Retry-After")))
+            except (TypeError, ValueError):
+                pass
+        return random.uniform(0, min(self.espera_max, self.espera_base * 2 ** tentativa))
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        # Devolve a resposta final, qualquer que seja o estado (200, 304, 404, ...).
+        # ErroAPIGHO se as tentativas se esgotarem num estado a repetir ou erro de ligação.
+        kwargs.setdefault("timeout", self.timeout)
+        for tentativa in range(1, self.tentativas + 1):
+            if self.balde is not None:
+                self.balde.adquirir()
+            inicio = time.perf_counter()
+            response, erro = None, None
+            try:
+                response = self.sessao.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                erro = e
+            with self._lock:
+                self.metricas.append({
+                    "url": url,
+                    "estado": response.status_code if response is not None else type(erro).__name__,
+                    "tentativa": tentativa,
+                    "segundos": time.perf_counter() - inicio,
+                    "bytes": len(response.content) if response is not None else 0,
+                })
+
+            if response is not None and response.status_code not in ESTADOS_REPETIR_GHO:
+                return response
+            if tentativa < self.tentativas:
+                espera = self._espera(tentativa - 1, response)
+                if response is not None:
+                    response.close()
+                time.sleep(espera)
+
+        motivo = f"estado {response.status_code}" if response is not None else erro
+        raise ErroAPIGHO(f"{url}: {motivo} após {self.tentativas} tentativas")
+
+    def resumo(self) -> dict:
+        # Pedidos feitos, quantos foram repetições, bytes recebidos e percentis da latência (segundos)
+        with self._lock:
+            segundos = np.array([m["segundos"] for m in self.metricas])
+            repeticoes = sum(m["tentativa"] > 1 for m in self.metricas)
+            recebidos = sum(m["bytes"] for m in self.metricas)
+        if not len(segundos):
+            return {"pedidos": 0, "repeticoes": 0, "bytes": 0}
+        return {
+            "pedidos": len(segundos),
+            "repeticoes": repeticoes,
+            "bytes": recebidos,
+            "p50": round(float(np.percentile(segundos, 50)), 4),
+            "p95": round(float(np.percentile(segundos, 95)), 4),
+            "max": round(float(segundos.max()), 4),
+        }
+
+    def fechar(self):
+        self.sessao.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+# Campos OData de que o pipeline precisa (CAMPOS_GHO e FactValueNumeric), para o $select
+CAMPOS_SELECT_GHO = [*CAMPOS_GHO.values(), "FactValueNumeric"]
+
+
+class ConsultaGHO:
+    # Filtros por países, intervalo de anos e sexo, e projeção dos campos, enviados à API
+    # como $filter/$select para que o servidor devolva só o que o pipeline usa. Os
+    # indicadores sem desagregação por sexo (Dim1 nulo) não são excluídos pelo filtro de
+    # sexo. aceita() aplica os mesmos filtros localmente, caso o servidor os ignore.
+    def __init__(self, paises: list | None = None, ano_inicio: int | None = None, ano_fim: int | None = None,
+                 sexos: list | None = None, campos: list | None = None):
+        self.paises = set(paises) if paises else None
+        self.ano_inicio = ano_inicio
+        self.ano_fim = ano_fim
+        self.sexos = set(sexos) if sexos else None
+        self.campos = campos
+
+    def filtrada(self) -> bool:
+        return bool(self.paises or self.sexos) or self.ano_inicio is not None or self.ano_fim is not None
+
+    def parametros(self) -> dict:
+        def alternativas(campo, valores):
+            return " or ".join(f"{campo} eq '{valor.replace(chr(39), chr(39) * 2)}'" for valor in sorted(valores))
+
+        parametros = {}
+        if self.filtrada():
+            # Com filtros, também os registos sem valor ficam no servidor
+            condicoes = ["(Value ne null or FactValueNumeric ne null)"]
+            if self.paises:
+                condicoes.append(f"({alternativas('SpatialDim', self.paises)})")
+            if self.ano_inicio is not None:
+                condicoes.append(f"TimeDim ge {int(self.ano_inicio)}")
+            if self.ano_fim is not None:
+                condicoes.append(f"TimeDim le {int(self.ano_fim)}")
+            if self.sexos:
+                condicoes.append(f"({alternativas('Dim1', self.sexos)} or Dim1 eq null)")
+            parametros["$filter"] = " and ".join(condicoes)
+        if self.campos:
+            parametros["$select"] = ",".join(self.campos)
+        return parametros
+
+    def aceita(self, registo: dict) -> bool:
+        ano = registo.get("TimeDim")
+        return (
+            (self.paises is None or registo.get("SpatialDim") in self.paises)
+            and (self.ano_inicio is None or (ano is not None and ano >= self.ano_inicio))
+            and (self.ano_fim is None or (ano is not None and ano <= self.ano_fim))
+            and (self.sexos is None or registo.get("Dim1") is None or registo.get("Dim1") in self.sexos)
+        )
+
+    def chave(self) -> str:
+        # Sufixo dos ficheiros da cache local: cada consulta tem a sua entrada
+        parametros = self.parametros()
+        if not parametros:
+            return ""
+        return "-" + hashlib.sha256(json.dumps(parametros, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def registos_para_df(codigo: str, registos: list, consulta: ConsultaGHO | None = None) -> pd.DataFrame:
+    # Adicionar apenas se houver algum valor (Value ou FactValueNumeric)
+    # para evitar linhas completamente vazias para um indicador/ano/país
+    registos = [d for d in registos if d.get("Value") is not None or d.get("FactValueNumeric") is not None]
+    if consulta is not None and consulta.filtrada():
+        registos = [d for d in registos if consulta.aceita(d)]
+
+    # Construção colunar: uma lista por coluna em vez de um dicionário por registo
+    colunas = {"codigo": [codigo] * len(registos)}
+    for coluna, campo in CAMPOS_GHO.items():
+        colunas[coluna] = [d.get(campo) for d in registos]
+    df = pd.DataFrame(colunas)
+    df[COLUNAS_VALOR_WHO] = analisar_valores_who(df["value"])
+    return df[COLUNAS_WHO].astype(TIPOS_WHO)
+
+
+@task
+@instrumentado("extracao", detalhe="codigo")
+def extrair_api_por_codigo(codigo: str, base_url: str = GHO_BASE_URL, cliente: ClienteGHO | None = None,
+                           consulta: ConsultaGHO | None = None) -> pd.DataFrame:
+    url = f"{base_url}/{codigo}"
+    response = (cliente or ClienteGHO()).get(url, params=consulta.parametros() if consulta else None)
+
+    if response.status_code != 200:
+        raise ErroAPIGHO(f"Erro ao consultar API: {codigo} ({response.status_code})")
+    return registos_para_df(codigo, response.json()["value"], consulta)
+
+
+def paginas_api(codigo: str, base_url: str = GHO_BASE_URL, cliente: ClienteGHO | None = None,
+                tamanho_pagina: int = TAMANHO_PAGINA_GHO, consulta: ConsultaGHO | None = None):
+    # Percorre o endpoint OData página a página: segue o @odata.nextLink quando o
+    # servidor o devolve, caso contrário avança com $top/$skip. Só uma página de
+    # registos está em memória de cada vez.
+    cliente = cliente or ClienteGHO()
+    url = f"{base_url}/{codigo}"
+    params = {**(consulta.parametros() if consulta else {}), "$top": tamanho_pagina, "$skip": 0}
+
+    while url:
+        response = cliente.get(url, params=params)
+        if response.status_code != 200:
+            raise ErroAPIGHO(f"Erro ao consultar API: {codigo} ({response.status_code})")
+
+        pagina = response.json()
+        registos = pagina.get("value", [])
+        yield registos
+
+        proximo = pagina.get("@odata.nextLink")
+        if proximo:
+            url, params = proximo, None
+        elif params is not None and len(registos) == tamanho_pagina:
+            params["$skip"] += tamanho_pagina
+        else:
+            url = None
+
+
+@task
+@instrumentado("extracao", detalhe="codigo")
+def extrair_api_em_streaming(codigo: str, escritor: EscritorIntermedio, base_url: str = GHO_BASE_URL,
+                             cliente: ClienteGHO | None = None, tamanho_pagina: int = TAMANHO_PAGINA_GHO,
+                             consulta: ConsultaGHO | None = None) -> int:
+    # Cada página é convertida num bloco colunar e acrescentada diretamente ao
+    # ficheiro de saída, pelo que o pico de memória depende do tamanho da página
+    # e não do tamanho do indicador. Devolve o número de linhas escritas.
+    linhas = 0
+    for registos in paginas_api(codigo, base_url, cliente, tamanho_pagina, consulta):
+        bloco = registos_para_df(codigo, registos, consulta)
+        if bloco.empty:
+            continue
+        escritor.escrever(bloco)
+        linhas += len(bloco)
+    return linhas
+
+
+@task
+@instrumentado("extracao", detalhe="codigo")
+def extrair_api_paginado(codigo: str, base_url: str = GHO_BASE_URL, cliente: ClienteGHO | None = None,
+                         tamanho_pagina: int = TAMANHO_PAGINA_GHO, consulta: ConsultaGHO | None = None) -> pd.DataFrame:
+    # Mesmas páginas de extrair_api_em_streaming, juntadas num DataFrame por indicador
+    blocos = [registos_para_df(codigo, registos, consulta)
+              for registos in paginas_api(codigo, base_url, cliente, tamanho_pagina, consulta)]
+    return pd.concat([bloco for bloco in blocos if not bloco.empty] or blocos[:1], ignore_index=True)
+
+
+def _caminhos_cache(dir_cache: str, codigo: str, sufixo: str = "") -> dict:
+    # Por indicador (e consulta): resposta bruta da API, metadados HTTP e DataFrame já processado
+    return {
+        "bruto": os.path.join(dir_cache, f"{codigo}{sufixo}.json"),
+        "meta": os.path.join(dir_cache, f"{codigo}{sufixo}.meta.json"),
+        "processado": os.path.join(dir_cache, f"{codigo}{sufixo}.pkl"),
+    }
 
 
 @task
-def extrair_api_por_codigo(codigo: str) -> pd.DataFrame:
-    url = f"https://ghoapi.azureedge.net/api/{codigo}"
-    response = requests.get(url)
-
-    if response.status_code == 200:
-        data = response.json()["value"]
-
-        # Lista para armazenar os dicionários de dados
-        dados_para_df = []
-        for d in data:
-            # Adicionar "FactValueNumeric" à lista de campos extraídos
-            # e também garantir que outras colunas relevantes sejam incluídas
-            record = {
-                "codigo": codigo,
-                "country": d.get("SpatialDim"),
-                "year": d.get("TimeDim"),
-                "sex": d.get("Dim1"),
-                "dim2": d.get("Dim2"),  # Manter outras colunas que possam ser úteis
-                "dim3": d.get("Dim3"),  # Manter outras colunas que possam ser úteis
-                "value_type": d.get("ValueType"),  # Manter outras colunas que possam ser úteis
-                "source": d.get("DataSourceDim"),  # Manter outras colunas que possam ser úteis
-                "value": d.get("Value"),  # Coluna original com o texto
-            }
-            # Adicionar apenas se houver algum valor (Value ou FactValueNumeric)
-            # para evitar linhas completamente vazias para um indicador/ano/país
-            if d.get("Value") is not None or d.get("FactValueNumeric") is not None:
-                dados_para_df.append(record)
-
-        return pd.DataFrame(dados_para_df)
+@instrumentado("extracao", detalhe="codigo")
+def extrair_api_com_cache(codigo: str, dir_cache: str = DIR_CACHE_GHO, base_url: str = GHO_BASE_URL,
+                          cliente: ClienteGHO | None = None, apenas_novos: bool = False,
+                          consulta: ConsultaGHO | None = None) -> tuple:
+    # Devolve (DataFrame, alterado). Com cache presente, o pedido é condicional
+    # (If-None-Match / If-Modified-Since): um 304 reutiliza o DataFrame guardado sem
+    # voltar a descarregar nem processar o indicador. Com apenas_novos=True pedem-se
+    # só os registos com TimeDim posterior ao último ano já guardado localmente.
+    # Se a API falhar, usa-se a cache; sem cache, ErroAPIGHO.
+    cliente = cliente or ClienteGHO()
+    consulta = consulta or ConsultaGHO()
+    os.makedirs(dir_cache, exist_ok=True)
+    caminhos = _caminhos_cache(dir_cache, codigo, consulta.chave())
+    url = f"{base_url}/{codigo}"
+    params = consulta.parametros()
+
+    em_cache = os.path.exists(caminhos["processado"]) and os.path.exists(caminhos["bruto"])
+    meta = {}
+    if em_cache and os.path.exists(caminhos["meta"]):
+        with open(caminhos["meta"], encoding="utf-8") as f:
+            meta = json.load(f)
+    df_cache = completar_valores_who(pd.read_pickle(caminhos["processado"])) if em_cache else None
+
+    # Extração delta: só registos mais recentes do que os que já temos
+    if apenas_novos and df_cache is not None and not df_cache.empty:
+        ultimo_ano = pd.to_numeric(df_cache["year"], errors="coerce").max()
+        filtro = f"TimeDim gt {int(ultimo_ano)}"
+        if "$filter" in params:
+            filtro = f"{params['$filter']} and {filtro}"
+        try:
+            response = cliente.get(url, params={**params, "$filter": filtro})
+        except ErroAPIGHO as e:
+            print(f" Erro ao consultar API: {e} - a usar cache local")
+            return df_cache, False
+        if response.status_code != 200:
+            print(f" Erro ao consultar API: {codigo} ({response.status_code}) - a usar cache local")
+            return df_cache, False
+
+        # Salvaguarda caso o servidor ignore o $filter
+        novos = [d for d in response.json()["value"] if (d.get("TimeDim") or 0) > ultimo_ano]
+        df_novos = registos_para_df(codigo, novos, consulta)
+        if df_novos.empty:
+            return df_cache, False
+
+        with open(caminhos["bruto"], encoding="utf-8") as f:
+            bruto = json.load(f)
+        bruto["value"].extend(novos)
+        with open(caminhos["bruto"], "w", encoding="utf-8") as f:
+            json.dump(bruto, f)
+
+        df_final = pd.concat([df_cache, df_novos], ignore_index=True)
+        df_final.to_pickle(caminhos["processado"])
+        return df_final, True
+
+    cabecalhos = {}
+    if em_cache:
+        if meta.get("etag"):
+            cabecalhos["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            cabecalhos["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = cliente.get(url, params=params or None, headers=cabecalhos)
+    except ErroAPIGHO as e:
+        if not em_cache:
+            raise
+        print(f" Erro ao consultar API: {e} - a usar cache local")
+        return df_cache, False
+
+    if response.status_code == 304 and em_cache:
+        return df_cache, False
+
+    if response.status_code != 200:
+        if not em_cache:
+            raise ErroAPIGHO(f"Erro ao consultar API: {codigo} ({response.status_code})")
+        print(f" Erro ao consultar API: {codigo} ({response.status_code}) - a usar cache local")
+        return df_cache, False
+
+    with open(caminhos["bruto"], "wb") as f:
+        f.write(response.content)
+    with open(caminhos["meta"], "w", encoding="utf-8") as f:
+        json.dump({
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }, f)
+
+    df_codigo = registos_para_df(codigo, response.json()["value"], consulta)
+    df_codigo.to_pickle(caminhos["processado"])
+    return df_codigo, True
+
+
+def extrair_indicadores(extrair, codigos: list, concorrencia: int = 1) -> tuple:
+    # extrair(codigo) para todos os códigos, num pool de threads limitado se concorrencia > 1.
+    # executor.map preserva a ordem dos códigos, por isso o CSV final é idêntico ao da
+    # execução sequencial. Um indicador que falhe não impede os restantes: devolve
+    # ({codigo: resultado}, {codigo: erro}).
+    def tentar(codigo):
+        try:
+            return extrair(codigo), None
+        except ErroAPIGHO as e:
+            return None, e
+
+    if concorrencia > 1:
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            pares = list(executor.map(tentar, codigos))
     else:
-        print(f" Erro ao consultar API: {codigo} ({response.status_code})")
-        return pd.DataFrame()
+        pares = [tentar(codigo) for codigo in codigos]
+    resultados = {codigo: resultado for codigo, (resultado, erro) in zip(codigos, pares) if erro is None}
+    falhas = {codigo: erro for codigo, (_, erro) in zip(codigos, pares) if erro is not None}
+    return resultados, falhas
 
-@flow
-def fluxo_extracao_todos_codigos():
-    codigos = [
-        "WHOSIS_000015", "MH_1", "MH_3", "MH_6", "MH_7", "MH_9", "MH_16", "MH_19"
-    ]
 
-    dfs_api = []
-    for codigo in codigos:
-        df_codigo = extrair_api_por_codigo(codigo)
-        if not df_codigo.empty:
-            dfs_api.append(df_codigo)
+def verificar_falhas_extracao(falhas: dict):
+    # Nenhum indicador é descartado em silêncio: com falhas, todos_dados_who não é
+    # atualizado e a extração termina em erro
+    if falhas:
+        for codigo, erro in falhas.items():
+            print(f" {codigo}: {erro}")
+        raise ErroAPIGHO(f"{len(falhas)} indicadores não extraídos ({', '.join(falhas)}); "
+                         f"todos_dados_who não foi atualizado")
+
+
+@flow
+def fluxo_extracao_todos_codigos(concorrencia: int = 1, base_url: str = GHO_BASE_URL, streaming: bool = False,
+                                 tamanho_pagina: int = TAMANHO_PAGINA_GHO, dir_cache: str | None = None,
+                                 apenas_novos: bool = False, timeout: float | None = None,
+                                 tentativas: int = TENTATIVAS_GHO, pedidos_por_segundo: float | None = None,
+                                 paises: list[str] | None = None, ano_inicio: int | None = None,
+                                 ano_fim: int | None = None, sexos: list[str] | None = None, projecao: bool = False):
+    codigos = apis_who
+    # Filtros e projeção resolvidos no servidor (ver ConsultaGHO)
+    consulta = ConsultaGHO(paises, ano_inicio, ano_fim, sexos, CAMPOS_SELECT_GHO if projecao else None)
+    # Um só cliente (e pool de ligações) para todos os pedidos; .fn nas tarefas: o cliente
+    # e o escritor não são serializáveis para a cache de inputs do Prefect
+    cliente = ClienteGHO(max(concorrencia, 1), timeout or TIMEOUT_GHO, tentativas, pedidos_por_segundo)
+    try:
+        _extrair_todos_codigos(cliente, codigos, concorrencia, base_url, streaming, tamanho_pagina,
+                               dir_cache, apenas_novos, consulta)
+        return cliente.resumo()
+    finally:
+        cliente.fechar()
+        imprimir_resumo_api(cliente)
+
+
+def imprimir_resumo_api(cliente: ClienteGHO):
+    resumo = cliente.resumo()
+    if resumo["pedidos"]:
+        print(f" Pedidos à API: {resumo['pedidos']} ({resumo['repeticoes']} repetidos, "
+              f"{resumo['bytes'] / 1e6:.2f} MB), latência p50 {resumo['p50']:.3f} s, "
+              f"p95 {resumo['p95']:.3f} s, máx. {resumo['max']:.3f} s")
+
+
+def _extrair_todos_codigos(cliente: ClienteGHO, codigos: list, concorrencia: int, base_url: str, streaming: bool,
+                           tamanho_pagina: int, dir_cache: str | None, apenas_novos: bool,
+                           consulta: ConsultaGHO | None = None):
+    # Modo incremental: pedidos condicionais contra a cache local. Se nenhum
+    # indicador mudou e o CSV final já existe, não é reescrito.
+    if dir_cache:
+        resultados, falhas = extrair_indicadores(
+            lambda codigo: extrair_api_com_cache.fn(codigo, dir_cache, base_url, cliente, apenas_novos, consulta),
+            codigos, concorrencia,
+        )
+        verificar_falhas_extracao(falhas)
+
+        alterados = [codigo for codigo, (_, alterado) in resultados.items() if alterado]
+        if not alterados and existe_intermedio("todos_dados_who"):
+            print(" Dados da WHO inalterados desde a última extração.")
+            return
+
+        dfs_api = [df_codigo for df_codigo, _ in resultados.values() if not df_codigo.empty]
+        if dfs_api:
+            guardar_intermedio(pd.concat(dfs_api, ignore_index=True), "todos_dados_who")
+            print(f" Dados da WHO atualizados ({len(alterados)} indicadores alterados).")
+        else:
+            print(" Nenhum dado extraído.")
+        return
+
+    # Modo streaming: os indicadores são paginados e escritos bloco a bloco para um
+    # ficheiro temporário, substituído no fim (e só se todos foram extraídos) para
+    # nunca deixar um ficheiro incompleto
+    if streaming:
+        destino = caminho_intermedio("todos_dados_who")
+        with EscritorIntermedio(destino + ".tmp") as escritor:
+            _, falhas = extrair_indicadores(
+                lambda codigo: extrair_api_em_streaming.fn(codigo, escritor, base_url, cliente, tamanho_pagina,
+                                                           consulta),
+                codigos,
+            )
+        if falhas and os.path.exists(escritor.caminho):
+            os.remove(escritor.caminho)
+        verificar_falhas_extracao(falhas)
+
+        if escritor.linhas:
+            os.replace(escritor.caminho, destino)
+            print(" Todos os dados da WHO foram extraídos e salvos.")
+        else:
+            print(" Nenhum dado extraído.")
+        return
+
+    # Modo concorrente (ou sequencial com concorrencia=1): os códigos são distribuídos
+    # por um pool de threads limitado que partilha o cliente HTTP
+    resultados, falhas = extrair_indicadores(
+        lambda codigo: extrair_api_por_codigo.fn(codigo, base_url, cliente, consulta), codigos, concorrencia
+    )
+    verificar_falhas_extracao(falhas)
+
+    dfs_api = [df_codigo for df_codigo in resultados.values() if not df_codigo.empty]
 
     if dfs_api:
-        df_final = pd.concat(dfs_api)
-        df_final.to_csv("todos_dados_who.csv", index=False)
+        df_final = pd.concat(dfs_api, ignore_index=True)
+        guardar_intermedio(df_final, "todos_dados_who")
         print(" Todos os dados da WHO foram extraídos e salvos.")
     else:
         print(" Nenhum dado extraído.")
 
 
-if __name__ == "__main__":
-    fluxo_extracao_todos_codigos()
+# Armazém local indexado dos dados da WHO (--armazem-who): uma tabela SQLite ordenada e
+# indexada por (codigo, country, year), para consultas pontuais, por intervalo de anos e
+# do último valor de cada país sem voltar a ler e percorrer a extração inteira
+ARMAZEM_WHO = "who_indicadores.sqlite"
+TIPOS_SQL_WHO = {"year": "INTEGER", "value_num": "REAL", "value_low": "REAL", "value_high": "REAL",
+                 "value_bool": "INTEGER"}
+
+
+class ArmazemWHO:
+    def __init__(self, caminho: str = ARMAZEM_WHO):
+        self.caminho = caminho
+
+    def construir(self, df_who: pd.DataFrame, origem: str | None = None) -> int:
+        # Escrito num ficheiro temporário e substituído de uma vez: quem estiver a consultar
+        # nunca vê um armazém a meio. origem (o ficheiro extraído) fica registada para
+        # saber se o armazém está atualizado. Devolve as linhas guardadas.
+        import sqlite3
+
+        df_who = completar_valores_who(df_who)[COLUNAS_WHO].astype(TIPOS_WHO)
+        df_who = df_who.sort_values(["codigo", "country", "year"], kind="stable")
+        temporario = self.caminho + ".tmp"
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+        conn = sqlite3.connect(temporario)
+        try:
+            colunas = ", ".join(f"{coluna} {TIPOS_SQL_WHO.get(coluna, 'TEXT')}" for coluna in COLUNAS_WHO)
+            conn.execute(f"CREATE TABLE indicadores ({colunas})")
+            query = f"INSERT INTO indicadores VALUES ({','.join(['?'] * len(COLUNAS_WHO))})"
+            for _, lote in lotes_parametros(preparar_para_carga(df_who), 10_000):
+                conn.executemany(query, lote)
+            conn.execute("CREATE INDEX ix_indicadores ON indicadores (codigo, country, year)")
+            conn.execute("CREATE TABLE origem (tamanho INTEGER, mtime_ns INTEGER)")
+            if origem:
+                estado = os.stat(origem)
+                conn.execute("INSERT INTO origem VALUES (?, ?)", (estado.st_size, estado.st_mtime_ns))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(temporario, self.caminho)
+        return len(df_who)
+
+    def atualizado(self, origem: str) -> bool:
+        if not os.path.exists(self.caminho) or not os.path.exists(origem):
+            return False
+        estado = os.stat(origem)
+        registo = self._consultar("SELECT tamanho, mtime_ns FROM origem", tipar=False)
+        return not registo.empty and tuple(registo.iloc[0]) == (estado.st_size, estado.st_mtime_ns)
+
+    def construir_de_intermedio(self, nome: str = "todos_dados_who") -> bool:
+        # Reconstrói só se o ficheiro extraído mudou desde a última vez; devolve se reconstruiu
+        _, origem = caminho_leitura(nome)
+        if self.atualizado(origem):
+            return False
+        linhas = self.construir(ler_intermedio(nome), origem)
+        print(f" Armazém dos dados da WHO atualizado em '{self.caminho}' ({linhas} linhas).")
+        return True
+
+    def _consultar(self, sql: str, parametros=(), tipar: bool = True) -> pd.DataFrame:
+        import sqlite3
+
+        # Só leitura: várias consultas (threads, processos) podem correr em simultâneo
+        conn = sqlite3.connect(f"file:{self.caminho}?mode=ro", uri=True)
+        try:
+            df = pd.read_sql_query(sql, conn, params=list(parametros))
+        finally:
+            conn.close()
+        if not tipar:
+            return df
+        return df.astype({coluna: TIPOS_WHO[coluna] for coluna in df.columns if coluna in TIPOS_WHO})
+
+    @staticmethod
+    def _filtros(paises=None, ano_inicio=None, ano_fim=None, sexo=None, prefixo="") -> tuple:
+        # Condições SQL extra e respetivos parâmetros; sem desagregação por sexo (NULL) mantém-se
+        condicoes, parametros = [], []
+        if paises:
+            condicoes.append(f"{prefixo}country IN ({','.join(['?'] * len(paises))})")
+            parametros += list(paises)
+        if ano_inicio is not None:
+            condicoes.append(f"{prefixo}year >= ?")
+            parametros.append(int(ano_inicio))
+        if ano_fim is not None:
+            condicoes.append(f"{prefixo}year <= ?")
+            parametros.append(int(ano_fim))
+        if sexo is not None:
+            condicoes.append(f"({prefixo}sex = ? OR {prefixo}sex IS NULL)")
+            parametros.append(sexo)
+        return "".join(f" AND {condicao}" for condicao in condicoes), parametros
+
+    def valor(self, codigo: str, country: str, year: int, sexo: str | None = None) -> pd.DataFrame:
+        # Consulta pontual: os registos de um indicador num país e ano (um por sexo)
+        condicoes, parametros = self._filtros(sexo=sexo)
+        return self._consultar(
+            f"SELECT * FROM indicadores WHERE codigo = ? AND country = ? AND year = ?{condicoes}",
+            [codigo, country, int(year), *parametros],
+        )
+
+    def serie(self, codigo: str, country: str, ano_inicio: int | None = None, ano_fim: int | None = None,
+              sexo: str | None = None) -> pd.DataFrame:
+        # Evolução de um indicador num país, por ordem de ano, opcionalmente num intervalo
+        condicoes, parametros = self._filtros(ano_inicio=ano_inicio, ano_fim=ano_fim, sexo=sexo)
+        return self._consultar(
+            f"SELECT * FROM indicadores WHERE codigo = ? AND country = ?{condicoes} ORDER BY year",
+            [codigo, country, *parametros],
+        )
+
+    def ultimo_por_pais(self, codigo: str, paises: list | None = None, sexo: str | None = None) -> pd.DataFrame:
+        # Registos do ano mais recente de cada país
+        condicoes, parametros = self._filtros(paises=paises, sexo=sexo)
+        condicoes_sexo, parametros_sexo = self._filtros(sexo=sexo, prefixo="i.")
+        return self._consultar(
+            f"SELECT i.* FROM indicadores i JOIN ("
+            f"SELECT country, MAX(year) AS year FROM indicadores WHERE codigo = ?{condicoes} GROUP BY country"
+            f") u ON i.country = u.country AND i.year = u.year "
+            f"WHERE i.codigo = ?{condicoes_sexo} ORDER BY i.country",
+            [codigo, *parametros, codigo, *parametros_sexo],
+        )
+
+    def medias_pais_ano(self, codigos: list, paises: list | None = None, ano_inicio: int | None = None,
+                        ano_fim: int | None = None) -> pd.DataFrame:
+        # Tabela país × ano com a média de value_num de cada indicador numa coluna
+        condicoes, parametros = self._filtros(paises, ano_inicio, ano_fim)
+        medias = self._consultar(
+            f"SELECT country, year, codigo, AVG(value_num) AS value_num FROM indicadores "
+            f"WHERE codigo IN ({','.join(['?'] * len(codigos))}){condicoes} GROUP BY codigo, country, year",
+            [*codigos, *parametros],
+        )
+        tabela = medias.pivot_table(index=["country", "year"], columns="codigo", values="value_num",
+                                    observed=True).reset_index()
+        tabela.columns.name = None
+        return tabela
+
+
+def executar_entregavel_1(concorrencia: int = 1, streaming: bool = False, dir_cache: str | None = None,
+                          apenas_novos: bool = False, timeout: float | None = None,
+                          tentativas: int = TENTATIVAS_GHO, pedidos_por_segundo: float | None = None,
+                          paises: list[str] | None = None, ano_inicio: int | None = None,
+                          ano_fim: int | None = None, sexos: list[str] | None = None, projecao: bool = False,
+                          armazem: str | None = None):
+    # Com armazem, o armazém indexado dos dados da WHO é atualizado depois da extração
+    inspecionar_csv_original()
+    fluxo_extracao_todos_codigos(
+        concorrencia=concorrencia,
+        streaming=streaming,
+        dir_cache=dir_cache,
+        apenas_novos=apenas_novos,
+        timeout=timeout,
+        tentativas=tentativas,
+        pedidos_por_segundo=pedidos_por_segundo,
+        paises=paises,
+        ano_inicio=ano_inicio,
+        ano_fim=ano_fim,
+        sexos=sexos,
+        projecao=projecao,
+    )
+    if armazem:
+        ArmazemWHO(armazem).construir_de_intermedio()
 
 ##########################################################################################################################
 ##########################################################################################################################
@@ -105,436 +1159,1136 @@ if __name__ == "__main__":
 ##########################################################################################################################
 ##########################################################################################################################
 
-# 0. Carregar corretamente o CSV
-df = pd.read_csv("Impact_of_Remote_Work_on_Mental_Health.csv", na_values=[], keep_default_na=False)
+# Esquema compacto do inquérito: categóricos nas colunas de baixa cardinalidade,
+# inteiros pequenos nas classificações de 1 a 5 e nas restantes colunas inteiras.
+# As colunas normalizadas (criadas em transformar_inquerito) ficam em float32.
+COLUNAS_CATEGORICAS_INQUERITO = [
+    "Gender", "Job_Role", "Industry", "Work_Location", "Stress_Level",
+    "Mental_Health_Condition", "Access_to_Mental_Health_Resources", "Productivity_Change",
+    "Satisfaction_with_Remote_Work", "Physical_Activity", "Sleep_Quality", "Region",
+]
+COLUNAS_CLASSIFICACAO_INQUERITO = [
+    "Work_Life_Balance_Rating", "Social_Isolation_Rating", "Company_Support_for_Remote_Work",
+]
+ESQUEMA_INQUERITO = {
+    **{coluna: "category" for coluna in COLUNAS_CATEGORICAS_INQUERITO},
+    **{coluna: "int8" for coluna in COLUNAS_CLASSIFICACAO_INQUERITO},
+    "Age": "int8",
+    "Years_of_Experience": "int8",
+    "Hours_Worked_Per_Week": "int16",
+    "Number_of_Virtual_Meetings": "int16",
+}
 
-# Dados da API OMS (já extraídos anteriormente)
-df_api = pd.read_csv("dados_suicidio_api.csv")
 
-###################################################### Limpeza dos dados ######################################################
+def _memoria_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
 
-# 1. Verificar os tipos de dados
-print(" Tipos de dados por coluna:")
-print(df.dtypes)
-print("\n")
-
-# 2. Verificar valores nulos
-print(" Quantidade de valores nulos por coluna:")
-print(df.isnull().sum())
-print("\n")
-
-# 3. Verificar duplicados
-duplicados = df.duplicated().sum()
-print(f" Número total de registos duplicados: {duplicados}")
-print("\n")
-
-# 4. Verificar valores únicos por coluna
-print(" Número de valores únicos por coluna:")
-print(df.nunique())
-print("\n")
-
-# 5. Estatísticas descritivas das colunas numéricas e categóricas
-print(" Estatísticas descritivas gerais:")
-print(df.describe(include='all'))
-print("\n")
-
-# 6. Verificar valores infinitos nas colunas numéricas
-valores_infinitos = np.isinf(df.select_dtypes(include=[np.number])).sum()
-print(" Quantidade de valores infinitos por coluna numérica:")
-print(valores_infinitos)
-print("\n")
-
-# 7. Verificar valores negativos em colunas numéricas
-valores_negativos = (df.select_dtypes(include=[np.number]) < 0).sum()
-print(" Quantidade de valores negativos por coluna numérica:")
-print(valores_negativos)
-print("\n")
 
-############################### Transformar os dados ###############################
+@instrumentado("inquerito:leitura")
+def carregar_inquerito(caminho: str = CSV_INQUERITO, relatorio_memoria: bool = False) -> pd.DataFrame:
+    # 0. Carregar corretamente o CSV, já com os tipos compactos
+    df = pd.read_csv(caminho, na_values=[], keep_default_na=False, dtype=ESQUEMA_INQUERITO)
 
-# 8. Substituir "None" por valores descritivos nas colunas indicadas
-df["Mental_Health_Condition"] = df["Mental_Health_Condition"].replace("None", "Nenhuma")
-df["Physical_Activity"] = df["Physical_Activity"].replace("None", "Não faz")
+    # Comparação com a leitura por omissão (object/int64); obriga a ler o CSV duas vezes
+    if relatorio_memoria:
+        antes = _memoria_mb(pd.read_csv(caminho, na_values=[], keep_default_na=False))
+        depois = _memoria_mb(df)
+        print(f" Memória do inquérito: {antes:.2f} MB (tipos por omissão) → {depois:.2f} MB "
+              f"(esquema compacto), {antes / depois:.1f}x menos")
+    return df
 
-# 9. Confirmar substituições únicas
-print(" Valores únicos em 'Mental_Health_Condition':")
-print(df["Mental_Health_Condition"].unique())
-print("\n")
 
-print(" Valores únicos em 'Physical_Activity':")
-print(df["Physical_Activity"].unique())
-print("\n")
+def renomear_categoria(serie: pd.Series, antigo: str, novo: str) -> pd.Series:
+    # Substituição de um valor feita sobre as categorias (não linha a linha); se a
+    # coluna não for categórica, recorre ao replace normal
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.replace(antigo, novo)
+    if antigo not in serie.cat.categories:
+        return serie
+    if novo in serie.cat.categories:
+        return serie.where(serie != antigo, novo).cat.remove_unused_categories()
+    return serie.cat.rename_categories({antigo: novo})
 
-############################### Normalizar os dados ###############################
+###################################################### Limpeza dos dados ######################################################
+
+@instrumentado("inquerito:diagnostico")
+def diagnosticar_inquerito(df: pd.DataFrame):
+    # 1. Verificar os tipos de dados
+    print(" Tipos de dados por coluna:")
+    print(df.dtypes)
+    print("\n")
+
+    # 2. Verificar valores nulos
+    print(" Quantidade de valores nulos por coluna:")
+    print(df.isnull().sum())
+    print("\n")
+
+    # 3. Verificar duplicados
+    duplicados = df.duplicated().sum()
+    print(f" Número total de registos duplicados: {duplicados}")
+    print("\n")
+
+    # 4. Verificar valores únicos por coluna
+    print(" Número de valores únicos por coluna:")
+    print(df.nunique())
+    print("\n")
+
+    # 5. Estatísticas descritivas das colunas numéricas e categóricas
+    print(" Estatísticas descritivas gerais:")
+    print(df.describe(include='all'))
+    print("\n")
+
+    # 6. Verificar valores infinitos nas colunas numéricas
+    valores_infinitos = np.isinf(df.select_dtypes(include=[np.number])).sum()
+    print(" Quantidade de valores infinitos por coluna numérica:")
+    print(valores_infinitos)
+    print("\n")
+
+    # 7. Verificar valores negativos em colunas numéricas
+    valores_negativos = (df.select_dtypes(include=[np.number]) < 0).sum()
+    print(" Quantidade de valores negativos por coluna numérica:")
+    print(valores_negativos)
+    print("\n")
+
+############################### Transformar os dados ###############################
 
-df["Work_Life_Balance_Norm"] = df["Work_Life_Balance_Rating"] / 5
-df["Social_Isolation_Norm"] = df["Social_Isolation_Rating"] / 5
-df["Company_Support_Norm"] = df["Company_Support_for_Remote_Work"] / 5
+def limpar_e_normalizar(df: pd.DataFrame) -> pd.DataFrame:
+    # Passos linha a linha da transformação (sem prints), usados tanto no inquérito
+    # completo como em cada bloco do modo em blocos
+
+    # 8. Substituir "None" por valores descritivos nas colunas indicadas
+    df["Mental_Health_Condition"] = renomear_categoria(df["Mental_Health_Condition"], "None", "Nenhuma")
+    df["Physical_Activity"] = renomear_categoria(df["Physical_Activity"], "None", "Não faz")
+
+    ############################### Normalizar os dados ###############################
+
+    df["Work_Life_Balance_Norm"] = (df["Work_Life_Balance_Rating"] / 5).astype("float32")
+    df["Social_Isolation_Norm"] = (df["Social_Isolation_Rating"] / 5).astype("float32")
+    df["Company_Support_Norm"] = (df["Company_Support_for_Remote_Work"] / 5).astype("float32")
+    return df
+
+
+@instrumentado("inquerito:limpeza")
+def transformar_inquerito(df: pd.DataFrame) -> pd.DataFrame:
+    # Altera o DataFrame recebido e devolve-o para encadear as etapas
+    df = limpar_e_normalizar(df)
+
+    # 9. Confirmar substituições únicas (só com --verboso)
+    if VERBOSO:
+        print(" Valores únicos em 'Mental_Health_Condition':")
+        print(df["Mental_Health_Condition"].unique())
+        print("\n")
+
+        print(" Valores únicos em 'Physical_Activity':")
+        print(df["Physical_Activity"].unique())
+        print("\n")
+    return df
+
+
+def ler_inquerito_em_blocos(caminho: str = CSV_INQUERITO, tamanho_bloco: int = 100_000):
+    # Lê o inquérito aos blocos, com o mesmo esquema compacto da leitura completa.
+    # As categorias de cada bloco são só as que nele aparecem.
+    with pd.read_csv(caminho, na_values=[], keep_default_na=False, dtype=ESQUEMA_INQUERITO,
+                     chunksize=tamanho_bloco) as leitor:
+        yield from leitor
+
+
+def indice_bem_estar(df: pd.DataFrame) -> pd.Series:
+    # Índice composto de bem-estar (Mental_Wellness_Index)
+    return (df["Work_Life_Balance_Norm"] +
+            (1 - df["Social_Isolation_Norm"]) +
+                df["Company_Support_Norm"]) / 3
+
+
+class AgregadosInquerito:
+    # Somas e contagens parciais do inquérito, por região e por indústria × região × condição,
+    # e co-momentos dos fatores de bem-estar por região. Calculados bloco a bloco e
+    # combináveis entre si, dão no fim as mesmas médias, frequências e correlações que
+    # calcular_metricas/tabela_profissionais_it sobre o inquérito completo.
+    # Por região só se somam as classificações inteiras, exatas seja qual for a divisão
+    # das linhas; as médias das colunas normalizadas e do índice são derivadas delas.
+    COLUNAS_REGIAO = [
+        "Company_Support_for_Remote_Work",
+        "Work_Life_Balance_Rating",
+        "Social_Isolation_Rating",
+    ]
+    CHAVES_PROF_IT = ["Industry", "Region", "Mental_Health_Condition"]
+    COLUNAS_PROF_IT = {
+        "Company_Support_for_Remote_Work": "Avg_Company_Support",
+        "Work_Life_Balance_Rating": "Avg_Work_Life_Balance",
+        "Social_Isolation_Rating": "Avg_Social_Isolation",
+    }
+    COLUNAS_CORRELACAO = ["Work_Life_Balance_Norm", "Social_Isolation_Norm", "Company_Support_Norm"]
+
+    def __init__(self):
+        self.por_regiao = None
+        self.por_prof_it = None
+        self.condicoes = pd.Series(dtype="int64")
+        # Região -> (linhas, médias, matriz de co-momentos centrados) de COLUNAS_CORRELACAO
+        self.comomentos = {}
+        self.linhas = 0
+
+    @staticmethod
+    def _somas_contagens(df: pd.DataFrame, chaves: list, colunas: list) -> pd.DataFrame:
+        # Somas em float64 (as colunas normalizadas são float32). As chaves passam a texto
+        # só depois de agrupar, para que blocos com categorias diferentes se alinhem ao combinar
+        valores = df[colunas].astype("float64")
+        parcial = valores.groupby([df[chave] for chave in chaves], observed=True).agg(["sum", "count"])
+        parcial = parcial.reset_index()
+        parcial[chaves] = parcial[chaves].astype(object)
+        return parcial.set_index(chaves)
+
+    @classmethod
+    def _comomentos_bloco(cls, df: pd.DataFrame) -> dict:
+        comomentos = {}
+        for regiao, grupo in df.groupby("Region", observed=True)[cls.COLUNAS_CORRELACAO]:
+            valores = grupo.to_numpy("float64")
+            media = valores.mean(axis=0)
+            centrados = valores - media
+            comomentos[str(regiao)] = (len(valores), media, centrados.T @ centrados)
+        return comomentos
+
+    @staticmethod
+    def _juntar_comomentos(atual: dict, novo: dict) -> dict:
+        # Combinação de Chan et al.: os co-momentos são centrados em cada parte e corrigidos
+        # pela diferença das médias, sem as somas de produtos que perdem precisão
+        for regiao, (n_novo, media_nova, c_novo) in novo.items():
+            if regiao not in atual:
+                atual[regiao] = (n_novo, media_nova, c_novo)
+                continue
+            n_atual, media_atual, c_atual = atual[regiao]
+            n = n_atual + n_novo
+            delta = media_nova - media_atual
+            atual[regiao] = (n, media_atual + delta * n_novo / n,
+                             c_atual + c_novo + np.outer(delta, delta) * n_atual * n_novo / n)
+        return atual
+
+    @staticmethod
+    def _juntar(atual, novo):
+        return novo if atual is None else atual.add(novo, fill_value=0)
+
+    def atualizar(self, bloco: pd.DataFrame):
+        # O bloco tem de estar já normalizado (as correlações usam as colunas *_Norm)
+        self.por_regiao = self._juntar(self.por_regiao, self._somas_contagens(bloco, ["Region"], self.COLUNAS_REGIAO))
+
+        # Mesmo critério de tabela_profissionais_it
+        estatico = bloco[bloco["Mental_Health_Condition"] != "Nenhuma"]
+        estatico = estatico.assign(Region=renomear_categoria(estatico["Region"], "", "Desconhecida"))
+        self.por_prof_it = self._juntar(
+            self.por_prof_it, self._somas_contagens(estatico, self.CHAVES_PROF_IT, list(self.COLUNAS_PROF_IT)))
+
+        contagens = bloco["Mental_Health_Condition"].astype(object).value_counts()
+        self.condicoes = self.condicoes.add(contagens, fill_value=0).astype("int64")
+        self.comomentos = self._juntar_comomentos(self.comomentos, self._comomentos_bloco(bloco))
+        self.linhas += len(bloco)
+        return self
+
+    def combinar(self, outro: "AgregadosInquerito"):
+        # Junta os parciais de outro conjunto de blocos (p.ex. outro ficheiro ou processo)
+        self.por_regiao = self._juntar(self.por_regiao, outro.por_regiao)
+        self.por_prof_it = self._juntar(self.por_prof_it, outro.por_prof_it)
+        self.condicoes = self.condicoes.add(outro.condicoes, fill_value=0).astype("int64")
+        self.comomentos = self._juntar_comomentos(self.comomentos, outro.comomentos)
+        self.linhas += outro.linhas
+        return self
+
+    @staticmethod
+    def _parcial_para_json(parcial: pd.DataFrame | None):
+        if parcial is None:
+            return None
+        return {
+            "chaves": list(parcial.index.names),
+            "indice": parcial.index.tolist(),
+            "colunas": parcial.columns.tolist(),
+            "valores": parcial.to_numpy("float64").tolist(),
+        }
+
+    @staticmethod
+    def _parcial_de_json(dados: dict | None) -> pd.DataFrame | None:
+        if dados is None:
+            return None
+        if len(dados["chaves"]) > 1:
+            indice = pd.MultiIndex.from_tuples([tuple(chave) for chave in dados["indice"]], names=dados["chaves"])
+        else:
+            indice = pd.Index(dados["indice"], dtype=object, name=dados["chaves"][0])
+        colunas = pd.MultiIndex.from_tuples([tuple(coluna) for coluna in dados["colunas"]])
+        return pd.DataFrame(dados["valores"], index=indice, columns=colunas)
+
+    def para_json(self) -> dict:
+        # Os floats são escritos com repr, por isso voltam exatamente iguais
+        return {
+            "linhas": self.linhas,
+            "por_regiao": self._parcial_para_json(self.por_regiao),
+            "por_prof_it": self._parcial_para_json(self.por_prof_it),
+            "condicoes": {condicao: int(n) for condicao, n in self.condicoes.items()},
+            "comomentos": {regiao: [n, media.tolist(), c.tolist()]
+                           for regiao, (n, media, c) in self.comomentos.items()},
+        }
+
+    @classmethod
+    def de_json(cls, dados: dict) -> "AgregadosInquerito":
+        agregados = cls()
+        agregados.linhas = dados["linhas"]
+        agregados.por_regiao = cls._parcial_de_json(dados["por_regiao"])
+        agregados.por_prof_it = cls._parcial_de_json(dados["por_prof_it"])
+        agregados.condicoes = pd.Series(dados["condicoes"], dtype="int64")
+        agregados.comomentos = {regiao: (n, np.array(media), np.array(c))
+                                for regiao, (n, media, c) in dados["comomentos"].items()}
+        return agregados
+
+    @staticmethod
+    def _medias(parcial: pd.DataFrame) -> pd.DataFrame:
+        medias = parcial.xs("sum", axis=1, level=1) / parcial.xs("count", axis=1, level=1)
+        return medias.sort_index()
+
+    def correlacoes(self) -> pd.DataFrame:
+        # Correlação de Pearson de todo o inquérito, a partir dos co-momentos das regiões
+        total = {}
+        for regiao in sorted(self.comomentos):
+            self._juntar_comomentos(total, {"": self.comomentos[regiao]})
+        _, _, c = total[""]
+        desvios = np.sqrt(np.diag(c))
+        return pd.DataFrame(c / np.outer(desvios, desvios), index=self.COLUNAS_CORRELACAO,
+                            columns=self.COLUNAS_CORRELACAO).round(2)
+
+    def resultados(self) -> dict:
+        medias_regiao = self._medias(self.por_regiao)
+        # Mesmas fórmulas de limpar_e_normalizar e indice_bem_estar, sobre as médias
+        normalizadas = pd.DataFrame({
+            "Work_Life_Balance_Norm": medias_regiao["Work_Life_Balance_Rating"] / 5,
+            "Social_Isolation_Norm": medias_regiao["Social_Isolation_Rating"] / 5,
+            "Company_Support_Norm": medias_regiao["Company_Support_for_Remote_Work"] / 5,
+        })
+        normalizadas["Mental_Wellness_Index"] = indice_bem_estar(normalizadas)
+
+        cond_freq = (self.condicoes / self.condicoes.sum()).sort_values(ascending=False).round(3) * 100
+        cond_freq.index.name = "Mental_Health_Condition"
+        cond_freq.name = "proportion"
+
+        prof_it = self._medias(self.por_prof_it).round(2).reset_index()
+        prof_it.rename(columns=self.COLUNAS_PROF_IT, inplace=True)
+
+        return {
+            "cond_freq": cond_freq,
+            "apoio_medio": medias_regiao["Company_Support_for_Remote_Work"].round(2),
+            "correlacoes": self.correlacoes(),
+            "indice_medio_regiao": normalizadas["Mental_Wellness_Index"].round(2),
+            "metricas_regionais": normalizadas.round(2).reset_index(),
+            "prof_it": prof_it,
+        }
+
+
+def particionar_por_chave(df: pd.DataFrame, chave: str, n_particoes: int) -> list:
+    # Partição por hash dos valores da chave: todas as linhas de um grupo caem na mesma
+    # partição (pela ordem original), pelo que os resultados das partições são disjuntos
+    # e juntam-se sem recalcular nada. Partições vazias são omitidas.
+    particao = pd.util.hash_pandas_object(df[chave], index=False).to_numpy() % n_particoes
+    return [parte for _, parte in df.groupby(particao, sort=False)]
+
+
+# Inquérito partilhado com os processos de agregar_inquerito_em_paralelo (herdado com fork)
+_INQUERITO_PARTILHADO = None
+
+
+def _agregar_particao_inquerito(parte: pd.DataFrame | tuple) -> AgregadosInquerito:
+    # parte: as linhas, ou (início, fim) das linhas do inquérito partilhado
+    if isinstance(parte, tuple):
+        parte = _INQUERITO_PARTILHADO.iloc[parte[0]:parte[1]]
+    return AgregadosInquerito().atualizar(parte)
+
+
+@instrumentado("metricas:agregados_inquerito")
+def agregar_inquerito_em_paralelo(df: pd.DataFrame, processos: int) -> AgregadosInquerito:
+    # Reparte o inquérito em intervalos de linhas contíguos, um por processo, e junta os
+    # parciais pela ordem (AgregadosInquerito.combinar). Todas as somas por grupo são de
+    # valores inteiros, pelo que o resultado é igual ao de AgregadosInquerito().atualizar(df).
+    # Com fork os processos herdam o inquérito e só recebem os limites do intervalo;
+    # nos outros casos cada um recebe as colunas necessárias das suas linhas.
+    global _INQUERITO_PARTILHADO
+    colunas = list(dict.fromkeys(
+        AgregadosInquerito.CHAVES_PROF_IT + list(AgregadosInquerito.COLUNAS_PROF_IT)
+        + AgregadosInquerito.COLUNAS_REGIAO + AgregadosInquerito.COLUNAS_CORRELACAO
+    ))
+    limites = np.linspace(0, len(df), processos + 1).astype(int)
+    intervalos = [(inicio, fim) for inicio, fim in zip(limites[:-1], limites[1:]) if fim > inicio]
+
+    contexto = multiprocessing.get_context()
+    if contexto.get_start_method() == "fork":
+        _INQUERITO_PARTILHADO = df
+        partes = intervalos
+    else:
+        partes = [df[colunas].iloc[inicio:fim] for inicio, fim in intervalos]
 
-#Guardar os dados limpos num ficheiro csv
-df.to_csv("dados_transformados.csv", index=False)
+    agregados = AgregadosInquerito()
+    try:
+        with ProcessPoolExecutor(max_workers=processos, mp_context=contexto) as executor:
+            for parcial in executor.map(_agregar_particao_inquerito, partes):
+                agregados.combinar(parcial)
+    finally:
+        _INQUERITO_PARTILHADO = None
+    return agregados
 
 ###################################################### Merge dos dados ######################################################
-try:
-    df_who_para_mapeamento = pd.read_csv("todos_dados_who.csv")
-except FileNotFoundError:
-    print("Erro: O ficheiro 'todos_dados_who.csv' não foi encontrado. Execute o fluxo de extração primeiro.")
-    # Considerar adicionar um sys.exit() ou levantar uma exceção se este ficheiro for crucial
-    df_who_para_mapeamento = pd.DataFrame(columns=['country']) # DataFrame vazio para evitar erros subsequentes
-
-
-# Mapeamento manual de alguns países mais comuns (adiciona mais conforme necessário)
-# Mapeamento manual de países ISO para regiões
-# Obter os valores únicos das regiões e países
-regioes_main = df["Region"].dropna().unique()
-paises_api = df_api["country"].dropna().unique()
-
-# Criar o dicionário de mapeamento de códigos ISO para regiões
-# Inicialmente vazio
-iso_para_regiao_completo = {}
-
-# Mapeamento manual inicial (será expandido automaticamente abaixo)
-mapeamento_inicial = {
-    "Europe": [],
-    "North America": [],
-    "Asia": [],
-    "Africa": [],
-    "South America": [],
-    "Oceania": []
-}
 
-def mapear_regiao(iso3):
+@instrumentado("who:leitura")
+def carregar_dados_who(nome: str = "todos_dados_who") -> pd.DataFrame:
     try:
-        # Converter ISO-3 para ISO-2 (ex: 'FRA' → 'FR')
-        alpha2 = pycountry.countries.get(alpha_3=iso3).alpha_2
-        cont_code = country_alpha2_to_continent_code(alpha2)
-        return convert_continent_code_to_continent_name(cont_code)
-    except:
-        return None  # Se não conseguir mapear, retorna None
-
-# Obter os códigos únicos dos países de TODOS os dados da WHO
-if not df_who_para_mapeamento.empty and 'country' in df_who_para_mapeamento.columns:
-    paises_todos_who = df_who_para_mapeamento["country"].dropna().unique()
-else:
-    paises_todos_who = []
-    if 'country' not in df_who_para_mapeamento.columns and not df_who_para_mapeamento.empty:
-        print("Aviso: A coluna 'country' não foi encontrada em 'todos_dados_who.csv' para o mapeamento de regiões.")
-
-
-# Obter os códigos únicos dos países da API
-paises_api = df_api["country"].dropna().unique()
-
-# Aplicar o mapeamento
-iso_para_regiao_completo = {iso: mapear_regiao(iso) for iso in paises_todos_who} # <--- CORRIGIDO para usar paises_todos_who
-# Opcional: verificar quais não foram mapeados
-nao_mapeados = [iso for iso, regiao in iso_para_regiao_completo.items() if regiao is None]
-print(f" Países não mapeados automaticamente: {len(nao_mapeados)}")
-print(nao_mapeados[:20])  # Mostra os 20 primeiros
-
-# Carregar dados extraídos da WHO
-df_who = pd.read_csv("todos_dados_who.csv")
-
-for codigo in df_who["codigo"].unique():
-    df_temp = df_who[df_who["codigo"] == codigo].copy()
-    df_temp["value"] = pd.to_numeric(df_temp["value"], errors="coerce")
-    df_temp["Region"] = df_temp["country"].map(iso_para_regiao_completo)
-
-    num_sem_regiao = df_temp["Region"].isna().sum()#
-    print(f" {codigo} - Países sem região mapeada: {num_sem_regiao} de {len(df_temp)}")#
-    print(df_temp[df_temp["Region"].isna()]["country"].unique()[:10])  # mostra os 10 primeiros#
-
-    print(f" {codigo} - Regiões mapeadas:")#
-    print(df_temp["Region"].unique())#
+        return completar_valores_who(ler_intermedio(nome))
+    except FileNotFoundError:
+        print(f"Erro: O ficheiro '{caminho_intermedio(nome)}' não foi encontrado. Execute o fluxo de extração primeiro.")
+        raise
+
+
+# Tabela ISO3 → continente construída uma vez a partir do pycountry e guardada em
+# disco; a versão faz parte do nome do ficheiro e deve ser incrementada sempre que
+# a construção ou as correções manuais mudarem
+VERSAO_TABELA_REGIOES = 1
+CAMINHO_TABELA_REGIOES = f"tabela_iso3_continente_v{VERSAO_TABELA_REGIOES}.csv"
+
+# Correções manuais para códigos que o pycountry_convert não consegue mapear.
+# Os agregados regionais/globais da WHO ficam explicitamente sem continente (None)
+# para não serem contados duas vezes nas médias por região.
+CORRECOES_REGIOES = {
+    "TLS": "Asia",  # Timor-Leste
+    "ESH": "Africa",  # Sara Ocidental
+    "VAT": "Europe",  # Santa Sé
+    "SXM": "North America",  # São Martinho (parte holandesa)
+    "PCN": "Oceania",  # Pitcairn
+    "UMI": "Oceania",  # Ilhas Menores Distantes dos EUA
+    "XKX": "Europe",  # Kosovo (código usado pela WHO, não é ISO 3166)
+    "ATA": None,  # Antártida
+    "ATF": None,  # Terras Austrais Francesas
+    "AFR": None,  # Região africana da WHO
+    "AMR": None,  # Região das Américas da WHO
+    "EMR": None,  # Região do Mediterrâneo Oriental da WHO
+    "EUR": None,  # Região europeia da WHO
+    "SEAR": None,  # Região do Sudeste Asiático da WHO
+    "WPR": None,  # Região do Pacífico Ocidental da WHO
+    "GLOBAL": None,  # Total mundial
+}
+
+
+def construir_tabela_regioes() -> pd.Series:
+    # Importações pesadas só quando a tabela tem de ser (re)construída
+    import pycountry
+    from pycountry_convert import country_alpha2_to_continent_code, convert_continent_code_to_continent_name
+
+    regioes = {}
+    for pais in pycountry.countries:
+        try:
+            cont_code = country_alpha2_to_continent_code(pais.alpha_2)
+            regioes[pais.alpha_3] = convert_continent_code_to_continent_name(cont_code)
+        except KeyError:
+            regioes[pais.alpha_3] = None
+    regioes.update(CORRECOES_REGIOES)
+    return pd.Series(regioes, name="Region", dtype=object).rename_axis("iso3").sort_index()
+
+
+def carregar_tabela_regioes(caminho: str = CAMINHO_TABELA_REGIOES, correcoes: dict | None = None) -> pd.Series:
+    # Series indexada pelo código ISO3. Lida do disco quando já existe; caso
+    # contrário é construída e guardada para as execuções seguintes.
+    if os.path.exists(caminho):
+        tabela = pd.read_csv(caminho, index_col="iso3", keep_default_na=False, na_values=[""])["Region"]
+    else:
+        tabela = construir_tabela_regioes()
+        tabela.to_csv(caminho)
+    if correcoes:
+        tabela = tabela.astype(object)
+        for iso3, regiao in correcoes.items():
+            tabela.loc[iso3] = regiao
+    return tabela
+
+
+def mapear_regioes(paises: pd.Series, tabela_regioes: pd.Series) -> pd.Series:
+    # Mapeamento vetorizado de uma coluna inteira: a tabela é juntada às categorias
+    # (cada código distinto é procurado uma única vez) e o resultado é um
+    # categórico com as regiões por ordem alfabética
+    paises = paises.astype("category")
+    regioes = tabela_regioes.reindex(paises.cat.categories)
+    codigos_regiao, categorias = pd.factorize(regioes, sort=True)
+
+    codigos_pais = paises.cat.codes.to_numpy()
+    codigos = np.full(len(codigos_pais), -1, dtype=np.int64)
+    validos = codigos_pais >= 0
+    codigos[validos] = codigos_regiao[codigos_pais[validos]]
+    return pd.Series(pd.Categorical.from_codes(codigos, categorias), index=paises.index, name="Region")
+
+
+@instrumentado("who:mapeamento_regioes")
+def construir_mapeamento_regioes(df_who: pd.DataFrame) -> pd.Series:
+    # Tabela ISO3 → continente em cache e diagnóstico dos países da WHO sem região
+    tabela_regioes = carregar_tabela_regioes()
+
+    # Obter os códigos únicos dos países de TODOS os dados da WHO
+    if not df_who.empty and 'country' in df_who.columns:
+        paises_todos_who = pd.Index(df_who["country"].dropna().unique())
+    else:
+        paises_todos_who = pd.Index([])
+        if 'country' not in df_who.columns and not df_who.empty:
+            print("Aviso: A coluna 'country' não foi encontrada nos dados da WHO para o mapeamento de regiões.")
+
+    # Opcional: verificar quais não foram mapeados
+    nao_mapeados = paises_todos_who[tabela_regioes.reindex(paises_todos_who).isna().to_numpy()].tolist()
+    print(f" Países não mapeados automaticamente: {len(nao_mapeados)}")
+    print(nao_mapeados[:20])  # Mostra os 20 primeiros
+    return tabela_regioes
+
+
+def diagnosticar_regioes_who(df_norm: pd.DataFrame):
+    # Diagnóstico do mapeamento por indicador a partir dos dados já normalizados,
+    # com um único groupby em vez de um filtro e uma cópia por código
+    sem_regiao = df_norm["Region"].isna()
+    por_codigo = df_norm.groupby("codigo", observed=True)
+    totais = por_codigo.size()
+    num_sem_regiao = sem_regiao.groupby(df_norm["codigo"], observed=True).sum()
+    regioes = por_codigo["Region"].unique()
+    paises_sem_regiao = df_norm.loc[sem_regiao].groupby("codigo", observed=True)["country"].unique()
+
+    for codigo in df_norm["codigo"].unique():
+        print(f" {codigo} - Países sem região mapeada: {num_sem_regiao[codigo]} de {totais[codigo]}")#
+        print(np.asarray(paises_sem_regiao.get(codigo, []))[:10])  # mostra os 10 primeiros#
+
+        print(f" {codigo} - Regiões mapeadas:")#
+        print(np.asarray(regioes[codigo]))#
 
     print(" Códigos de país nos dados da OMS:")#
-    print(df_who["country"].unique())#
+    print(np.asarray(df_norm["country"].unique()))#
+
 ################################################################ Metricas ##########################################################################
 
+# Chaves de agrupamento suportadas pelo motor de agregação da WHO
+CHAVES_WHO = ["codigo", "Region", "country", "year", "sex"]
 
+# Tabelas agregadas usadas no Entregável 2: nome -> (chaves, códigos ou None para todos, estatística)
+PEDIDOS_WHO = {
+    "regiao_sexo": (["Region", "sex", "codigo"], None, "mean"),
+    "evolucao_anual": (["year", "codigo"], None, "mean"),
+    "regiao": (["Region", "codigo"], None, "mean"),
+    "pais_ano": (["country", "year", "codigo"], ["MH_6", "MH_7", "MH_9"], "mean"),
+}
+
+
+@instrumentado("who:normalizacao")
+def normalizar_who(df_who: pd.DataFrame, tabela_regioes: pd.Series) -> pd.DataFrame:
+    # Normalização feita uma única vez: estimativa pontual já interpretada na extração,
+    # ano inteiro e colunas categóricas (o mapeamento de regiões é feito sobre as
+    # categorias, não as linhas). Os indicadores Yes/No (MH_3) não têm value_num: contam
+    # como 1/0, pelo que a sua média é a proporção de "Yes".
+    country = df_who["country"].astype("category")
+    return pd.DataFrame({
+        "codigo": df_who["codigo"].astype("category"),
+        "country": country,
+        "Region": mapear_regioes(country, tabela_regioes),
+        "year": pd.to_numeric(df_who["year"], errors="coerce").astype("Int64"),
+        "sex": df_who["sex"].astype("category"),
+        "value": df_who["value_num"].fillna(df_who["value_bool"].astype("float64")),
+    })
+
+
+@instrumentado("who:agregacao")
+def agregar_who(df_norm: pd.DataFrame, pedidos: dict = PEDIDOS_WHO) -> dict:
+    # Um único groupby sobre os dados normalizados, ao grão mais fino pedido, guarda
+    # soma, contagem, mínimo e máximo por grupo. Cada tabela pedida é depois obtida
+    # agregando esses parciais (média = soma das somas / soma das contagens), sem
+    # voltar a percorrer nem copiar df_norm. Devolve nome -> DataFrame(chaves + "value").
+    chaves_base = [c for c in CHAVES_WHO if any(c in chaves for chaves, _, _ in pedidos.values())]
+    base = df_norm.groupby(chaves_base, observed=True, dropna=False)["value"].agg(
+        ["sum", "count", "min", "max"]
+    ).reset_index()
+
+    resultados = {}
+    for nome, (chaves, codigos, estatistica) in pedidos.items():
+        parcial = base if codigos is None else base[base["codigo"].isin(codigos)]
+        # Como no groupby original, grupos com chaves em falta são descartados
+        grupos = parcial.groupby(chaves, observed=True)
+        if estatistica == "mean":
+            valor = grupos["sum"].sum() / grupos["count"].sum()
+        elif estatistica in ("sum", "count"):
+            valor = grupos[estatistica].sum()
+        elif estatistica == "min":
+            valor = grupos["min"].min()
+        elif estatistica == "max":
+            valor = grupos["max"].max()
+        else:
+            raise ValueError(f"Estatística não suportada: {estatistica}")
+
+        tabela = valor.rename("value").reset_index()
+        for chave in chaves:
+            if isinstance(tabela[chave].dtype, pd.CategoricalDtype):
+                tabela[chave] = tabela[chave].astype(object)
+        resultados[nome] = tabela
+    return resultados
+
+
+@instrumentado("who:agregacao")
+def agregar_who_em_paralelo(df_norm: pd.DataFrame, processos: int, pedidos: dict = PEDIDOS_WHO) -> dict:
+    # Todas as tabelas pedidas são por indicador, por isso os dados são repartidos por
+    # "codigo" e cada processo corre agregar_who na sua parte. Juntar as partes e ordenar
+    # pelas chaves dá as mesmas tabelas que agregar_who(df_norm).
+    partes = particionar_por_chave(df_norm, "codigo", processos)
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        parciais = list(executor.map(agregar_who, partes, repeat(pedidos)))
+    return juntar_agregados_who(parciais, pedidos)
+
+
+def juntar_agregados_who(parciais: list, pedidos: dict = PEDIDOS_WHO) -> dict:
+    # Agregados de partes disjuntas por "codigo" (por processo ou por indicador):
+    # concatenados e ordenados pelas chaves são as tabelas de agregar_who sobre tudo.
+    # Partes sem linhas numa tabela (p.ex. pais_ano noutros indicadores) são ignoradas.
+    resultados = {}
+    for nome, (chaves, _, _) in pedidos.items():
+        tabelas = [parcial[nome] for parcial in parciais if not parcial[nome].empty] or [parciais[0][nome]]
+        tabela = pd.concat(tabelas, ignore_index=True)
+        resultados[nome] = tabela.sort_values(chaves, kind="stable", ignore_index=True)
+    return resultados
+
+
+def particionar_por_codigo(df_who: pd.DataFrame) -> dict:
+    # Separa os dados (com o texto original de "value") por indicador numa só passagem
+    return {codigo: grupo for codigo, grupo in df_who.groupby("codigo", sort=False)}
+
+
+@instrumentado("metricas:inquerito")
+def calcular_metricas(df: pd.DataFrame, agregados_who: dict) -> dict:
+    # Acrescenta Mental_Wellness_Index a df e devolve as métricas por nome
+
+    # print("\n Média de psicólogos por 100.000 habitantes por sexo e região (MH_9):")
+    # df_mh9 = df_who[df_who["codigo"] == "MH_9"].copy()
+    # df_mh9["value"] = pd.to_numeric(df_mh9["value"], errors="coerce")
+    # df_mh9["Region"] = df_mh9["country"].map(iso_para_regiao_completo)  # ADICIONA ISTO
+    # #media_psicologos = df_mh9.groupby(["Region", "sex"])["value"].mean().round(2).reset_index()
+    # media_psicologos = df_mh9.groupby(["Region"])["value"].mean().round(2).reset_index()
+    # print(media_psicologos)
+    # media_psicologos.to_csv("media_psicologos_por_sexo_regiao.csv", index=False)
+    # print(df_mh9["country"].unique())
+
+    print("\n[Métricas] - Frequência de condições de saúde mental:")
+    cond_freq = df["Mental_Health_Condition"].value_counts(normalize=True).round(3) * 100
+    print(cond_freq)
+
+    print("\n [Métricas] - Média de apoio da empresa por região:")
+    apoio_medio = df.groupby("Region", observed=True)["Company_Support_for_Remote_Work"].mean().round(2)
+    print(apoio_medio)
+
+    print("\n[Métricas] - Correlação entre fatores de bem-estar:")
+    correlacoes = df[[
+        "Work_Life_Balance_Norm",
+        "Social_Isolation_Norm",
+        "Company_Support_Norm"
+    ]].corr().round(2)
+    print(correlacoes)
+
+    print("\n [Métricas] - Índice composto de bem-estar:")
+    df["Mental_Wellness_Index"] = indice_bem_estar(df)
+
+    print(df[["Mental_Wellness_Index"]].describe().round(2))
+
+    print("\n [Métricas] - Índice médio por região:")
+    indice_medio_regiao = df.groupby("Region", observed=True)["Mental_Wellness_Index"].mean().astype(float).round(2)
+    print(indice_medio_regiao)
+
+    # Médias das colunas float32 arredondadas já em float64
+    metricas_regionais = df.groupby("Region", observed=True)[[
+        "Work_Life_Balance_Norm",
+        "Social_Isolation_Norm",
+        "Company_Support_Norm",
+        "Mental_Wellness_Index"
+    ]].mean().astype(float).round(2).reset_index()
+
+    return {
+        "cond_freq": cond_freq,
+        "apoio_medio": apoio_medio,
+        "correlacoes": correlacoes,
+        "indice_medio_regiao": indice_medio_regiao,
+        "metricas_regionais": metricas_regionais,
+        **metricas_who(agregados_who),
+    }
+
+
+def metricas_who(agregados_who: dict) -> dict:
+    #  Adicional: médias por sexo nos dados da OMS
+    print("\n [Métricas] - Média dos indicadores da OMS por região e sexo:")
+    media_por_regiao_sexo = agregados_who["regiao_sexo"]
+    print(media_por_regiao_sexo.head())
+
+    #  Adicional: evolução temporal
+    print("\n [Métricas] - Evolução anual dos indicadores da OMS (média global):")
+    evolucao_anual = agregados_who["evolucao_anual"]
+    print(evolucao_anual.head())
+
+    return {
+        "media_por_regiao_sexo": media_por_regiao_sexo,
+        "evolucao_anual": evolucao_anual,
+    }
+
+
+@instrumentado("metricas:inquerito")
+def calcular_metricas_de_agregados(agregados: AgregadosInquerito, agregados_who: dict) -> dict:
+    # Mesmas métricas de calcular_metricas, a partir de parciais já acumulados (bloco a
+    # bloco, por processo ou incrementalmente)
+    metricas = agregados.resultados()
+
+    print("\n[Métricas] - Frequência de condições de saúde mental:")
+    print(metricas["cond_freq"])
+
+    print("\n [Métricas] - Média de apoio da empresa por região:")
+    print(metricas["apoio_medio"])
+
+    print("\n[Métricas] - Correlação entre fatores de bem-estar:")
+    print(metricas["correlacoes"])
+
+    print("\n [Métricas] - Índice médio por região:")
+    print(metricas["indice_medio_regiao"])
+
+    metricas.update(metricas_who(agregados_who))
+    return metricas
 
-# print("\n Média de psicólogos por 100.000 habitantes por sexo e região (MH_9):")
-# df_mh9 = df_who[df_who["codigo"] == "MH_9"].copy()
-# df_mh9["value"] = pd.to_numeric(df_mh9["value"], errors="coerce")
-# df_mh9["Region"] = df_mh9["country"].map(iso_para_regiao_completo)  # ADICIONA ISTO
-# #media_psicologos = df_mh9.groupby(["Region", "sex"])["value"].mean().round(2).reset_index()
-# media_psicologos = df_mh9.groupby(["Region"])["value"].mean().round(2).reset_index()
-# print(media_psicologos)
-# media_psicologos.to_csv("media_psicologos_por_sexo_regiao.csv", index=False)
-# print(df_mh9["country"].unique())
-
-
-print("\n[Métricas] - Frequência de condições de saúde mental:")
-cond_freq = df["Mental_Health_Condition"].value_counts(normalize=True).round(3) * 100
-print(cond_freq)
-
-print("\n [Métricas] - Média de apoio da empresa por região:")
-apoio_medio = df.groupby("Region")["Company_Support_for_Remote_Work"].mean().round(2)
-print(apoio_medio)
-
-print("\n[Métricas] - Correlação entre fatores de bem-estar:")
-correlacoes = df[[
-    "Work_Life_Balance_Norm",
-    "Social_Isolation_Norm",
-    "Company_Support_Norm"
-]].corr().round(2)
-print(correlacoes)
-
-print("\n [Métricas] - Índice composto de bem-estar:")
-df["Mental_Wellness_Index"] = (df["Work_Life_Balance_Norm"] +
-                                (1 - df["Social_Isolation_Norm"]) +
-                                    df["Company_Support_Norm"]) / 3
-
-print(df[["Mental_Wellness_Index"]].describe().round(2))
-
-print("\n [Métricas] - Índice médio por região:")
-indice_medio_regiao = df.groupby("Region")["Mental_Wellness_Index"].mean().round(2)
-print(indice_medio_regiao)
-
-    # Se quiseres guardar como CSV
-metricas_regionais = df.groupby("Region")[[
-    "Work_Life_Balance_Norm",
-    "Social_Isolation_Norm",
-    "Company_Support_Norm",
-    "Mental_Wellness_Index"
-]].mean().round(2).reset_index()
-
-#  Adicional: médias por sexo nos dados da OMS
-df_who["value"] = pd.to_numeric(df_who["value"], errors="coerce")
-df_who["Region"] = df_who["country"].map(iso_para_regiao_completo)
-
-print("\n [Métricas] - Média dos indicadores da OMS por região e sexo:")
-media_por_regiao_sexo = df_who.groupby(["Region", "sex", "codigo"])["value"].mean().reset_index()
-print(media_por_regiao_sexo.head())
-
-#  Adicional: evolução temporal
-print("\n [Métricas] - Evolução anual dos indicadores da OMS (média global):")
-evolucao_anual = df_who.groupby(["year", "codigo"])["value"].mean().reset_index()
-print(evolucao_anual.head())
 ################################################################################
 # --------------------------------------
 # 🚨 AGREGAR MÉDIAS DA OMS POR REGIÃO 🚨
 # --------------------------------------
-df_who["value"] = pd.to_numeric(df_who["value"], errors="coerce")
-df_who["Region"] = df_who["country"].map(iso_para_regiao_completo)
-
-# Agrupar os indicadores da WHO por região
-media_oms = df_who.groupby(["Region", "codigo"])["value"].mean().unstack().reset_index()
-
-# Renomear colunas (conforme o SQL)
-media_oms.columns.name = None
-media_oms.rename(columns={
-    "WHOSIS_000015": "Life expectancy at age 60 (years)",
-    "MH_1": "MH_1_avg",
-    "MH_3": "MH_3_avg",
-    "MH_6": "MH_6_avg",
-    "MH_7": "MH_7_avg",
-    "MH_9": "MH_9_avg",
-    "MH_16": "MH_16_avg",
-    "MH_19": "MH_19_avg"
-}, inplace=True)
-
-# Juntar com os dados principais
-df = pd.merge(df, media_oms, on="Region", how="left")
-
-# Validar dimensões e colunas
-print("\n✅ Dimensões finais do DataFrame:", df.shape)
-print("✅ Colunas finais:", df.columns.tolist())
-# Guardar resultado final
-df.to_csv("dados_transformados_com_todas_apis.csv", index=False)
-print("Merge com todos os dados da OMS concluído.")
+def medias_oms_por_regiao(agregados_who: dict) -> pd.DataFrame:
+    # Indicadores da WHO agrupados por região
+    media_oms = agregados_who["regiao"].set_index(["Region", "codigo"])["value"].unstack().reset_index()
+
+    # Renomear colunas (conforme o SQL)
+    media_oms.columns.name = None
+    media_oms.rename(columns={
+        "WHOSIS_000015": "Life expectancy at age 60 (years)",
+        "MH_1": "MH_1_avg",
+        "MH_3": "MH_3_avg",
+        "MH_6": "MH_6_avg",
+        "MH_7": "MH_7_avg",
+        "MH_9": "MH_9_avg",
+        "MH_16": "MH_16_avg",
+        "MH_19": "MH_19_avg"
+    }, inplace=True)
+    return media_oms
+
+
+@instrumentado("metricas:merge_oms")
+def juntar_medias_oms(df: pd.DataFrame, media_oms: pd.DataFrame) -> pd.DataFrame:
+    # Juntar com os dados principais
+    df = pd.merge(df, media_oms, on="Region", how="left")
+
+    # Validar dimensões e colunas
+    print("\n✅ Dimensões finais do DataFrame:", df.shape)
+    print("✅ Colunas finais:", df.columns.tolist())
+    return df
+
+
+# Linhas do inquérito juntadas de cada vez ao materializar a tabela larga a partir da dimensão
+TAMANHO_BLOCO_JUNCAO = 100_000
+
+
+@instrumentado("metricas:merge_oms")
+def juntar_medias_oms_em_blocos(tamanho_bloco: int = TAMANHO_BLOCO_JUNCAO,
+                                media_oms: pd.DataFrame | None = None) -> str:
+    # Tabela larga (inquérito com as médias da OMS da sua região), só quando pedida:
+    # gerada a partir do inquérito com índice e da dimensão por região, um bloco de
+    # cada vez, sem o inquérito todo em memória
+    if media_oms is None:
+        media_oms = ler_intermedio("medias_oms_por_regiao")
+    caminho = caminho_intermedio("dados_transformados_com_todas_apis")
+    with EscritorIntermedio(caminho) as escritor:
+        for bloco in ler_intermedio_em_blocos("dados_transformados_com_indice", tamanho_bloco):
+            escritor.escrever(pd.merge(bloco, media_oms, on="Region", how="left"))
+    print(f"Tabela larga com as médias da OMS gerada em blocos ({escritor.linhas} linhas).")
+    return caminho
 
 
 # ------------------------------------------
 # COMPLEMENTO: Tabelas adicionais para Entregável 2
 # ------------------------------------------
 
-# --- Tabela 1: Profissionais de saúde (MH_9)
-df_mh9 = df_who[df_who["codigo"] == "MH_9"].copy()
-df_mh9["value"] = pd.to_numeric(df_mh9["value"], errors="coerce")
-df_mh9["Region"] = df_mh9["country"].map(iso_para_regiao_completo)
-
-media_psicologos_g = df_mh9.groupby(["Region"])
-media_psicologos = media_psicologos_g["value"].mean().round(2).reset_index()
-media_psicologos.rename(columns={"value": "Avg_Psychologists_per_100k"}, inplace=True)
-# media_psicologos.to_csv("tabela_profissionais_saude.csv", index=False)
-# print("✅ Tabela de profissionais de saúde salva como 'tabela_profissionais_saude.csv'.")
-
-# Psiquiatras (MH_6)
-df_mh6 = df_who[df_who["codigo"] == "MH_6"].copy()
-df_mh6["value"] = pd.to_numeric(df_mh6["value"], errors="coerce")
-df_mh6["Region"] = df_mh6["country"].map(iso_para_regiao_completo)
-media_psychiatrists = df_mh6.groupby("Region")["value"].mean().round(2).reset_index()
-media_psychiatrists.rename(columns={"value": "Avg_Psychiatrists_per_100k"}, inplace=True)
-
-# Enfermeiros (MH_7)
-df_mh7 = df_who[df_who["codigo"] == "MH_7"].copy()
-df_mh7["value"] = pd.to_numeric(df_mh7["value"], errors="coerce")
-df_mh7["Region"] = df_mh7["country"].map(iso_para_regiao_completo)
-media_nurses = df_mh7.groupby("Region")["value"].mean().round(2).reset_index()
-media_nurses.rename(columns={"value": "Avg_Nurses_per_100k"}, inplace=True)
-
-# Merge com metricas_regionais
-# Primeiro, metricas_regionais com psicólogos (MH_9)
-df_unificado = pd.merge(metricas_regionais, media_psicologos, on="Region", how="left")
-# Depois, adicionar psiquiatras (MH_6)
-df_unificado = pd.merge(df_unificado, media_psychiatrists, on="Region", how="left")
-# Finalmente, adicionar enfermeiros (MH_7)
-df_unificado = pd.merge(df_unificado, media_nurses, on="Region", how="left")
-
-df_unificado.to_csv("dados_unificados_por_regiao.csv", index=False)
-print("✅ Tabela unificada por região (com psicólogos, psiquiatras, enfermeiros) salva como 'dados_unificados_por_regiao.csv'.")
-
-
-# --- Tabela 2: Profissionais de IT com dados estáticos
-df_static = pd.read_csv("Impact_of_Remote_Work_on_Mental_Health.csv")
-df_static["Region"] = df_static["Region"].fillna("Desconhecida")
-
-prof_it = df_static.groupby(["Industry", "Region", "Mental_Health_Condition"]).agg({
-    "Company_Support_for_Remote_Work": "mean",
-    "Work_Life_Balance_Rating": "mean",
-    "Social_Isolation_Rating": "mean"
-}).round(2).reset_index()
-
-prof_it.rename(columns={
-    "Company_Support_for_Remote_Work": "Avg_Company_Support",
-    "Work_Life_Balance_Rating": "Avg_Work_Life_Balance",
-    "Social_Isolation_Rating": "Avg_Social_Isolation"
-}, inplace=True)
-
-prof_it.to_csv("tabela_profissionais_it.csv", index=False)
-print("✅ Tabela de profissionais de IT salva como 'tabela_profissionais_it.csv'.")
+@instrumentado("tabela:dados_unificados_por_regiao")
+def tabela_unificada_por_regiao(metricas_regionais: pd.DataFrame, agregados_who: dict) -> pd.DataFrame:
+    # Médias por região de psicólogos (MH_9), psiquiatras (MH_6) e enfermeiros (MH_7),
+    # todas retiradas da mesma agregação região × indicador
+    por_regiao = agregados_who["regiao"]
+
+    def media_regional(codigo, nome_coluna):
+        media = por_regiao.loc[por_regiao["codigo"] == codigo, ["Region", "value"]]
+        return media.assign(value=media["value"].round(2)).rename(columns={"value": nome_coluna})
+
+    # --- Tabela 1: Profissionais de saúde (MH_9)
+    media_psicologos = media_regional("MH_9", "Avg_Psychologists_per_100k")
+    # Psiquiatras (MH_6)
+    media_psychiatrists = media_regional("MH_6", "Avg_Psychiatrists_per_100k")
+    # Enfermeiros (MH_7)
+    media_nurses = media_regional("MH_7", "Avg_Nurses_per_100k")
+
+    # Merge com metricas_regionais
+    # Primeiro, metricas_regionais com psicólogos (MH_9)
+    df_unificado = pd.merge(metricas_regionais, media_psicologos, on="Region", how="left")
+    # Depois, adicionar psiquiatras (MH_6)
+    df_unificado = pd.merge(df_unificado, media_psychiatrists, on="Region", how="left")
+    # Finalmente, adicionar enfermeiros (MH_7)
+    df_unificado = pd.merge(df_unificado, media_nurses, on="Region", how="left")
+    return df_unificado
+
+
+@instrumentado("tabela:profissionais_it")
+def tabela_profissionais_it(df: pd.DataFrame) -> pd.DataFrame:
+    # --- Tabela 2: Profissionais de IT com dados estáticos
+    # Reutiliza o inquérito já carregado em vez de voltar a ler o CSV original. Essa
+    # leitura convertia "None" em valor em falta, pelo que quem não tem condição de
+    # saúde mental ("Nenhuma") nunca entrou nesta tabela; mantém-se esse critério.
+    df_static = df[df["Mental_Health_Condition"] != "Nenhuma"]
+    df_static = df_static.assign(Region=renomear_categoria(df_static["Region"], "", "Desconhecida"))
+
+    prof_it = df_static.groupby(["Industry", "Region", "Mental_Health_Condition"], observed=True).agg({
+        "Company_Support_for_Remote_Work": "mean",
+        "Work_Life_Balance_Rating": "mean",
+        "Social_Isolation_Rating": "mean"
+    }).round(2).reset_index()
+
+    prof_it.rename(columns={
+        "Company_Support_for_Remote_Work": "Avg_Company_Support",
+        "Work_Life_Balance_Rating": "Avg_Work_Life_Balance",
+        "Social_Isolation_Rating": "Avg_Social_Isolation"
+    }, inplace=True)
+    return prof_it
+
 
 # --------------------------------------
 # Tabela 3: Indicadores MH_6, MH_7, MH_9 por País (ISO) – SEM MH_3
 # --------------------------------------
-
-# Parte 1: Indicadores MH_6, MH_7, MH_9 (numéricos) com ano incluído
-codigos_numericos = ["MH_6", "MH_7", "MH_9"]
-df_numericos = df_who[df_who["codigo"].isin(codigos_numericos)].copy()
-
-# Garantir que o valor é numérico
-df_numericos["value"] = pd.to_numeric(df_numericos["value"], errors="coerce")
-
-# Garantir que o ano é inteiro
-df_numericos["year"] = pd.to_numeric(df_numericos["year"], errors="coerce").astype("Int64")
-
-# Agrupar por país, ano e código
-media_numericos_ano = df_numericos.groupby(["country", "year", "codigo"])["value"].mean().unstack().reset_index()
-media_numericos_ano.columns.name = None
-
-# Renomear colunas
-media_numericos_ano.rename(columns={
-    "MH_6": "Avg_MH_6_PsychiatristsInMH",
-    "MH_7": "Avg_MH_7_NursesInMH",
-    "MH_9": "Avg_MH_9_PsychologistsInMH"
-}, inplace=True)
-
-# Exportar com ano incluído
-media_numericos_ano.to_csv("tabela_indicadores_api_por_pais_ano.csv", index=False)
-print("✅ Tabela com MH_6, MH_7, MH_9 por país e ano salva com sucesso.")
+@instrumentado("tabela:indicadores_api_por_pais_ano")
+def tabela_indicadores_por_pais_ano(agregados_who: dict) -> pd.DataFrame:
+    # Indicadores MH_6, MH_7, MH_9 (numéricos) por país, ano e código; o ano já vem
+    # como inteiro da normalização
+    media_numericos_ano = agregados_who["pais_ano"].set_index(["country", "year", "codigo"])["value"].unstack().reset_index()
+    media_numericos_ano.columns.name = None
+
+    # Renomear colunas
+    media_numericos_ano.rename(columns={
+        "MH_6": "Avg_MH_6_PsychiatristsInMH",
+        "MH_7": "Avg_MH_7_NursesInMH",
+        "MH_9": "Avg_MH_9_PsychologistsInMH"
+    }, inplace=True)
+    return media_numericos_ano
 
 
 # --------------------------------------
 # Tabela 4: Indicador MH_3 (Legislação em Saúde Mental) por País (ISO)
 # --------------------------------------
+@instrumentado("tabela:mh3_legislacao_por_pais_ano")
+def tabela_mh3_legislacao(df_mh3: pd.DataFrame) -> pd.DataFrame:
+    # Recebe apenas as linhas do indicador MH_3; manter só as colunas relevantes
+    df_mh3 = df_mh3[["country", "year", "value_bool"]].copy()
 
-# Carregar o ficheiro com todos os dados da WHO
-df_who = pd.read_csv("todos_dados_who.csv")
-
-# Filtrar apenas o indicador MH_3
-df_mh3 = df_who[df_who["codigo"] == "MH_3"].copy()
-
-# Manter apenas colunas relevantes
-df_mh3 = df_mh3[["country", "year", "value"]]
+    # Yes → 1, No → 0, outros → em falta (value_bool, interpretado na extração)
+    df_mh3["MH_3_Legislation_Status"] = df_mh3["value_bool"].astype("float64")
 
-# Limpar e normalizar os valores (Yes / No)
-df_mh3["value_str"] = df_mh3["value"].astype(str).str.strip().str.lower()
-
-# Converter para booleano: Yes → 1, No → 0, outros → None
-df_mh3["MH_3_Legislation_Status"] = df_mh3["value_str"].apply(
-    lambda x: 1 if x == "yes" else 0 if x == "no" else None
-)
+    # Remover os inválidos (None)
+    df_mh3_clean = df_mh3.dropna(subset=["MH_3_Legislation_Status"]).copy()
 
-# Remover os inválidos (None)
-df_mh3_clean = df_mh3.dropna(subset=["MH_3_Legislation_Status"]).copy()
+    # Converter ano para inteiro (caso esteja como string)
+    df_mh3_clean["year"] = df_mh3_clean["year"].astype(int)
 
-# Converter ano para inteiro (caso esteja como string)
-df_mh3_clean["year"] = df_mh3_clean["year"].astype(int)
-
-# Agrupar por país e ano: 1 se houve pelo menos um "yes"
-df_mh3_ano = df_mh3_clean.groupby(["country", "year"])["MH_3_Legislation_Status"].max().reset_index()
-
-# Exportar como nova tabela
-df_mh3_ano.to_csv("tabela_mh3_legislacao_por_pais_ano.csv", index=False)
-print("✅ Tabela MH_3 com anos criada com sucesso.")
+    # Agrupar por país e ano: 1 se houve pelo menos um "yes"
+    return df_mh3_clean.groupby(["country", "year"])["MH_3_Legislation_Status"].max().reset_index()
 
 
 # --------------------------------------
 # Tabela 5
 # --------------------------------------
-print("\n🔄 Processando Tabela 5: Esperança de Vida aos 60 (extraindo de 'value')...")
-
-# 1. Filtrar indicador WHOSIS_000015 (Life expectancy at 60)
-df_life60 = df_who[df_who["codigo"] == "WHOSIS_000015"].copy()
-print(f"Linhas após filtrar por código WHOSIS_000015: {len(df_life60)}")
-
-# 2. Extrair o primeiro número da coluna "value" e converter para numérico
-#    Isto irá lidar com strings como "15.9 [15.3-16.8]" para obter 15.9
-#    Se não houver um número no início da string, o resultado será NaN.
-df_life60['extracted_value'] = df_life60['value'].astype(str).str.extract(r'^\s*(\d+\.?\d*)')[0]
-df_life60["LifeExpectancyAt60"] = pd.to_numeric(df_life60["extracted_value"], errors="coerce")
-
-# Remover linhas onde a extração/conversão para numérico falhou (resultando em NaN)
-# Esta linha mantém o comportamento original de apenas incluir linhas com valores numéricos válidos.
-df_life60.dropna(subset=["LifeExpectancyAt60"], inplace=True)
-print(f"Linhas após extrair e converter 'value' e remover NaNs: {len(df_life60)}")
-
-# 3. Adicionar Região (diretamente ao df_life60!)
-#    Certifica-te que a coluna "country" em df_life60 contém os códigos ISO corretos
-#    e que iso_para_regiao_completo está definido.
-if "country" in df_life60.columns:
-    df_life60["Region"] = df_life60["country"].map(iso_para_regiao_completo)
-    df_life60["Region"] = df_life60["Region"].fillna("Desconhecida")
-else:
-    df_life60["Region"] = "Desconhecida"
-    print("⚠️ Coluna 'country' não encontrada para mapear regiões.")
-
-
-# 4. Selecionar colunas finais e remover NaNs essenciais (country, year)
-#    LifeExpectancyAt60 já não deve ter NaNs devido ao dropna anterior.
-colunas_finais = ["country", "year", "LifeExpectancyAt60", "Region"]
-colunas_existentes_para_selecao = [col for col in colunas_finais if col in df_life60.columns]
-
-# Verificar se as colunas essenciais para dropna existem
-subset_dropna_final = []
-if "country" in colunas_existentes_para_selecao:
-    subset_dropna_final.append("country")
-if "year" in colunas_existentes_para_selecao:
-    subset_dropna_final.append("year")
-# LifeExpectancyAt60 já foi tratada, mas podemos manter para consistência se a coluna existir
-if "LifeExpectancyAt60" in colunas_existentes_para_selecao:
-    subset_dropna_final.append("LifeExpectancyAt60")
-
-
-if not df_life60.empty:
-    df_life60_final = df_life60[colunas_existentes_para_selecao].copy()
-    if subset_dropna_final:
-        df_life60_final.dropna(subset=subset_dropna_final, inplace=True)
-else:
-    # Se df_life60 estiver vazio, cria um DataFrame final vazio com as colunas esperadas
-    df_life60_final = pd.DataFrame(columns=colunas_existentes_para_selecao)
-
-print(f"Linhas após selecionar colunas e remover NaNs de 'country'/'year': {len(df_life60_final)}")
-
-# 5. Garantir ano como inteiro (depois de dropar NaNs no ano)
-if not df_life60_final.empty and 'year' in df_life60_final.columns:
-    # Tenta converter para Int64 para permitir NaNs se ainda existirem (embora não devam)
-    df_life60_final["year"] = pd.to_numeric(df_life60_final["year"], errors='coerce').astype('Int64')
-
-# 6. Exportar
-output_filename_life60 = "tabela_life_expectancy_at_60.csv"
-df_life60_final.to_csv(output_filename_life60, index=False)
-print(f"✅ Tabela corrigida com Life Expectancy at 60 (extraído de 'value') gerada: {output_filename_life60} ({len(df_life60_final)} linhas)")
+@instrumentado("tabela:life_expectancy_at_60")
+def tabela_life_expectancy_60(df_life60: pd.DataFrame, tabela_regioes: pd.Series) -> pd.DataFrame:
+    print("\n🔄 Processando Tabela 5: Esperança de Vida aos 60 (extraindo de 'value')...")
+
+    # 1. Linhas do indicador WHOSIS_000015 (Life expectancy at 60)
+    df_life60 = df_life60.copy()
+    print(f"Linhas após filtrar por código WHOSIS_000015: {len(df_life60)}")
+
+    # O indicador vem por sexo (SEX_MLE, SEX_FMLE, SEX_BTSX) e a tabela não tem coluna de
+    # sexo: fica a linha de ambos os sexos, uma por país e ano (a chave no upsert)
+    df_life60 = df_life60[df_life60["sex"].isna() | (df_life60["sex"] == "SEX_BTSX")]
+    print(f"Linhas após manter só ambos os sexos (SEX_BTSX): {len(df_life60)}")
+
+    # 2. Estimativa pontual de "value" (p.ex. 15.9 em "15.9 [15.3-16.8]"), já interpretada
+    #    na extração. Sem número válido, o valor fica em falta (NaN).
+    df_life60["LifeExpectancyAt60"] = df_life60["value_num"]
+
+    # Remover linhas onde a extração/conversão para numérico falhou (resultando em NaN)
+    # Esta linha mantém o comportamento original de apenas incluir linhas com valores numéricos válidos.
+    df_life60.dropna(subset=["LifeExpectancyAt60"], inplace=True)
+    print(f"Linhas após extrair e converter 'value' e remover NaNs: {len(df_life60)}")
+
+    # 3. Adicionar Região (diretamente ao df_life60!)
+    #    Certifica-te que a coluna "country" em df_life60 contém os códigos ISO corretos
+    #    presentes na tabela de regiões.
+    if "country" in df_life60.columns:
+        df_life60["Region"] = mapear_regioes(df_life60["country"], tabela_regioes).astype(object)
+        df_life60["Region"] = df_life60["Region"].fillna("Desconhecida")
+    else:
+        df_life60["Region"] = "Desconhecida"
+        print("⚠️ Coluna 'country' não encontrada para mapear regiões.")
+
+
+    # 4. Selecionar colunas finais e remover NaNs essenciais (country, year)
+    #    LifeExpectancyAt60 já não deve ter NaNs devido ao dropna anterior.
+    colunas_finais = ["country", "year", "LifeExpectancyAt60", "Region"]
+    colunas_existentes_para_selecao = [col for col in colunas_finais if col in df_life60.columns]
+
+    # Verificar se as colunas essenciais para dropna existem
+    subset_dropna_final = []
+    if "country" in colunas_existentes_para_selecao:
+        subset_dropna_final.append("country")
+    if "year" in colunas_existentes_para_selecao:
+        subset_dropna_final.append("year")
+    # LifeExpectancyAt60 já foi tratada, mas podemos manter para consistência se a coluna existir
+    if "LifeExpectancyAt60" in colunas_existentes_para_selecao:
+        subset_dropna_final.append("LifeExpectancyAt60")
+
+
+    if not df_life60.empty:
+        df_life60_final = df_life60[colunas_existentes_para_selecao].copy()
+        if subset_dropna_final:
+            df_life60_final.dropna(subset=subset_dropna_final, inplace=True)
+    else:
+        # Se df_life60 estiver vazio, cria um DataFrame final vazio com as colunas esperadas
+        df_life60_final = pd.DataFrame(columns=colunas_existentes_para_selecao)
+
+    print(f"Linhas após selecionar colunas e remover NaNs de 'country'/'year': {len(df_life60_final)}")
+
+    # 5. Garantir ano como inteiro (depois de dropar NaNs no ano)
+    if not df_life60_final.empty and 'year' in df_life60_final.columns:
+        # Tenta converter para Int64 para permitir NaNs se ainda existirem (embora não devam)
+        df_life60_final["year"] = pd.to_numeric(df_life60_final["year"], errors='coerce').astype('Int64')
+    return df_life60_final
+
+
+def preparar_agregados_who(processos: int = 1):
+    # Carregar dados extraídos da WHO
+    df_who = carregar_dados_who()
+    tabela_regioes = construir_mapeamento_regioes(df_who)
+
+    # Normalizar uma vez e calcular todas as agregações da WHO numa única passagem
+    df_norm = normalizar_who(df_who, tabela_regioes)
+    if VERBOSO:
+        diagnosticar_regioes_who(df_norm)
+    if processos > 1:
+        return df_who, tabela_regioes, agregar_who_em_paralelo(df_norm, processos)
+    return df_who, tabela_regioes, agregar_who(df_norm)
+
+
+@instrumentado("inquerito:limpeza_em_blocos")
+def transformar_inquerito_em_blocos(media_oms: pd.DataFrame | None, tamanho_bloco: int,
+                                    caminho: str = CSV_INQUERITO) -> AgregadosInquerito:
+    # Modo fora de memória: cada bloco é limpo, normalizado, escrito nos dois ficheiros
+    # intermédios e reduzido a somas/contagens. Nunca está mais de um bloco em memória.
+    # Sem media_oms (médias da OMS como dimensão) o segundo ficheiro é o inquérito com o
+    # índice, sem as médias.
+    agregados = AgregadosInquerito()
+    nome_oms = "dados_transformados_com_indice" if media_oms is None else "dados_transformados_com_todas_apis"
+    with EscritorIntermedio(caminho_intermedio("dados_transformados")) as escritor_limpos, \
+            EscritorIntermedio(caminho_intermedio(nome_oms)) as escritor_oms:
+        for bloco in ler_inquerito_em_blocos(caminho, tamanho_bloco):
+            bloco = limpar_e_normalizar(bloco)
+            escritor_limpos.escrever(bloco)
+
+            bloco["Mental_Wellness_Index"] = indice_bem_estar(bloco)
+            agregados.atualizar(bloco)
+            escritor_oms.escrever(bloco if media_oms is None else pd.merge(bloco, media_oms, on="Region", how="left"))
+
+    print(f"Inquérito processado em blocos de {tamanho_bloco} linhas ({agregados.linhas} linhas).")
+    return agregados
+
+
+# Agregados do inquérito guardados entre execuções (--metricas-incrementais)
+ESTADO_METRICAS_INQUERITO = "estado_metricas_inquerito.json"
+BYTES_ASSINATURA_INQUERITO = 1 << 16
+
+
+def _assinatura_inquerito(f, deslocamento: int) -> str:
+    # Cabeçalho e últimos bytes já processados do CSV: se mudarem, o ficheiro não foi
+    # só acrescentado. Lê no máximo BYTES_ASSINATURA_INQUERITO, seja qual for o tamanho.
+    f.seek(0)
+    cabecalho = f.readline()
+    inicio = max(len(cabecalho), deslocamento - BYTES_ASSINATURA_INQUERITO)
+    f.seek(inicio)
+    resumo = hashlib.sha256(cabecalho)
+    resumo.update(f.read(deslocamento - inicio))
+    return resumo.hexdigest()
+
+
+@instrumentado("metricas:incrementais")
+def atualizar_agregados_inquerito(estado: str = ESTADO_METRICAS_INQUERITO, caminho: str = CSV_INQUERITO,
+                                  tamanho_bloco: int | None = None) -> AgregadosInquerito:
+    # As respostas novas ao inquérito só são acrescentadas ao fim do CSV. Os agregados
+    # (somas, contagens e co-momentos) ficam em estado com a posição até onde o CSV foi
+    # lido, e cada execução lê e junta apenas as linhas seguintes. Se a parte já lida
+    # mudou, ou a versão da transformação, os agregados são recalculados do início.
+    agregados = AgregadosInquerito()
+    with open(caminho, "rb") as f:
+        cabecalho = f.readline()
+        deslocamento = len(cabecalho)
+        if os.path.exists(estado):
+            with open(estado, encoding="utf-8") as g:
+                guardado = json.load(g)
+            tamanho = os.fstat(f.fileno()).st_size
+            if (guardado["versao"] == VERSAO_TRANSFORMACAO and guardado["deslocamento"] <= tamanho
+                    and guardado["assinatura"] == _assinatura_inquerito(f, guardado["deslocamento"])):
+                agregados = AgregadosInquerito.de_json(guardado["agregados"])
+                deslocamento = guardado["deslocamento"]
+            else:
+                print(f"Inquérito alterado desde '{estado}': métricas recalculadas do início.")
+
+        # Só até à última linha completa; uma linha ainda a ser escrita fica para a próxima
+        f.seek(deslocamento)
+        novos = f.read()
+        fim = novos.rfind(b"\n") + 1
+        if fim < len(novos):
+            print(f"Aviso: última linha do inquérito incompleta ({len(novos) - fim} bytes), ignorada por agora.")
+        linhas_antes = agregados.linhas
+        if fim:
+            fonte = io.BytesIO(cabecalho + novos[:fim])
+            for bloco in ler_inquerito_em_blocos(fonte, tamanho_bloco or 100_000):
+                bloco = limpar_e_normalizar(bloco)
+                bloco["Mental_Wellness_Index"] = indice_bem_estar(bloco)
+                agregados.atualizar(bloco)
+            deslocamento += fim
+
+        conteudo = {
+            "versao": VERSAO_TRANSFORMACAO,
+            "deslocamento": deslocamento,
+            "assinatura": _assinatura_inquerito(f, deslocamento),
+            "agregados": agregados.para_json(),
+        }
+    with open(estado + ".tmp", "w", encoding="utf-8") as g:
+        json.dump(conteudo, g)
+    os.replace(estado + ".tmp", estado)
+
+    print(f"Métricas incrementais: {agregados.linhas - linhas_antes} linhas novas ({agregados.linhas} no total).")
+    return agregados
+
+
+# Ficheiros intermédios escritos pelo Entregável 2
+SAIDAS_ENTREGAVEL_2 = [
+    "dados_transformados",
+    "dados_transformados_com_todas_apis",
+    "dados_unificados_por_regiao",
+    "tabela_profissionais_it",
+    "tabela_indicadores_api_por_pais_ano",
+    "tabela_mh3_legislacao_por_pais_ano",
+    "tabela_life_expectancy_at_60",
+]
+
+# Com as médias da OMS como dimensão, em vez da tabela larga (que só é gerada a pedido)
+SAIDAS_DIMENSAO_OMS = ["dados_transformados_com_indice", "medias_oms_por_regiao"]
+
+# Incrementar quando a transformação mudar, para invalidar a cache de etapas
+VERSAO_TRANSFORMACAO = 4
+
+
+def executar_entregavel_2(relatorio_memoria: bool = False, tamanho_bloco: int | None = None,
+                          processos: int = 1, cache: CacheEtapas | None = None,
+                          dimensao_oms: bool = False, juntar_oms: bool = False, incremental: str | None = None):
+    # Com cache, o Entregável 2 é saltado quando o inquérito, os dados da WHO e a versão
+    # da transformação são os de uma execução anterior. Blocos e processos não entram
+    # na chave porque não mudam o resultado.
+    # Com dimensao_oms as médias da OMS ficam numa tabela por região em vez de repetidas
+    # em cada linha do inquérito; a tabela larga só é gerada com juntar_oms, em blocos.
+    # Com incremental (ficheiro de estado) só as linhas novas do inquérito são lidas, para
+    # as métricas e tabelas agregadas; as tabelas linha a linha do inquérito não são
+    # reescritas e a cache de etapas não é usada.
+    saidas_inquerito = SAIDAS_DIMENSAO_OMS if dimensao_oms else ["dados_transformados_com_todas_apis"]
+    if dimensao_oms and juntar_oms:
+        saidas_inquerito = saidas_inquerito + ["dados_transformados_com_todas_apis"]
+    if incremental:
+        cache = None
+    if cache is not None:
+        entradas = [CSV_INQUERITO, caminho_leitura("todos_dados_who")[1]]
+        parametros = {"formato": _formato(), "exportar_csv": EXPORTAR_CSV, "regioes": VERSAO_TABELA_REGIOES,
+                      "saidas": saidas_inquerito}
+        chave = cache.chave("transformacao", VERSAO_TRANSFORMACAO, entradas, parametros)
+        if cache.restaurar("transformacao", chave):
+            print("Entregável 2 sem alterações nas entradas: tabelas reutilizadas da cache.")
+            return
+
+    if incremental:
+        df_who, tabela_regioes, agregados_who = preparar_agregados_who(processos)
+        media_oms = medias_oms_por_regiao(agregados_who)
+        agregados = atualizar_agregados_inquerito(incremental, tamanho_bloco=tamanho_bloco)
+        metricas = calcular_metricas_de_agregados(agregados, agregados_who)
+        prof_it = metricas["prof_it"]
+    elif tamanho_bloco:
+        # As médias da OMS são precisas antes do inquérito para juntar cada bloco
+        df_who, tabela_regioes, agregados_who = preparar_agregados_who(processos)
+        media_oms = medias_oms_por_regiao(agregados_who)
+        agregados = transformar_inquerito_em_blocos(None if dimensao_oms else media_oms, tamanho_bloco)
+        metricas = calcular_metricas_de_agregados(agregados, agregados_who)
+        if not dimensao_oms:
+            print("Merge com todos os dados da OMS concluído.")
+        prof_it = metricas["prof_it"]
+    else:
+        df = carregar_inquerito(relatorio_memoria=relatorio_memoria)
+        if VERBOSO:
+            diagnosticar_inquerito(df)
+        df = transformar_inquerito(df)
+
+        #Guardar os dados limpos num ficheiro csv
+        guardar_intermedio(df, "dados_transformados")
+
+        df_who, tabela_regioes, agregados_who = preparar_agregados_who(processos)
+        if processos > 1:
+            # Tabelas por região e por indústria × região × condição repartidas por processos
+            df["Mental_Wellness_Index"] = indice_bem_estar(df)
+            metricas = calcular_metricas_de_agregados(agregar_inquerito_em_paralelo(df, processos), agregados_who)
+        else:
+            metricas = calcular_metricas(df, agregados_who)
+
+        # Guardar resultado final
+        media_oms = medias_oms_por_regiao(agregados_who)
+        if dimensao_oms:
+            guardar_intermedio(df, "dados_transformados_com_indice")
+        else:
+            df = juntar_medias_oms(df, media_oms)
+            guardar_intermedio(df, "dados_transformados_com_todas_apis")
+            print("Merge com todos os dados da OMS concluído.")
+        prof_it = metricas["prof_it"] if processos > 1 else tabela_profissionais_it(df)
+
+    if dimensao_oms:
+        caminho = guardar_intermedio(media_oms, "medias_oms_por_regiao")
+        print(f"✅ Médias da OMS por região ({len(media_oms)} regiões) salvas como '{caminho}'.")
+        if juntar_oms:
+            juntar_medias_oms_em_blocos(tamanho_bloco or TAMANHO_BLOCO_JUNCAO)
+
+    df_unificado = tabela_unificada_por_regiao(metricas["metricas_regionais"], agregados_who)
+    caminho = guardar_intermedio(df_unificado, "dados_unificados_por_regiao")
+    print(f"✅ Tabela unificada por região (com psicólogos, psiquiatras, enfermeiros) salva como '{caminho}'.")
+
+    caminho = guardar_intermedio(prof_it, "tabela_profissionais_it")
+    print(f"✅ Tabela de profissionais de IT salva como '{caminho}'.")
+
+    # Exportar com ano incluído
+    media_numericos_ano = tabela_indicadores_por_pais_ano(agregados_who)
+    guardar_intermedio(media_numericos_ano, "tabela_indicadores_api_por_pais_ano")
+    print("✅ Tabela com MH_6, MH_7, MH_9 por país e ano salva com sucesso.")
+
+    # Linhas de cada indicador (texto original), separadas numa só passagem
+    partes_who = particionar_por_codigo(df_who)
+    vazio = df_who.iloc[0:0]
+
+    # Exportar como nova tabela
+    df_mh3_ano = tabela_mh3_legislacao(partes_who.get("MH_3", vazio))
+    guardar_intermedio(df_mh3_ano, "tabela_mh3_legislacao_por_pais_ano")
+    print("✅ Tabela MH_3 com anos criada com sucesso.")
+
+    # 6. Exportar
+    df_life60_final = tabela_life_expectancy_60(partes_who.get("WHOSIS_000015", vazio), tabela_regioes)
+    output_filename_life60 = guardar_intermedio(df_life60_final, "tabela_life_expectancy_at_60")
+    print(f"✅ Tabela corrigida com Life Expectancy at 60 (extraído de 'value') gerada: {output_filename_life60} ({len(df_life60_final)} linhas)")
+
+    if cache is not None:
+        nomes = [nome for nome in SAIDAS_ENTREGAVEL_2 if nome != "dados_transformados_com_todas_apis"]
+        nomes += saidas_inquerito
+        saidas = [caminho_intermedio(nome) for nome in nomes]
+        if EXPORTAR_CSV and _formato() != "csv":
+            saidas += [nome + ".csv" for nome in nomes]
+        cache.guardar("transformacao", chave, saidas)
 
 
 ##########################################################################################################################
@@ -542,142 +2296,1022 @@ print(f"✅ Tabela corrigida com Life Expectancy at 60 (extraído de 'value') ge
 ###################################################### Entregavél 3 ######################################################
 ##########################################################################################################################
 ##########################################################################################################################
-import pandas as pd
-import pyodbc
-import numpy as np
 
-# Conexão
-conn = pyodbc.connect(
-    'DRIVER={ODBC Driver 17 for SQL Server};'
-    'SERVER=CARLOTA_SANTOS\\SQLEXPRESS;'
-    'DATABASE=Projetoo;'
-    'UID=sa;'
-    'PWD=sa;'
-    'Encrypt=yes;'
-    'TrustServerCertificate=yes;'
-)
-cursor = conn.cursor()
+# Ligação à base de dados. Os valores por omissão podem ser substituídos por um ficheiro
+# JSON (--config-bd, ou a variável CONFIG_BD) e estes pelas variáveis de ambiente BD_<CHAVE>
+# (p.ex. BD_SERVIDOR, BD_PALAVRA_PASSE). tipo "sqlite" usa o ficheiro em "caminho".
+CONFIG_BD_OMISSAO = {
+    "tipo": "sqlserver",
+    "driver": "ODBC Driver 17 for SQL Server",
+    "servidor": "CARLOTA_SANTOS\\SQLEXPRESS",
+    "base_dados": "Projetoo",
+    "utilizador": "sa",
+    "palavra_passe": "sa",
+    "encrypt": "yes",
+    "trust_server_certificate": "yes",
+    "caminho": "projeto.sqlite",
+    "timeout": 60,
+}
+CAMINHO_CONFIG_BD = os.environ.get("CONFIG_BD", "config_bd.json")
+
+
+def carregar_config_bd(caminho: str | None = None) -> dict:
+    config = dict(CONFIG_BD_OMISSAO)
+    caminho = caminho or CAMINHO_CONFIG_BD
+    if os.path.exists(caminho):
+        with open(caminho, encoding="utf-8") as f:
+            config.update(json.load(f))
+    for chave in config:
+        if f"BD_{chave.upper()}" in os.environ:
+            config[chave] = os.environ[f"BD_{chave.upper()}"]
+    return config
+
+
+def descrever_destino(config: dict) -> str:
+    # Identifica a base de dados de destino (sem credenciais), p.ex. para a cache de etapas
+    if config["tipo"] == "sqlite":
+        return f"sqlite:{os.path.abspath(config['caminho'])}"
+    return f"{config['tipo']}:{config['servidor']}/{config['base_dados']}"
+
+
+def ligar_bd(config: dict | None = None):
+    config = config or carregar_config_bd()
+    if config["tipo"] == "sqlite":
+        import sqlite3
+
+        # A ligação pode passar entre threads do pool, mas só uma a usa de cada vez
+        return sqlite3.connect(config["caminho"], timeout=float(config["timeout"]), check_same_thread=False)
+
+    # pyodbc só é importado quando a carga em SQL Server é efetivamente executada
+    import pyodbc
+
+    # Conexão
+    return pyodbc.connect(
+        f'DRIVER={{{config["driver"]}}};'
+        f'SERVER={config["servidor"]};'
+        f'DATABASE={config["base_dados"]};'
+        f'UID={config["utilizador"]};'
+        f'PWD={config["palavra_passe"]};'
+        f'Encrypt={config["encrypt"]};'
+        f'TrustServerCertificate={config["trust_server_certificate"]};'
+    )
+
+
+class PoolLigacoes:
+    # Pool pequeno de ligações: cria até "tamanho" ligações à medida que são pedidas e
+    # reutiliza-as. Cada ligação é usada por uma só thread de cada vez.
+    def __init__(self, fabrica, tamanho: int = 1):
+        self._fabrica = fabrica
+        self._livres = queue.Queue()
+        self._criadas = []
+        self._tamanho = tamanho
+        self._trinco = threading.Lock()
+
+    @contextmanager
+    def ligacao(self):
+        try:
+            conn = self._livres.get_nowait()
+        except queue.Empty:
+            with self._trinco:
+                criar = len(self._criadas) < self._tamanho
+                if criar:
+                    conn = self._fabrica()
+                    self._criadas.append(conn)
+            if not criar:
+                conn = self._livres.get()
+        try:
+            yield conn
+        finally:
+            self._livres.put(conn)
+
+    def fechar(self):
+        for conn in self._criadas:
+            conn.close()
+        self._criadas = []
+
+
+class DadosCarga:
+    # Tabela pronta a carregar: um array tipado por coluna e, nas colunas com valores em
+    # falta, a máscara dos nulos (NULL no SQL). As colunas categóricas ficam com os
+    # códigos e as categorias. Os valores só passam a objetos Python ao gerar os
+    # parâmetros do DB-API, sem DataFrame de objetos com None.
+    def __init__(self, colunas, valores: list, nulos: list, indice: pd.Index, categorias: list | None = None):
+        self.colunas = list(colunas)
+        self.valores = valores
+        self.nulos = nulos
+        self.categorias = categorias or [None] * len(valores)
+        self.indice = indice
+        self.linhas = len(indice)
+
+    def filtrar(self, manter: np.ndarray) -> "DadosCarga":
+        return DadosCarga(self.colunas, [valores[manter] for valores in self.valores],
+                          [None if nulos is None else nulos[manter] for nulos in self.nulos],
+                          self.indice[manter], self.categorias)
+
+    def _coluna(self, i: int, inicio: int = 0, fim: int | None = None) -> np.ndarray:
+        valores = self.valores[i][inicio:fim]
+        return valores if self.categorias[i] is None else self.categorias[i][valores]
+
+    def serie(self, coluna: str) -> pd.Series:
+        # Uma coluna como Series (nulos a NaN), p.ex. para detetar chaves repetidas
+        i = self.colunas.index(coluna)
+        serie = pd.Series(self._coluna(i), index=self.indice)
+        return serie if self.nulos[i] is None else serie.mask(self.nulos[i])
+
+    def parametros(self, inicio: int = 0, fim: int | None = None) -> list:
+        # Tuplos de valores Python das linhas [inicio, fim), com None nos nulos
+        colunas = []
+        for i, nulos in enumerate(self.nulos):
+            lista = self._coluna(i, inicio, fim).tolist()
+            if nulos is not None:
+                for j in np.flatnonzero(nulos[inicio:fim]):
+                    lista[j] = None
+            colunas.append(lista)
+        return list(zip(*colunas))
+
+
+def preparar_para_carga(df: pd.DataFrame, colunas_float=None, casas_decimais: int | None = None) -> DadosCarga:
+    # Uma passagem por coluna, sem cópias do DataFrame inteiro. Só as colunas float são
+    # verificadas quanto a inf/NaN; as linhas sem valor válido em colunas_float (convertidas
+    # para float se vierem como texto do CSV) não são carregadas.
+    colunas_float = list(colunas_float or [])
+    valores, nulos, categorias = [], [], []
+    manter = None
+    for col in df.columns:
+        serie = df[col]
+        categorias.append(None)
+        if col in colunas_float or pd.api.types.is_float_dtype(serie.dtype):
+            if not pd.api.types.is_float_dtype(serie.dtype):
+                serie = pd.to_numeric(serie, errors='coerce')
+            array = serie.to_numpy(dtype=np.float64, na_value=np.nan)
+            if serie.dtype == np.float32:
+                # Índices normalizados: float64 com a precisão que realmente têm, para
+                # não levar ruído de representação para o SQL
+                array = array.round(7)
+            elif col in colunas_float and casas_decimais is not None:
+                array = array.round(casas_decimais)
+            em_falta = ~np.isfinite(array)
+            if col in colunas_float:
+                manter = ~em_falta if manter is None else manter & ~em_falta
+        elif isinstance(serie.dtype, np.dtype) and serie.dtype.kind in "iub":
+            array, em_falta = serie.to_numpy(), None
+        elif isinstance(serie.dtype, pd.CategoricalDtype):
+            # Só as categorias (poucas) passam a objetos; código -1 = em falta
+            array = serie.cat.codes.to_numpy()
+            em_falta = array < 0
+            categorias[-1] = np.empty(len(serie.cat.categories), dtype=object)
+            categorias[-1][:] = serie.cat.categories.tolist()
+        else:
+            # Tipos com nulos (Int64, boolean, str, object): valores + máscara.
+            # Os escalares numpy/NA não são aceites pelos drivers DB-API, daí tolist() depois.
+            em_falta = serie.isna().to_numpy()
+            if pd.api.types.is_integer_dtype(serie.dtype):
+                array = serie.to_numpy(dtype=np.int64, na_value=0)
+            elif pd.api.types.is_bool_dtype(serie.dtype):
+                array = serie.to_numpy(dtype=bool, na_value=False)
+            elif isinstance(serie.dtype, pd.StringDtype):
+                # Texto: o array do pandas (Arrow) é fatiado e convertido lote a lote
+                array = serie.array
+            else:
+                array = serie.to_numpy(dtype=object)
+        valores.append(array)
+        nulos.append(em_falta if em_falta is not None and em_falta.any() else None)
+
+    dados = DadosCarga(df.columns, valores, nulos, df.index, categorias)
+    if manter is not None and not manter.all():
+        dados = dados.filtrar(manter)
+    return dados
+
+
+@instrumentado("carga:preparacao", detalhe="nome")
+def preparar_df(nome, colunas_float=None, casas_decimais: int | None = None) -> DadosCarga:
+    return preparar_para_carga(ler_intermedio(nome), colunas_float, casas_decimais)
+
+
+# Número de linhas enviadas em cada executemany
+TAMANHO_LOTE_SQL = 1000
+
+
+def lotes_parametros(dados: DadosCarga | pd.DataFrame, tamanho_lote: int = TAMANHO_LOTE_SQL):
+    # Gerador de lotes de parâmetros DB-API, (posição da primeira linha, lista de tuplos),
+    # tirados diretamente dos arrays das colunas: nenhuma Series por linha, cada coluna
+    # mantém o seu tipo e só um lote de cada vez passa a objetos Python
+    if isinstance(dados, pd.DataFrame):
+        dados = preparar_para_carga(dados)
+    for inicio in range(0, dados.linhas, tamanho_lote):
+        yield inicio, dados.parametros(inicio, inicio + tamanho_lote)
+
+
+def _savepoint_lote(conn, cursor, sqlite: bool, acao: str):
+    # Savepoint de um lote da carga. A transação é aberta explicitamente antes do primeiro:
+    # no SQLite, libertar um savepoint que abriu a transação faria commit dela.
+    if acao == "criar":
+        if sqlite:
+            if not conn.in_transaction:
+                cursor.execute("BEGIN")
+            cursor.execute("SAVEPOINT lote")
+        else:
+            cursor.execute("IF @@TRANCOUNT = 0 BEGIN TRANSACTION")
+            cursor.execute("SAVE TRANSACTION lote")
+    elif acao == "desfazer":
+        cursor.execute("ROLLBACK TO lote" if sqlite else "ROLLBACK TRANSACTION lote")
+    elif sqlite:
+        # No SQL Server os savepoints não são libertados; terminam com a transação
+        cursor.execute("RELEASE lote")
+
+
+@instrumentado("carga", detalhe="tabela")
+def carregar_tabela_bulk(conn, dados: DadosCarga | pd.DataFrame, tabela: str,
+                         tamanho_lote: int = TAMANHO_LOTE_SQL, lotes_por_commit: int = 0) -> int:
+    # Insere os dados em lotes com executemany (fast_executemany no pyodbc).
+    # lotes_por_commit > 0 faz commit a cada N lotes; 0 faz um único commit no fim.
+    # Cada lote tem o seu savepoint: quando falha, só esse lote é desfeito e as suas
+    # linhas são inseridas uma a uma, para isolar as linhas com erro sem perder as
+    # restantes. Se nenhuma linha do lote entrar (tabela inexistente, número de colunas
+    # errado, ...) o erro é da tabela e é lançado. Devolve as linhas inseridas.
+    if isinstance(dados, pd.DataFrame):
+        dados = preparar_para_carga(dados)
+    sqlite = type(conn).__module__ == "sqlite3"
+    cursor = conn.cursor()
+    if hasattr(cursor, "fast_executemany"):
+        cursor.fast_executemany = True
+
+    # O texto do INSERT é construído uma única vez por tabela
+    query = f"INSERT INTO {tabela} VALUES ({','.join(['?'] * len(dados.colunas))})"
+
+    inseridas = 0
+    for n_lote, (inicio, lote) in enumerate(lotes_parametros(dados, tamanho_lote), start=1):
+        _savepoint_lote(conn, cursor, sqlite, "criar")
+        try:
+            cursor.executemany(query, lote)
+            validas = len(lote)
+        except Exception as erro_lote:
+            _savepoint_lote(conn, cursor, sqlite, "desfazer")
+            erros = []
+            for offset, linha in enumerate(lote):
+                try:
+                    cursor.execute(query, linha)
+                except Exception as e:
+                    erros.append((dados.indice[inicio + offset], e))
+            validas = len(lote) - len(erros)
+            if not validas:
+                raise erro_lote
+            for indice, e in erros:
+                print(f"[{tabela}] Erro na linha {indice}: {e}")
+        _savepoint_lote(conn, cursor, sqlite, "libertar")
+        inseridas += validas
+
+        if lotes_por_commit and n_lote % lotes_por_commit == 0:
+            conn.commit()
+
+    conn.commit()
+    cursor.close()
+    return inseridas
+
+
+# Chaves naturais de cada tabela (nomes das colunas do DataFrame) para o modo upsert. Dados
+# com chaves repetidas são recusados (life_expectancy_at_60 só tem a linha de ambos os sexos)
+CHAVES_SQL = {
+    "dados_transformados": ["Employee_ID"],
+    "dados_transformados_indice": ["Employee_ID"],
+    "medias_oms_por_regiao": ["Region"],
+    "profissionais_it_regionais": ["Industry", "Region", "Mental_Health_Condition"],
+    "dados_unificados_por_regiao": ["Region"],
+    "indicadores_api_por_pais_ano": ["country", "year"],
+    "legislacao_mh3_por_pais_ano": ["country", "year"],
+    "life_expectancy_at_60": ["country", "year"],
+}
 
-def preparar_df(path, colunas_float=None):
-    df = pd.read_csv(path)
-    if colunas_float:
-        for col in colunas_float:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-            df[col] = df[col].astype(float)
-        df = df.replace([np.inf, -np.inf], np.nan)
-        df = df.dropna(subset=colunas_float)
-    return df.where(pd.notnull(df), None)
 
+def _instrucao_upsert(tabela: str, temporaria: str, colunas: list, chaves: list, sqlite: bool) -> str:
+    # Uma só instrução por tabela: insere as chaves novas e atualiza apenas as linhas
+    # em que algum valor mudou (as restantes não são escritas)
+    outras = [c for c in colunas if c not in chaves]
+    if sqlite:
+        q = lambda c: f'"{c}"'
+        lista = ", ".join(q(c) for c in colunas)
+        conflito = f"ON CONFLICT ({', '.join(q(c) for c in chaves)}) DO "
+        if not outras:
+            return f"INSERT INTO {tabela} ({lista}) SELECT {lista} FROM {temporaria} WHERE true {conflito}NOTHING"
+        return (
+            f"INSERT INTO {tabela} ({lista}) SELECT {lista} FROM {temporaria} WHERE true "
+            f"{conflito}UPDATE SET {', '.join(f'{q(c)} = excluded.{q(c)}' for c in outras)} "
+            f"WHERE {' OR '.join(f'{tabela}.{q(c)} IS NOT excluded.{q(c)}' for c in outras)}"
+        )
+
+    q = lambda c: f"[{c}]"
+    instrucao = (
+        f"MERGE {tabela} WITH (HOLDLOCK) AS destino USING {temporaria} AS origem "
+        f"ON {' AND '.join(f'destino.{q(c)} = origem.{q(c)}' for c in chaves)} "
+    )
+    if outras:
+        # EXCEPT compara também os NULL como iguais
+        instrucao += (
+            f"WHEN MATCHED AND EXISTS (SELECT {', '.join(f'origem.{q(c)}' for c in outras)} "
+            f"EXCEPT SELECT {', '.join(f'destino.{q(c)}' for c in outras)}) "
+            f"THEN UPDATE SET {', '.join(f'destino.{q(c)} = origem.{q(c)}' for c in outras)} "
+        )
+    return instrucao + (
+        f"WHEN NOT MATCHED BY TARGET THEN INSERT ({', '.join(q(c) for c in colunas)}) "
+        f"VALUES ({', '.join(f'origem.{q(c)}' for c in colunas)});"
+    )
+
+
+def _criar_indice_chave_sqlite(cursor, tabela: str, chaves: list):
+    # O ON CONFLICT do SQLite precisa de um índice único nas chaves. Uma tabela já
+    # preenchida em modo inserir pode ter chaves repetidas, que impedem o índice: a
+    # carga é recusada com a indicação do que fazer, sem apagar nada por conta própria.
+    nome = f"ux_{tabela}_chave"
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (nome,))
+    if cursor.fetchone():
+        return
+    lista = ", ".join(f"[{c}]" for c in chaves)
+    cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(n), 0) FROM "
+                   f"(SELECT COUNT(*) AS n FROM {tabela} GROUP BY {lista} HAVING COUNT(*) > 1)")
+    repetidas, linhas = cursor.fetchone()
+    if repetidas:
+        raise ValueError(
+            f"{tabela} já tem {repetidas} chaves ({', '.join(chaves)}) repetidas em {linhas} linhas, "
+            f"de cargas anteriores em modo inserir; o upsert precisa de chaves únicas. Apagar as "
+            f"repetidas (p.ex. DELETE FROM {tabela} WHERE rowid NOT IN (SELECT MAX(rowid) FROM "
+            f"{tabela} GROUP BY {lista})) ou esvaziar a tabela, e voltar a carregar."
+        )
+    cursor.execute(f"CREATE UNIQUE INDEX {nome} ON {tabela} ({lista})")
+
+
+@instrumentado("carga", detalhe="tabela")
+def carregar_tabela_upsert(conn, dados: DadosCarga | pd.DataFrame, tabela: str, chaves: list,
+                           tamanho_lote: int = TAMANHO_LOTE_SQL) -> int:
+    # Carga idempotente pelas chaves naturais: as linhas vão em lotes para uma tabela
+    # temporária com as colunas do destino e são aplicadas de uma vez (MERGE no SQL
+    # Server, INSERT ... ON CONFLICT no SQLite). Voltar a carregar os mesmos dados não
+    # escreve nada. Devolve as linhas inseridas ou alteradas no destino.
+    if isinstance(dados, pd.DataFrame):
+        dados = preparar_para_carga(dados)
+    sqlite = type(conn).__module__ == "sqlite3"
+    cursor = conn.cursor()
+
+    # As colunas do destino correspondem às do DataFrame pela posição, como no INSERT
+    cursor.execute(f"SELECT * FROM {tabela} WHERE 1 = 0")
+    colunas = [descricao[0] for descricao in cursor.description]
+    if len(colunas) != len(dados.colunas):
+        raise ValueError(f"{tabela} tem {len(colunas)} colunas e os dados {len(dados.colunas)}")
+    nomes = dict(zip(dados.colunas, colunas))
+
+    # Dados que não são únicos pela chave não podem ser aplicados por ela sem perder linhas:
+    # a carga da tabela é recusada
+    repetidas = pd.DataFrame({chave: dados.serie(chave) for chave in chaves}).duplicated(keep=False).to_numpy()
+    if repetidas.any():
+        raise ValueError(f"{repetidas.sum()} linhas com a chave ({', '.join(chaves)}) repetida; "
+                         f"upsert recusado para não descartar linhas (usar --modo-carga inserir)")
+    chaves = [nomes[chave] for chave in chaves]
+
+    if sqlite:
+        temporaria = f"temp.stg_{tabela}"
+        _criar_indice_chave_sqlite(cursor, tabela, chaves)
+        cursor.execute(f"DROP TABLE IF EXISTS {temporaria}")
+        cursor.execute(f"CREATE TEMP TABLE stg_{tabela} AS SELECT * FROM {tabela} WHERE 0")
+    else:
+        temporaria = f"#stg_{tabela}"
+        cursor.execute(f"IF OBJECT_ID('tempdb..{temporaria}') IS NOT NULL DROP TABLE {temporaria}")
+        cursor.execute(f"SELECT TOP 0 * INTO {temporaria} FROM {tabela}")
+
+    # __wrapped__: a carga da temporária faz parte desta etapa, não é registada à parte
+    enviadas = carregar_tabela_bulk.__wrapped__(conn, dados, temporaria, tamanho_lote)
+    cursor.execute(_instrucao_upsert(tabela, temporaria, colunas, chaves, sqlite))
+    alteradas = cursor.rowcount
+    conn.commit()
+    cursor.execute(f"DROP TABLE {temporaria}")
+    cursor.close()
+
+    print(f"[{tabela}] Upsert: {enviadas} linhas enviadas, {alteradas} inseridas ou alteradas.")
+    return alteradas
+
+
+@instrumentado("carga:preparacao", detalhe="nome")
+def preparar_indicadores_pais_ano(nome: str = "tabela_indicadores_api_por_pais_ano") -> DadosCarga:
+    # Colunas float arredondadas a 4 casas; linhas sem valor válido não são inseridas
+    colunas_float = [
+        'Avg_MH_6_PsychiatristsInMH',
+        'Avg_MH_7_NursesInMH',
+        'Avg_MH_9_PsychologistsInMH'
+    ]
+    return preparar_para_carga(ler_intermedio(nome), colunas_float, casas_decimais=4)
+
+
+@instrumentado("carga:preparacao", detalhe="nome")
+def preparar_life_expectancy_60(nome: str = "tabela_life_expectancy_at_60") -> DadosCarga:
+    # Valores em falta passam a NULL
+    return preparar_para_carga(ler_intermedio(nome))
 
-# ----------------------- Tabela 1: dados_transformados_com_todas_apis -----------------------
-colunas_float_1 = [
+
+# Colunas float da tabela 1 (linhas sem valor numérico válido não são inseridas)
+COLUNAS_FLOAT_DADOS_TRANSFORMADOS = [
     'MH_1_avg', 'MH_3_avg', 'MH_6_avg', 'MH_7_avg', 'MH_9_avg',
     'MH_16_avg', 'MH_19_avg', 'Life expectancy at age 60 (years)',
     'Work_Life_Balance_Norm', 'Social_Isolation_Norm',
     'Company_Support_Norm', 'Mental_Wellness_Index'
 ]
 
-df1 = preparar_df("dados_transformados_com_todas_apis.csv", colunas_float_1)
-
-for idx, row in df1.iterrows():
-    try:
-        cursor.execute(f"""
-            INSERT INTO dados_transformados VALUES ({','.join(['?' for _ in row])})
-        """, tuple(row))
-    except Exception as e:
-        print(f"[dados_transformados] Erro na linha {idx}: {e}")
-
+# Tabela SQL -> (ficheiro intermédio, função que o prepara para inserir), pela ordem de carga
+TABELAS_SQL = {
+    "dados_transformados": (
+        "dados_transformados_com_todas_apis",
+        functools.partial(preparar_df, colunas_float=COLUNAS_FLOAT_DADOS_TRANSFORMADOS),
+    ),
+    "profissionais_it_regionais": ("tabela_profissionais_it", preparar_df),
+    "dados_unificados_por_regiao": ("dados_unificados_por_regiao", preparar_df),
+    "indicadores_api_por_pais_ano": ("tabela_indicadores_api_por_pais_ano", preparar_indicadores_pais_ano),
+    "legislacao_mh3_por_pais_ano": ("tabela_mh3_legislacao_por_pais_ano", preparar_df),
+    "life_expectancy_at_60": ("tabela_life_expectancy_at_60", preparar_life_expectancy_60),
+}
 
-# ----------------------- Tabela 2: tabela_profissionais_it.csv -----------------------
-df2 = preparar_df("tabela_profissionais_it.csv")
+# Com as médias da OMS como dimensão (--oms-como-dimensao), a tabela larga dá lugar ao
+# inquérito com o índice e à tabela das médias por região
+COLUNAS_FLOAT_INQUERITO = [
+    'Work_Life_Balance_Norm', 'Social_Isolation_Norm',
+    'Company_Support_Norm', 'Mental_Wellness_Index'
+]
+TABELAS_SQL_DIMENSAO_OMS = {
+    "medias_oms_por_regiao": ("medias_oms_por_regiao", preparar_df),
+    "dados_transformados_indice": (
+        "dados_transformados_com_indice",
+        functools.partial(preparar_df, colunas_float=COLUNAS_FLOAT_INQUERITO),
+    ),
+}
 
-for idx, row in df2.iterrows():
-    try:
-        cursor.execute("""
-            INSERT INTO profissionais_it_regionais VALUES (?,?,?,?,?,?)
-        """, tuple(row))
-    except Exception as e:
-        print(f"[profissionais_it_regionais] Erro na linha {idx}: {e}")
+# As tabelas de TABELAS_SQL já existem na base de dados; estas duas são criadas antes da
+# carga, se ainda não existirem. As colunas seguem a ordem dos intermédios (o INSERT é
+# posicional) e as chaves primárias são as de CHAVES_SQL.
+DDL_DIMENSAO_OMS = {
+    "medias_oms_por_regiao": """
+        [Region] NVARCHAR(50) NOT NULL PRIMARY KEY,
+        [MH_1_avg] FLOAT, [MH_16_avg] FLOAT, [MH_19_avg] FLOAT, [MH_3_avg] FLOAT,
+        [MH_6_avg] FLOAT, [MH_7_avg] FLOAT, [MH_9_avg] FLOAT,
+        [Life expectancy at age 60 (years)] FLOAT""",
+    "dados_transformados_indice": """
+        [Employee_ID] NVARCHAR(20) NOT NULL PRIMARY KEY,
+        [Age] INT, [Gender] NVARCHAR(50), [Job_Role] NVARCHAR(50), [Industry] NVARCHAR(50),
+        [Years_of_Experience] INT, [Work_Location] NVARCHAR(50), [Hours_Worked_Per_Week] INT,
+        [Number_of_Virtual_Meetings] INT, [Work_Life_Balance_Rating] INT, [Stress_Level] NVARCHAR(50),
+        [Mental_Health_Condition] NVARCHAR(50), [Access_to_Mental_Health_Resources] NVARCHAR(50),
+        [Productivity_Change] NVARCHAR(50), [Social_Isolation_Rating] INT,
+        [Satisfaction_with_Remote_Work] NVARCHAR(50), [Company_Support_for_Remote_Work] INT,
+        [Physical_Activity] NVARCHAR(50), [Sleep_Quality] NVARCHAR(50), [Region] NVARCHAR(50),
+        [Work_Life_Balance_Norm] FLOAT, [Social_Isolation_Norm] FLOAT, [Company_Support_Norm] FLOAT,
+        [Mental_Wellness_Index] FLOAT""",
+}
 
 
-# ----------------------- Tabela 3: dados_unificados_por_regiao.csv -----------------------
-df3 = preparar_df("dados_unificados_por_regiao.csv")
+def criar_tabelas_dimensao_oms(conn):
+    # Cria as tabelas de DDL_DIMENSAO_OMS que faltem (os tipos do SQL Server são aceites
+    # pelo SQLite)
+    sqlite = type(conn).__module__ == "sqlite3"
+    cursor = conn.cursor()
+    for tabela, colunas in DDL_DIMENSAO_OMS.items():
+        if sqlite:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {tabela} ({colunas})")
+        else:
+            cursor.execute(f"IF OBJECT_ID(N'{tabela}', N'U') IS NULL CREATE TABLE {tabela} ({colunas})")
+    conn.commit()
+    cursor.close()
+
+
+def tabelas_sql(dimensao_oms: bool = False) -> dict:
+    # Tabelas a carregar, pela ordem de carga, consoante o Entregável 2 tenha escrito a
+    # tabela larga ou a dimensão das médias da OMS
+    if not dimensao_oms:
+        return TABELAS_SQL
+    tabelas = dict(TABELAS_SQL_DIMENSAO_OMS)
+    tabelas.update((tabela, v) for tabela, v in TABELAS_SQL.items() if tabela != "dados_transformados")
+    return tabelas
+
+
+# Incrementar quando a preparação ou a inserção mudarem, para invalidar a cache de etapas
+VERSAO_CARGA = 1
+
+
+# Modos de carga: "inserir" acrescenta todas as linhas; "upsert" aplica-as pelas chaves de CHAVES_SQL
+MODOS_CARGA = ("inserir", "upsert")
+
+
+def carregar_tabela(pool: PoolLigacoes, tabela: str, nome: str, preparar, modo: str = "inserir") -> int:
+    # Uma ligação e uma transação por tabela: um erro desfaz só esta tabela
+    with pool.ligacao() as conn:
+        try:
+            if modo == "upsert":
+                return carregar_tabela_upsert(conn, preparar(nome), tabela, CHAVES_SQL[tabela])
+            return carregar_tabela_bulk(conn, preparar(nome), tabela)
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def executar_entregavel_3(conn=None, cache: CacheEtapas | None = None, destino: str | None = None,
+                          config: dict | None = None, ligacoes: int = 1, modo: str = "inserir",
+                          dimensao_oms: bool = False):
+    # Aceita uma ligação já aberta (p.ex. sqlite3 em testes); por omissão liga à base de
+    # dados da configuração. Com ligacoes > 1 as tabelas, independentes entre si, são
+    # carregadas em simultâneo, cada uma com a sua ligação do pool e a sua transação;
+    # a falha de uma tabela não desfaz nem impede as outras.
+    # Com cache, as tabelas cujo ficheiro intermédio não mudou desde a última carga para o
+    # mesmo destino não são carregadas outra vez.
+    # Com modo="upsert" a carga é idempotente: repetir não duplica linhas e só as
+    # linhas novas ou alteradas são escritas. Com dimensao_oms são carregadas as tabelas
+    # de tabelas_sql(True) em vez da tabela larga, criadas primeiro se não existirem.
+    if conn is None:
+        config = config or carregar_config_bd()
+        destino = destino or descrever_destino(config)
+        pool = PoolLigacoes(functools.partial(ligar_bd, config), ligacoes)
+    else:
+        pool = PoolLigacoes(lambda: conn, 1)
+        ligacoes = 1
+
+    tabelas = tabelas_sql(dimensao_oms)
+    pendentes = {}
+    for tabela, (nome, preparar) in tabelas.items():
+        if cache is not None:
+            chave = cache.chave(f"carga:{tabela}", VERSAO_CARGA, [caminho_leitura(nome)[1]], {"destino": destino})
+            if cache.restaurar(f"carga:{tabela}", chave):
+                print(f"[{tabela}] Sem alterações desde a última carga; tabela não recarregada.")
+                continue
+            pendentes[tabela] = chave
+        else:
+            pendentes[tabela] = None
+
+    def tentar(tabela):
+        nome, preparar = tabelas[tabela]
+        try:
+            return carregar_tabela(pool, tabela, nome, preparar, modo), None
+        except Exception as e:
+            return None, e
 
-for idx, row in df3.iterrows():
     try:
-        cursor.execute("""
-            INSERT INTO dados_unificados_por_regiao VALUES (?,?,?,?,?,?,?,?)
-        """, tuple(row))
-    except Exception as e:
-        print(f"[dados_unificados_por_regiao] Erro na linha {idx}: {e}")
-
+        if dimensao_oms:
+            with pool.ligacao() as ligacao:
+                criar_tabelas_dimensao_oms(ligacao)
+        if ligacoes > 1:
+            with ThreadPoolExecutor(max_workers=ligacoes) as executor:
+                resultados = dict(zip(pendentes, executor.map(tentar, pendentes)))
+        else:
+            resultados = {tabela: tentar(tabela) for tabela in pendentes}
+    finally:
+        # Finalização
+        pool.fechar()
+
+    falhas = {tabela: erro for tabela, (_, erro) in resultados.items() if erro is not None}
+    for tabela, (inseridas, erro) in resultados.items():
+        if erro is not None:
+            print(f"[{tabela}] Carga falhou e foi desfeita: {erro}")
+        elif cache is not None:
+            cache.guardar(f"carga:{tabela}", pendentes[tabela])
+
+    if falhas:
+        print(f"⚠️ {len(falhas)} de {len(tabelas)} tabelas não foram carregadas: {', '.join(falhas)}")
+    else:
+        print("✅ Todos os dados foram inseridos no SQL Server com sucesso.")
+    return resultados
 
-# ----------------------- Tabela 4: tabela_indicadores_api_por_pais_ano.csv -----------------------
-df4 = pd.read_csv("tabela_indicadores_api_por_pais_ano.csv")
 
-# Converter colunas para float com erro controlado
-colunas_float = [
-    'Avg_MH_6_PsychiatristsInMH',
-    'Avg_MH_7_NursesInMH',
-    'Avg_MH_9_PsychologistsInMH'
-]
-
-for col in colunas_float:
-    df4[col] = pd.to_numeric(df4[col], errors='coerce').round(4)
+##########################################################################################################################
+##########################################################################################################################
+######################################################## Execução ########################################################
+##########################################################################################################################
+##########################################################################################################################
 
-# Eliminar linhas com float inválido (NaN)
-df4 = df4.dropna(subset=colunas_float)
+# Execução sobreposta das três etapas (--sobrepor). Cada indicador da WHO segue para o
+# mapeamento de regiões e a agregação logo que é extraído, o inquérito é transformado ao
+# mesmo tempo, e cada tabela do Entregável 2 é entregue à carga assim que está escrita,
+# enquanto as seguintes ainda estão a ser calculadas. As filas entre etapas são limitadas:
+# uma etapa mais rápida fica à espera da seguinte em vez de acumular dados em memória.
+TAMANHO_FILA_PIPELINE = 4
+
+# Tabelas que só dependem de alguns indicadores, escritas e carregadas logo que estes
+# chegam: tabela SQL -> (códigos, função(linhas por código, agregados por código, regiões))
+TABELAS_POR_INDICADOR = {
+    "legislacao_mh3_por_pais_ano": (
+        ["MH_3"],
+        lambda partes, parciais, regioes: tabela_mh3_legislacao(partes["MH_3"]),
+    ),
+    "life_expectancy_at_60": (
+        ["WHOSIS_000015"],
+        lambda partes, parciais, regioes: tabela_life_expectancy_60(partes["WHOSIS_000015"], regioes),
+    ),
+    "indicadores_api_por_pais_ano": (
+        PEDIDOS_WHO["pais_ano"][1],
+        lambda partes, parciais, regioes: tabela_indicadores_por_pais_ano(
+            juntar_agregados_who(list(parciais.values()), {"pais_ano": PEDIDOS_WHO["pais_ano"]})),
+    ),
+}
 
-# Substituir outros NaNs por None
-df4 = df4.where(pd.notnull(df4), None)
 
-# Inserir
-for idx, row in df4.iterrows():
+class PipelineCancelado(RuntimeError):
+    # Outra etapa do pipeline falhou; o erro dessa etapa é o que é mostrado
+    pass
+
+
+def _por_na_fila(fila: queue.Queue, item, cancelado: threading.Event):
+    # put bloqueante (é aqui que uma etapa espera pela seguinte) que desiste se o pipeline falhou
+    while True:
+        if cancelado.is_set():
+            raise PipelineCancelado()
+        try:
+            fila.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _tirar_da_fila(fila: queue.Queue, cancelado: threading.Event):
+    while True:
+        if cancelado.is_set():
+            raise PipelineCancelado()
+        try:
+            return fila.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+
+def extrair_indicadores_para_fila(extrair, codigos: list, concorrencia: int, fila: queue.Queue,
+                                  cancelado: threading.Event):
+    # Cada indicador vai para a fila assim que é extraído; com a fila cheia, a thread que o
+    # extraiu espera antes de pedir o seguinte. None na fila marca o fim da extração, que
+    # só acontece se todos os indicadores foram extraídos.
+    falhas = {}
+
+    def extrair_e_enviar(codigo):
+        try:
+            df_codigo = extrair(codigo)
+        except Exception as e:
+            falhas[codigo] = e
+            return
+        _por_na_fila(fila, (codigo, df_codigo), cancelado)
+
+    with ThreadPoolExecutor(max_workers=max(concorrencia, 1)) as executor:
+        list(executor.map(extrair_e_enviar, codigos))
+    verificar_falhas_extracao(falhas)
+    _por_na_fila(fila, None, cancelado)
+
+
+def transformar_who_da_fila(fila: queue.Queue, tabelas: dict, entregar, cancelado: threading.Event) -> dict:
+    # Normaliza e agrega cada indicador à chegada, escreve todos_dados_who (substituído só
+    # no fim, como na extração em streaming) e as tabelas de TABELAS_POR_INDICADOR. Devolve
+    # os agregados da WHO, iguais aos de agregar_who sobre os dados todos.
+    # Os indicadores chegam pela ordem em que terminam; todos_dados_who é escrito pela
+    # ordem de apis_who, como na extração etapa a etapa, e os que chegam antes da vez
+    # esperam em memória.
+    tabela_regioes = carregar_tabela_regioes()
+    pendentes = {tabela: set(codigos) for tabela, (codigos, _) in TABELAS_POR_INDICADOR.items() if tabela in tabelas}
+    partes, parciais = {}, {}
+    por_escrever, ordem = {}, list(apis_who)
+
+    destino = caminho_intermedio("todos_dados_who")
+    escritor = EscritorIntermedio(destino + ".tmp")
     try:
-        placeholders = ','.join(['?'] * len(row))
-        query = f"INSERT INTO indicadores_api_por_pais_ano VALUES ({placeholders})"
-        cursor.execute(query, tuple(row))
-    except Exception as e:
-        print(f"[indicadores_api_por_pais_ano] Erro na linha {idx}: {e}")
-        print(row)
-
-
-
-# ----------------------- Tabela 5: tabela_mh3_legislacao_por_pais_ano.csv -----------------------
-df5 = preparar_df("tabela_mh3_legislacao_por_pais_ano.csv")
+        while True:
+            item = _tirar_da_fila(fila, cancelado)
+            if item is None:
+                break
+            codigo, df_codigo = item
+            por_escrever[codigo] = df_codigo
+            while ordem and ordem[0] in por_escrever:
+                df_seguinte = por_escrever.pop(ordem.pop(0))
+                if not df_seguinte.empty:
+                    escritor.escrever(df_seguinte)
+            df_codigo = completar_valores_who(df_codigo)
+            df_norm = normalizar_who(df_codigo, tabela_regioes)
+            if VERBOSO:
+                diagnosticar_regioes_who(df_norm)
+            parciais[codigo] = agregar_who(df_norm)
+            partes[codigo] = df_codigo
+
+            for tabela, faltam in list(pendentes.items()):
+                faltam.discard(codigo)
+                if faltam:
+                    continue
+                del pendentes[tabela]
+                codigos, construir = TABELAS_POR_INDICADOR[tabela]
+                df_tabela = construir(partes, {c: parciais[c] for c in codigos}, tabela_regioes)
+                guardar_intermedio(df_tabela, tabelas[tabela][0])
+                entregar(tabela)
+            # As linhas de cada indicador só ficam em memória enquanto uma tabela precisar delas
+            partes = {c: p for c, p in partes.items() if any(c in faltam for faltam in pendentes.values())}
+        # Indicadores fora de apis_who (não esperados) ficam no fim, pela ordem de chegada
+        for df_seguinte in por_escrever.values():
+            if not df_seguinte.empty:
+                escritor.escrever(df_seguinte)
+    except BaseException:
+        escritor.fechar()
+        if os.path.exists(escritor.caminho):
+            os.remove(escritor.caminho)
+        raise
+
+    escritor.fechar()
+    if escritor.linhas:
+        os.replace(escritor.caminho, destino)
+        print(" Todos os dados da WHO foram extraídos e salvos.")
+    return juntar_agregados_who([parciais[codigo] for codigo in apis_who if codigo in parciais])
+
+
+def transformar_inquerito_sobreposto(futuro_who, tabelas: dict, entregar, tamanho_bloco: int | None,
+                                     processos: int, dimensao_oms: bool, juntar_oms: bool, inspecionar: bool):
+    # O inquérito não depende da WHO: é limpo, agregado e as suas tabelas carregadas
+    # enquanto a extração decorre. Só a junção com as médias da OMS e a tabela
+    # unificada esperam pelos agregados da WHO (futuro_who).
+    if inspecionar:
+        inspecionar_csv_original()
+    df = None
+    if tamanho_bloco:
+        # Sem as médias da OMS ainda: o inquérito com o índice é juntado no fim, em blocos
+        agregados = transformar_inquerito_em_blocos(None, tamanho_bloco)
+        prof_it = agregados.resultados()["prof_it"]
+    else:
+        df = carregar_inquerito()
+        if VERBOSO:
+            diagnosticar_inquerito(df)
+        df = transformar_inquerito(df)
+        guardar_intermedio(df, "dados_transformados")
+        df["Mental_Wellness_Index"] = indice_bem_estar(df)
+        if processos > 1:
+            agregados = agregar_inquerito_em_paralelo(df, processos)
+        else:
+            agregados = AgregadosInquerito().atualizar(df)
+        prof_it = tabela_profissionais_it(df)
+        if dimensao_oms:
+            guardar_intermedio(df, "dados_transformados_com_indice")
+    guardar_intermedio(prof_it, "tabela_profissionais_it")
+    entregar("profissionais_it_regionais")
+    if dimensao_oms:
+        entregar("dados_transformados_indice")
+
+    agregados_who = futuro_who.result()
+    media_oms = medias_oms_por_regiao(agregados_who)
+    if dimensao_oms:
+        guardar_intermedio(media_oms, "medias_oms_por_regiao")
+        entregar("medias_oms_por_regiao")
+        if juntar_oms:
+            juntar_medias_oms_em_blocos(tamanho_bloco or TAMANHO_BLOCO_JUNCAO)
+    elif df is not None:
+        guardar_intermedio(juntar_medias_oms(df, media_oms), "dados_transformados_com_todas_apis")
+        entregar("dados_transformados")
+    else:
+        juntar_medias_oms_em_blocos(tamanho_bloco, media_oms)
+        os.remove(caminho_intermedio("dados_transformados_com_indice"))
+        entregar("dados_transformados")
+
+    metricas = calcular_metricas_de_agregados(agregados, agregados_who)
+    df_unificado = tabela_unificada_por_regiao(metricas["metricas_regionais"], agregados_who)
+    guardar_intermedio(df_unificado, "dados_unificados_por_regiao")
+    entregar("dados_unificados_por_regiao")
+
+
+def carregar_da_fila(fila: queue.Queue, pool: PoolLigacoes, tabelas: dict, modo: str, resultados: dict):
+    # Carrega as tabelas pela ordem em que ficam prontas, até receber None. Como no
+    # Entregável 3, cada tabela tem a sua transação e uma falha não afeta as outras.
+    while True:
+        tabela = fila.get()
+        if tabela is None:
+            return
+        nome, preparar = tabelas[tabela]
+        try:
+            resultados[tabela] = carregar_tabela(pool, tabela, nome, preparar, modo), None
+        except Exception as e:
+            resultados[tabela] = None, e
+
+
+def executar_pipeline_sobreposto(concorrencia: int = 1, base_url: str = GHO_BASE_URL, streaming: bool = False,
+                                 tamanho_pagina: int = TAMANHO_PAGINA_GHO, dir_cache: str | None = None,
+                                 apenas_novos: bool = False, timeout: float | None = None,
+                                 tentativas: int = TENTATIVAS_GHO, pedidos_por_segundo: float | None = None,
+                                 consulta: ConsultaGHO | None = None, armazem: str | None = None,
+                                 tamanho_bloco: int | None = None, processos: int = 1,
+                                 dimensao_oms: bool = False, juntar_oms: bool = False,
+                                 config: dict | None = None, ligacoes: int = 1, modo: str = "inserir",
+                                 tamanho_fila: int = TAMANHO_FILA_PIPELINE, inspecionar: bool = True) -> dict:
+    # Entregáveis 1 a 3 sobrepostos, com os mesmos ficheiros intermédios e tabelas que a
+    # execução etapa a etapa. Etapas em threads ligadas por filas limitadas: extração ->
+    # transformação da WHO -> carga, com a transformação do inquérito em paralelo. Se uma
+    # etapa falha as outras param na próxima passagem por uma fila e o erro é relançado;
+    # as tabelas já carregadas ficam (cada uma na sua transação). A cache de etapas não é
+    # usada neste modo. inspecionar: começar pela inspeção do CSV original, como o
+    # Entregável 1. Devolve, como executar_entregavel_3, tabela -> (linhas, erro).
+    tabelas = tabelas_sql(dimensao_oms)
+    cancelado = threading.Event()
+    fila_indicadores = queue.Queue(tamanho_fila)
+    fila_carga = queue.Queue(tamanho_fila)
+    resultados = {}
+    erros = []
+
+    def entregar(tabela):
+        if tabela in tabelas:
+            _por_na_fila(fila_carga, tabela, cancelado)
+
+    def etapa(funcao, *args):
+        # O primeiro erro cancela o pipeline; os PipelineCancelado que se seguem não contam
+        try:
+            return funcao(*args)
+        except BaseException as e:
+            if not cancelado.is_set():
+                erros.append(e)
+            cancelado.set()
+            raise
+
+    if dir_cache:
+        def extrair(codigo):
+            return extrair_api_com_cache.fn(codigo, dir_cache, base_url, cliente, apenas_novos, consulta)[0]
+    elif streaming:
+        def extrair(codigo):
+            return extrair_api_paginado.fn(codigo, base_url, cliente, tamanho_pagina, consulta)
+    else:
+        def extrair(codigo):
+            return extrair_api_por_codigo.fn(codigo, base_url, cliente, consulta)
 
-for idx, row in df5.iterrows():
+    config = config or carregar_config_bd()
+    pool = PoolLigacoes(functools.partial(ligar_bd, config), ligacoes)
+    cliente = ClienteGHO(max(concorrencia, 1), timeout or TIMEOUT_GHO, tentativas, pedidos_por_segundo)
     try:
-        cursor.execute("""
-            INSERT INTO legislacao_mh3_por_pais_ano VALUES (?,?,?)
-        """, tuple(row))
-    except Exception as e:
-        print(f"[legislacao_mh3_por_pais_ano] Erro na linha {idx}: {e}")
+        # Como no Entregável 3, as tabelas da dimensão são criadas antes de qualquer carga
+        if dimensao_oms:
+            with pool.ligacao() as ligacao:
+                criar_tabelas_dimensao_oms(ligacao)
+        with ThreadPoolExecutor(max_workers=4 + ligacoes) as executor:
+            carregadores = [executor.submit(carregar_da_fila, fila_carga, pool, tabelas, modo, resultados)
+                            for _ in range(ligacoes)]
+            etapas = [
+                executor.submit(etapa, extrair_indicadores_para_fila, extrair, apis_who, concorrencia,
+                                fila_indicadores, cancelado),
+            ]
+            futuro_who = executor.submit(etapa, transformar_who_da_fila, fila_indicadores, tabelas, entregar,
+                                         cancelado)
+            etapas.append(futuro_who)
+            etapas.append(executor.submit(etapa, transformar_inquerito_sobreposto, futuro_who, tabelas, entregar,
+                                          tamanho_bloco, processos, dimensao_oms, juntar_oms, inspecionar))
+            if armazem:
+                # O armazém só precisa de todos_dados_who, já escrito quando futuro_who termina
+                etapas.append(executor.submit(
+                    etapa, lambda: futuro_who.result() and ArmazemWHO(armazem).construir_de_intermedio()))
+            wait(etapas)
+            for _ in carregadores:
+                fila_carga.put(None)
+            wait(carregadores)
+    finally:
+        cliente.fechar()
+        imprimir_resumo_api(cliente)
+        pool.fechar()
+
+    if erros:
+        raise erros[0]
+    falhas = [tabela for tabela, (_, erro) in resultados.items() if erro is not None]
+    for tabela in falhas:
+        print(f"[{tabela}] Carga falhou e foi desfeita: {resultados[tabela][1]}")
+    if falhas:
+        print(f"⚠️ {len(falhas)} de {len(tabelas)} tabelas não foram carregadas: {', '.join(falhas)}")
+    else:
+        print("✅ Pipeline concluído: todas as tabelas foram carregadas à medida que ficaram prontas.")
+    return resultados
 
 
-# ----------------------- Tabela 6: tabela_life_expectancy_at_60.csv -----------------------
-# ----------------------- Tabela 6: tabela_life_expectancy_at_60.csv -----------------------
-df6 = pd.read_csv("tabela_life_expectancy_at_60.csv")
+# Etapas do pipeline, pela ordem em que são executadas
+ETAPAS = {
+    "extracao": "Entregável 1 - inspeção do CSV e extração da API da WHO",
+    "transformacao": "Entregável 2 - limpeza, métricas e tabelas",
+    "carga": "Entregável 3 - carga no SQL Server",
+}
 
-# Substituir NaNs por None
-df6 = df6.where(pd.notnull(df6), None)
 
-# Verifica se há valores estranhos (opcional)
-#print(df6["country"].unique())
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pipeline de saúde mental e trabalho remoto (Entregáveis 1 a 3).")
+    parser.add_argument("--etapas", nargs="+", choices=list(ETAPAS), default=list(ETAPAS),
+                        help="Etapas a executar (por omissão, todas).")
+    parser.add_argument("--concorrencia", type=int, default=1,
+                        help="Número de pedidos simultâneos à API da WHO (1 = sequencial).")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Extrair os indicadores página a página, escrevendo diretamente no CSV.")
+    parser.add_argument("--cache", metavar="DIR", default=None,
+                        help=f"Usar cache local da API com pedidos condicionais (p.ex. {DIR_CACHE_GHO}).")
+    parser.add_argument("--apenas-novos", action="store_true",
+                        help="Com --cache, pedir apenas registos mais recentes do que os guardados.")
+    parser.add_argument("--formato", choices=list(EXTENSOES_INTERMEDIO), default=None,
+                        help=f"Formato dos ficheiros intermédios (por omissão, {FORMATO_INTERMEDIO}).")
+    parser.add_argument("--timeout-api", type=float, default=None, metavar="SEGUNDOS",
+                        help=f"Timeout de cada pedido à API da WHO (por omissão, {TIMEOUT_GHO} para ligação e leitura).")
+    parser.add_argument("--tentativas-api", type=int, default=TENTATIVAS_GHO, metavar="N",
+                        help="Tentativas por pedido à API, com backoff exponencial, em 429/5xx e erros de ligação.")
+    parser.add_argument("--pedidos-por-segundo", type=float, default=None, metavar="N",
+                        help="Limitar o ritmo de pedidos à API da WHO (por omissão, sem limite).")
+    parser.add_argument("--paises", nargs="+", metavar="ISO3", default=None,
+                        help="Extrair só estes países (códigos ISO3), filtrados no servidor.")
+    parser.add_argument("--anos", nargs=2, type=int, metavar=("INICIO", "FIM"), default=None,
+                        help="Extrair só os anos deste intervalo (inclusivo), filtrados no servidor.")
+    parser.add_argument("--sexo", nargs="+", metavar="DIM1", default=None,
+                        help="Extrair só estes valores de sexo (p.ex. SEX_BTSX); indicadores sem sexo mantêm-se.")
+    parser.add_argument("--projecao", action="store_true",
+                        help="Pedir à API só os campos usados pelo pipeline ($select).")
+    parser.add_argument("--armazem-who", metavar="FICHEIRO", nargs="?", const=ARMAZEM_WHO, default=None,
+                        help=f"Manter um armazém SQLite indexado dos dados da WHO (por omissão, {ARMAZEM_WHO}).")
+    parser.add_argument("--exportar-csv", action="store_true",
+                        help="Exportar também em CSV os ficheiros intermédios.")
+    parser.add_argument("--tamanho-bloco", type=int, default=None, metavar="N",
+                        help="Transformar o inquérito em blocos de N linhas, sem o carregar todo em memória.")
+    parser.add_argument("--processos", type=int, default=1, metavar="N",
+                        help="Calcular as tabelas agregadas do Entregável 2 em N processos (1 = em série).")
+    parser.add_argument("--oms-como-dimensao", action="store_true",
+                        help="Guardar e carregar as médias da OMS numa tabela por região, sem as repetir no inquérito.")
+    parser.add_argument("--juntar-oms", action="store_true",
+                        help="Com --oms-como-dimensao, gerar também a tabela larga (em blocos).")
+    parser.add_argument("--metricas-incrementais", metavar="ESTADO", nargs="?", const=ESTADO_METRICAS_INQUERITO,
+                        default=None,
+                        help="Atualizar as métricas do inquérito só com as linhas acrescentadas desde a última "
+                             f"execução (agregados em ESTADO, por omissão {ESTADO_METRICAS_INQUERITO}).")
+    parser.add_argument("--relatorio-memoria", action="store_true",
+                        help="Comparar a memória do inquérito com e sem o esquema compacto.")
+    parser.add_argument("--cache-etapas", metavar="DIR", nargs="?", const=DIR_CACHE_ETAPAS, default=None,
+                        help=f"Saltar etapas cujas entradas não mudaram (cache em DIR, por omissão {DIR_CACHE_ETAPAS}).")
+    parser.add_argument("--max-entradas-cache", type=int, default=MAX_ENTRADAS_CACHE, metavar="N",
+                        help="Chaves guardadas por etapa na cache de etapas (as mais antigas são apagadas).")
+    parser.add_argument("--config-bd", metavar="FICHEIRO", default=None,
+                        help=f"Configuração JSON da base de dados (por omissão, {CAMINHO_CONFIG_BD} se existir).")
+    parser.add_argument("--ligacoes", type=int, default=1, metavar="N",
+                        help="Ligações à base de dados para carregar tabelas em simultâneo (1 = em série).")
+    parser.add_argument("--modo-carga", choices=MODOS_CARGA, default="inserir",
+                        help="inserir: acrescentar as linhas; upsert: inserir ou atualizar pelas chaves naturais.")
+    parser.add_argument("--sobrepor", action="store_true",
+                        help="Executar as três etapas sobrepostas: cada indicador é transformado logo que extraído "
+                             "e cada tabela carregada logo que escrita.")
+    parser.add_argument("--tamanho-fila", type=int, default=TAMANHO_FILA_PIPELINE, metavar="N",
+                        help="Com --sobrepor, indicadores ou tabelas em espera entre duas etapas.")
+    parser.add_argument("--verboso", action="store_true",
+                        help="Imprimir os diagnósticos completos do inquérito (describe, valores únicos).")
+    parser.add_argument("--relatorio-etapas", metavar="FICHEIRO", default=None,
+                        help="Guardar tempo, CPU, memória e linhas de cada etapa em JSON ou CSV (pela extensão).")
+    args = parser.parse_args(argv)
+    if args.sobrepor and set(args.etapas) != set(ETAPAS):
+        parser.error("--sobrepor executa sempre as três etapas; não pode ser usado com --etapas")
+    if args.sobrepor:
+        ignoradas = [opcao for opcao, valor in (("--cache-etapas", args.cache_etapas),
+                                                 ("--metricas-incrementais", args.metricas_incrementais),
+                                                 ("--relatorio-memoria", args.relatorio_memoria)) if valor]
+        if ignoradas:
+            parser.error(f"--sobrepor não pode ser usado com {', '.join(ignoradas)}")
+
+    configurar_intermedios(args.formato, args.exportar_csv)
+    configurar_instrumentacao(args.verboso)
+    cache = CacheEtapas(args.cache_etapas, args.max_entradas_cache) if args.cache_etapas else None
 
-for idx, row in df6.iterrows():
     try:
-        placeholders = ','.join(['?'] * len(row))
-        query = f"INSERT INTO life_expectancy_at_60 VALUES ({placeholders})"
-        cursor.execute(query, tuple(row))
-    except Exception as e:
-        print(f"[life_expectancy_at_60] Erro na linha {idx}: {e}")
-        print(row)
+        if args.sobrepor:
+            executar_pipeline_sobreposto(
+                concorrencia=args.concorrencia,
+                streaming=args.streaming,
+                dir_cache=args.cache,
+                apenas_novos=args.apenas_novos,
+                timeout=args.timeout_api,
+                tentativas=args.tentativas_api,
+                pedidos_por_segundo=args.pedidos_por_segundo,
+                consulta=ConsultaGHO(args.paises, args.anos[0] if args.anos else None,
+                                     args.anos[1] if args.anos else None, args.sexo,
+                                     CAMPOS_SELECT_GHO if args.projecao else None),
+                armazem=args.armazem_who,
+                tamanho_bloco=args.tamanho_bloco,
+                processos=args.processos,
+                dimensao_oms=args.oms_como_dimensao,
+                juntar_oms=args.juntar_oms,
+                config=carregar_config_bd(args.config_bd),
+                ligacoes=args.ligacoes,
+                modo=args.modo_carga,
+                tamanho_fila=args.tamanho_fila,
+            )
+            return
+        if "extracao" in args.etapas:
+            executar_entregavel_1(
+                concorrencia=args.concorrencia,
+                streaming=args.streaming,
+                dir_cache=args.cache,
+                apenas_novos=args.apenas_novos,
+                timeout=args.timeout_api,
+                tentativas=args.tentativas_api,
+                pedidos_por_segundo=args.pedidos_por_segundo,
+                paises=args.paises,
+                ano_inicio=args.anos[0] if args.anos else None,
+                ano_fim=args.anos[1] if args.anos else None,
+                sexos=args.sexo,
+                projecao=args.projecao,
+                armazem=args.armazem_who,
+            )
+        if "transformacao" in args.etapas:
+            executar_entregavel_2(relatorio_memoria=args.relatorio_memoria, tamanho_bloco=args.tamanho_bloco,
+                                  processos=args.processos, cache=cache,
+                                  dimensao_oms=args.oms_como_dimensao, juntar_oms=args.juntar_oms,
+                                  incremental=args.metricas_incrementais)
+        if "carga" in args.etapas:
+            executar_entregavel_3(cache=cache, config=carregar_config_bd(args.config_bd), ligacoes=args.ligacoes,
+                                  modo=args.modo_carga, dimensao_oms=args.oms_como_dimensao)
+    finally:
+        # Também em caso de erro, para se ver até onde o pipeline chegou
+        if args.relatorio_etapas:
+            caminho = guardar_relatorio_etapas(args.relatorio_etapas)
+            print(f"Relatório de etapas ({len(REGISTO_ETAPAS)} registos) guardado em '{caminho}'.")
 
 
-
-# Finalização
-conn.commit()
-cursor.close()
-conn.close()
-print("✅ Todos os dados foram inseridos no SQL Server com sucesso.")
+if __name__ == "__main__":
+    main()
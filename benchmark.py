@@ -0,0 +1,717 @@
+# Benchmarks do pipeline (II.py) com dados sintéticos: não precisa do CSV real,
+# da API da WHO nem do SQL Server.
+#
+# Pipeline completo (extração, transformação, agregação, merge e carga) a vários tamanhos,
+# cada um num processo à parte, comparado com a baseline guardada:
+#     python benchmark.py suite --tamanhos 10000 1000000 10000000
+#     python benchmark.py suite --guardar-baseline
+#
+# Uma só execução do pipeline:
+#     python benchmark.py pipeline --linhas 1000000
+#
+# Escalabilidade do cálculo das tabelas agregadas do inquérito, de 1 a N processos:
+#     python benchmark.py escalabilidade --linhas 10000000 --processos 1 2 4 8
+#
+# Extração contra uma API local que falha uma fração dos pedidos (429/503) e responde
+# com latência, para validar repetições, limite de ritmo e latência dos pedidos:
+#     python benchmark.py api --falhas 0.3 --latencia 0.05 --concorrencia 1 4 8
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import II
+
+##########################################################################################################################
+################################################### Dados sintéticos ####################################################
+##########################################################################################################################
+
+# Valores possíveis de cada coluna categórica, como no inquérito original
+VALORES_INQUERITO = {
+    "Gender": ["Female", "Male", "Non-binary", "Prefer not to say"],
+    "Job_Role": ["Data Scientist", "HR", "Sales", "Software Engineer", "Marketing",
+                 "Project Manager", "Designer"],
+    "Industry": ["Education", "Finance", "Healthcare", "IT", "Manufacturing", "Retail", "Consulting"],
+    "Work_Location": ["Hybrid", "Onsite", "Remote"],
+    "Stress_Level": ["High", "Low", "Medium"],
+    "Mental_Health_Condition": ["Anxiety", "Burnout", "Depression", "None"],
+    "Access_to_Mental_Health_Resources": ["No", "Yes"],
+    "Productivity_Change": ["Decrease", "Increase", "No Change"],
+    "Satisfaction_with_Remote_Work": ["Neutral", "Satisfied", "Unsatisfied"],
+    "Physical_Activity": ["Daily", "None", "Weekly"],
+    "Sleep_Quality": ["Average", "Good", "Poor"],
+    "Region": ["Africa", "Asia", "Europe", "North America", "Oceania", "South America"],
+}
+
+# Intervalos (inclusivos) das colunas inteiras
+INTERVALOS_INQUERITO = {
+    "Age": (22, 60),
+    "Years_of_Experience": (1, 35),
+    "Hours_Worked_Per_Week": (20, 60),
+    "Number_of_Virtual_Meetings": (0, 15),
+    "Work_Life_Balance_Rating": (1, 5),
+    "Social_Isolation_Rating": (1, 5),
+    "Company_Support_for_Remote_Work": (1, 5),
+}
+
+# Países (ISO3) de todos os continentes, incluindo agregados da WHO que não mapeiam
+PAISES_SINTETICOS = [
+    "PRT", "ESP", "FRA", "DEU", "ITA", "GBR", "POL", "USA", "CAN", "MEX", "BRA", "ARG",
+    "CHL", "COL", "NGA", "ZAF", "EGY", "KEN", "IND", "CHN", "JPN", "IDN", "AUS", "NZL",
+    "FJI", "TLS", "XKX", "AFR", "EUR", "GLOBAL",
+]
+ANOS_SINTETICOS = list(range(2000, 2024))
+SEXOS_SINTETICOS = ["SEX_MLE", "SEX_FMLE", "SEX_BTSX"]
+
+
+def gerar_inquerito_sintetico(n_linhas: int, semente: int = 0) -> pd.DataFrame:
+    # Inquérito com as colunas e tipos de ESQUEMA_INQUERITO, tal como sai de carregar_inquerito
+    rng = np.random.default_rng(semente)
+    colunas = {"Employee_ID": [f"EMP{i:07d}" for i in range(n_linhas)]}
+    for coluna, valores in VALORES_INQUERITO.items():
+        codigos = rng.integers(0, len(valores), n_linhas, dtype=np.int8)
+        colunas[coluna] = pd.Categorical.from_codes(codigos, categories=valores)
+    for coluna, (minimo, maximo) in INTERVALOS_INQUERITO.items():
+        tipo = II.ESQUEMA_INQUERITO[coluna]
+        colunas[coluna] = rng.integers(minimo, maximo + 1, n_linhas).astype(tipo)
+    return pd.DataFrame(colunas)
+
+
+def gerar_registos_gho(codigo: str, inicio: int, fim: int, semente: int = 0) -> list:
+    # Registos OData do GHO nas posições [inicio, fim) de um indicador. Sexo, país e ano
+    # seguem a posição, com o sexo a variar mais depressa: como no GHO, cada país e ano
+    # tem as linhas dos três sexos. Os valores têm o formato de cada indicador (intervalo
+    # para a esperança de vida, Yes/No para MH_3, número simples para os restantes)
+    posicoes = np.arange(inicio, fim)
+    rng = np.random.default_rng([semente, zlib.crc32(codigo.encode()), inicio])
+    sexos = np.array(SEXOS_SINTETICOS)[posicoes % len(SEXOS_SINTETICOS)]
+    paises = np.array(PAISES_SINTETICOS)[(posicoes // len(SEXOS_SINTETICOS)) % len(PAISES_SINTETICOS)]
+    anos = np.array(ANOS_SINTETICOS)[
+        (posicoes // (len(SEXOS_SINTETICOS) * len(PAISES_SINTETICOS))) % len(ANOS_SINTETICOS)]
+
+    if codigo == "MH_3":
+        valores = rng.choice(["Yes", "No", "Yes ", "-"], len(posicoes)).tolist()
+    elif codigo == "WHOSIS_000015":
+        media = rng.uniform(15, 25, len(posicoes))
+        valores = [f"{m:.1f} [{m - 0.5:.1f}-{m + 0.5:.1f}]" for m in media]
+    else:
+        valores = [f"{v:.3f}" for v in rng.uniform(0, 50, len(posicoes))]
+
+    return [
+        {"IndicatorCode": codigo, "SpatialDim": pais, "TimeDim": int(ano), "Dim1": sexo, "Dim2": None,
+         "Dim3": None, "ValueType": "numeric", "DataSourceDim": None, "Value": valor}
+        for pais, ano, sexo, valor in zip(paises.tolist(), anos, sexos.tolist(), valores)
+    ]
+
+
+_TOKENS_ODATA = re.compile(r"\(|\)|'(?:[^']|'')*'|[-+]?\d+(?:\.\d+)?|\w+")
+_OPERADORES_ODATA = {
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "ge": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "le": lambda a, b: a is not None and a <= b,
+}
+
+
+def filtro_odata(expressao: str):
+    # Predicado sobre um registo para o subconjunto de $filter que o pipeline gera:
+    # comparações campo-literal (eq, ne, gt, ge, lt, le) com and, or e parênteses
+    tokens = _TOKENS_ODATA.findall(expressao)
+    posicao = 0
+
+    def seguinte():
+        nonlocal posicao
+        posicao += 1
+        return tokens[posicao - 1]
+
+    def literal(token):
+        if token == "null":
+            return None
+        if token.startswith("'"):
+            return token[1:-1].replace("''", "'")
+        return float(token) if "." in token else int(token)
+
+    def atomo():
+        if tokens[posicao] == "(":
+            seguinte()
+            predicado = ou()
+            seguinte()  # ")"
+            return predicado
+        campo, operador, valor = seguinte(), _OPERADORES_ODATA[seguinte()], literal(seguinte())
+        return lambda registo: operador(registo.get(campo), valor)
+
+    def e():
+        partes = [atomo()]
+        while posicao < len(tokens) and tokens[posicao] == "and":
+            seguinte()
+            partes.append(atomo())
+        return lambda registo: all(parte(registo) for parte in partes)
+
+    def ou():
+        partes = [e()]
+        while posicao < len(tokens) and tokens[posicao] == "or":
+            seguinte()
+            partes.append(e())
+        return lambda registo: any(parte(registo) for parte in partes)
+
+    return ou()
+
+
+class _PedidoGHO(BaseHTTPRequestHandler):
+    # Endpoint OData mínimo: GET /api/<codigo>[?$top=&$skip=], com @odata.nextLink.
+    # As páginas são geradas no momento, por isso o servidor não guarda o indicador inteiro.
+    # Com falhas > 0, essa fração dos pedidos recebe 429 (com Retry-After) ou 503.
+    # $filter e $select são aplicados ao indicador inteiro, gerado de uma vez, antes de paginar.
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        servidor = self.server
+        with servidor.lock:
+            servidor.pedidos += 1
+            falha = servidor.aleatorio.random() < servidor.falhas
+            estado = servidor.aleatorio.choice([429, 503])
+        if servidor.latencia:
+            time.sleep(servidor.latencia)
+        if falha:
+            with servidor.lock:
+                servidor.falhados += 1
+            self.send_response(estado)
+            if estado == 429:
+                self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        codigo = url.path.rstrip("/").split("/")[-1]
+        if codigo not in II.apis_who:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        total = self.server.registos_por_indicador
+        inicio = int(params.get("$skip", [0])[0])
+        if "$filter" in params or "$select" in params:
+            registos = gerar_registos_gho(codigo, 0, total, self.server.semente)
+            if "$filter" in params:
+                registos = list(filter(filtro_odata(params["$filter"][0]), registos))
+            if "$select" in params:
+                campos = params["$select"][0].split(",")
+                registos = [{campo: registo.get(campo) for campo in campos} for registo in registos]
+            total = len(registos)
+            fim = min(total, inicio + int(params.get("$top", [total])[0]))
+            resposta = {"value": registos[inicio:fim]}
+        else:
+            fim = min(total, inicio + int(params.get("$top", [total])[0]))
+            resposta = {"value": gerar_registos_gho(codigo, inicio, fim, self.server.semente)}
+        if "$top" in params and fim < total:
+            seguinte = {chave: valores[0] for chave, valores in params.items()}
+            seguinte.update({"$top": fim - inicio, "$skip": fim})
+            resposta["@odata.nextLink"] = (
+                f"http://{self.headers['Host']}{url.path}?{urllib.parse.urlencode(seguinte, safe='$,')}"
+            )
+
+        corpo = json.dumps(resposta).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+
+def iniciar_servidor_gho(registos_por_indicador: int, semente: int = 0, falhas: float = 0.0,
+                         latencia: float = 0.0) -> ThreadingHTTPServer:
+    # Servidor local numa thread; o URL base da API é f"http://127.0.0.1:{porta}/api".
+    # falhas: fração de pedidos respondidos com 429/503; latencia: segundos por pedido.
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _PedidoGHO)
+    servidor.registos_por_indicador = registos_por_indicador
+    servidor.semente = semente
+    servidor.falhas = falhas
+    servidor.latencia = latencia
+    servidor.aleatorio = random.Random(semente)
+    servidor.lock = threading.Lock()
+    servidor.pedidos = 0
+    servidor.falhados = 0
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def criar_bd_sqlite(caminho: str, dimensao_oms: bool = False) -> dict:
+    # Base de dados local (DB-API) com as tabelas do Entregável 3, colunas tiradas dos
+    # intermédios. As tabelas da dimensão da OMS ficam por criar: o pipeline cria-as com
+    # a DDL de II.DDL_DIMENSAO_OMS, como numa base de dados que só tem as tabelas
+    # originais. Devolve a configuração de ligação para executar_entregavel_3.
+    if os.path.exists(caminho):
+        os.remove(caminho)
+    with contextlib.closing(sqlite3.connect(caminho)) as conn:
+        for tabela, (nome, _) in II.tabelas_sql(dimensao_oms).items():
+            if tabela in II.DDL_DIMENSAO_OMS:
+                continue
+            colunas = II.ler_intermedio(nome).columns
+            conn.execute(f"CREATE TABLE {tabela} ({', '.join(f'c{i}' for i in range(len(colunas)))})")
+        conn.commit()
+    return {**II.CONFIG_BD_OMISSAO, "tipo": "sqlite", "caminho": caminho}
+
+
+def conteudo_bd(caminho: str) -> dict:
+    # Linhas de cada tabela, ordenadas, para comparar cargas independentemente da ordem
+    with contextlib.closing(sqlite3.connect(caminho)) as conn:
+        tabelas = [linha[0] for linha in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return {tabela: sorted(conn.execute(f"SELECT * FROM {tabela}").fetchall(), key=repr) for tabela in tabelas}
+
+##########################################################################################################################
+###################################################### Medições ##########################################################
+##########################################################################################################################
+
+# Fase do pipeline de cada etapa instrumentada em II.py (pelo prefixo do nome)
+FASES = {
+    "extracao": ("extracao",),
+    "transformacao": ("inquerito:", "who:leitura", "who:mapeamento_regioes", "who:normalizacao"),
+    "agregacao": ("who:agregacao", "metricas:inquerito", "metricas:agregados_inquerito", "tabela:"),
+    "merge": ("metricas:merge_oms",),
+    "escrita": ("escrita",),
+    "carga": ("carga",),
+}
+
+
+def medir(funcao, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = funcao(*args, **kwargs)
+    return resultado, time.perf_counter() - inicio
+
+
+def resumir_fases(registos: list) -> dict:
+    # Soma tempos e linhas das etapas de cada fase; a memória é o maior pico das suas etapas
+    resumo = {}
+    for fase, prefixos in FASES.items():
+        etapas = [r for r in registos if r["etapa"].startswith(prefixos)]
+        if not etapas:
+            continue
+        picos = [r["pico_memoria_mb"] for r in etapas if r["pico_memoria_mb"] is not None]
+        resumo[fase] = {
+            "segundos": round(sum(r["segundos"] for r in etapas), 4),
+            "cpu_segundos": round(sum(r["cpu_segundos"] for r in etapas), 4),
+            "pico_memoria_mb": max(picos) if picos else None,
+            "etapas": len(etapas),
+        }
+    return resumo
+
+
+def executar_pipeline_sintetico(n_linhas: int, linhas_who: int, semente: int = 0, processos: int = 1,
+                                tamanho_bloco: int | None = None, ligacoes: int = 1, verboso: bool = False,
+                                dimensao_oms: bool = False, sobreposto: bool = False, latencia: float = 0.0) -> dict:
+    # Corre as três etapas na pasta atual, com o inquérito sintético em CSV, a API servida
+    # localmente (extração em streaming) e a carga num SQLite. Com sobreposto, corre depois
+    # o mesmo pipeline com as etapas sobrepostas e compara as tabelas carregadas.
+    II.REGISTO_ETAPAS.clear()
+    totais = {}
+    registos_por_indicador = max(1, linhas_who // len(II.apis_who))
+
+    _, totais["geracao"] = medir(lambda: gerar_inquerito_sintetico(n_linhas, semente).to_csv(II.CSV_INQUERITO, index=False))
+
+    with contextlib.ExitStack() as pilha:
+        if not verboso:
+            pilha.enter_context(contextlib.redirect_stdout(pilha.enter_context(open(os.devnull, "w"))))
+        servidor = iniciar_servidor_gho(registos_por_indicador, semente, latencia=latencia)
+        try:
+            base_url = f"http://127.0.0.1:{servidor.server_port}/api"
+            # Comparado com o modo sobreposto, que não corre um flow do Prefect, sem o arranque deste
+            fluxo = II.fluxo_extracao_todos_codigos.fn if sobreposto else II.fluxo_extracao_todos_codigos
+            _, totais["extracao"] = medir(fluxo, base_url=base_url, streaming=True)
+        finally:
+            servidor.shutdown()
+
+        _, totais["transformacao"] = medir(II.executar_entregavel_2, tamanho_bloco=tamanho_bloco, processos=processos,
+                                           dimensao_oms=dimensao_oms)
+
+        config = criar_bd_sqlite("benchmark.sqlite", dimensao_oms)
+        carga, totais["carga"] = medir(II.executar_entregavel_3, config=config, ligacoes=ligacoes,
+                                       dimensao_oms=dimensao_oms)
+        etapas = list(II.REGISTO_ETAPAS)
+
+        iguais = None
+        if sobreposto:
+            # Base de dados nova com as mesmas tabelas (criadas a partir dos intermédios já escritos)
+            referencia = conteudo_bd(config["caminho"])
+            config = criar_bd_sqlite("benchmark.sqlite", dimensao_oms)
+            servidor = iniciar_servidor_gho(registos_por_indicador, semente, latencia=latencia)
+            try:
+                _, totais["sobreposto"] = medir(
+                    II.executar_pipeline_sobreposto, base_url=f"http://127.0.0.1:{servidor.server_port}/api",
+                    streaming=True, tamanho_bloco=tamanho_bloco, processos=processos, dimensao_oms=dimensao_oms,
+                    config=config, ligacoes=ligacoes, inspecionar=False,
+                )
+            finally:
+                servidor.shutdown()
+            iguais = conteudo_bd(config["caminho"]) == referencia
+
+    resultado = {
+        "linhas": n_linhas,
+        "linhas_who": linhas_who,
+        "totais": {nome: round(segundos, 4) for nome, segundos in totais.items()},
+        "fases": resumir_fases(etapas),
+        "etapas": etapas,
+        # Linhas inseridas por tabela (None se a carga da tabela falhou)
+        "carregadas": {tabela: inseridas for tabela, (inseridas, _) in carga.items()},
+    }
+    if sobreposto:
+        resultado["sobreposto_igual"] = iguais
+    return resultado
+
+
+def comparar_com_baseline(resultados: dict, baseline: dict, tolerancia: float, minimo_segundos: float) -> list:
+    # Regressão: fase mais lenta (ou com mais memória) do que a baseline além da tolerância.
+    # Fases abaixo de minimo_segundos são ignoradas no tempo, por serem sobretudo ruído.
+    regressoes = []
+    for tamanho, resultado in resultados.items():
+        base = baseline.get(tamanho)
+        if base is None:
+            continue
+        for fase, atual in resultado["fases"].items():
+            anterior = base["fases"].get(fase)
+            if anterior is None:
+                continue
+            if (atual["segundos"] > anterior["segundos"] * (1 + tolerancia)
+                    and atual["segundos"] - anterior["segundos"] > minimo_segundos):
+                regressoes.append(f"{tamanho} linhas, {fase}: {anterior['segundos']:.3f} s -> {atual['segundos']:.3f} s")
+            if (atual["pico_memoria_mb"] and anterior["pico_memoria_mb"]
+                    and atual["pico_memoria_mb"] > anterior["pico_memoria_mb"] * (1 + tolerancia)):
+                regressoes.append(f"{tamanho} linhas, {fase}: memória {anterior['pico_memoria_mb']:.0f} MB -> "
+                                  f"{atual['pico_memoria_mb']:.0f} MB")
+    return regressoes
+
+
+def tabelas_vazias(resultados: dict) -> list:
+    # Tabelas que ficaram sem linhas (ou cuja carga falhou): os tempos dessas execuções
+    # não medem o pipeline completo
+    return [f"{tamanho} linhas, {tabela}"
+            for tamanho, resultado in resultados.items()
+            for tabela, inseridas in resultado["carregadas"].items() if not inseridas]
+
+
+def tabela_resultados(resultados: dict) -> pd.DataFrame:
+    linhas = [
+        {"linhas": int(tamanho), "fase": fase, **{k: v for k, v in medidas.items() if k != "etapas"}}
+        for tamanho, resultado in resultados.items()
+        for fase, medidas in resultado["fases"].items()
+    ]
+    return pd.DataFrame(linhas)
+
+
+def mesmos_resultados(a: dict, b: dict) -> bool:
+    return all(a[nome].equals(b[nome]) for nome in a)
+
+
+def escalabilidade_metricas(df: pd.DataFrame, lista_processos: list) -> pd.DataFrame:
+    # Tempo de AgregadosInquerito em série e em paralelo; confirma que os resultados coincidem
+    serie, t_serie = medir(lambda: II.AgregadosInquerito().atualizar(df).resultados())
+    linhas = [{"processos": 1, "segundos": t_serie, "aceleracao": 1.0, "igual_a_serie": True}]
+    for processos in lista_processos:
+        if processos <= 1:
+            continue
+        resultado, segundos = medir(lambda: II.agregar_inquerito_em_paralelo(df, processos).resultados())
+        linhas.append({
+            "processos": processos,
+            "segundos": segundos,
+            "aceleracao": t_serie / segundos,
+            "igual_a_serie": mesmos_resultados(serie, resultado),
+        })
+    return pd.DataFrame(linhas).round(3)
+
+##########################################################################################################################
+###################################################### Execução ##########################################################
+##########################################################################################################################
+
+def comando_pipeline(args):
+    dir_trabalho = args.dir_trabalho or tempfile.mkdtemp(prefix="benchmark_")
+    os.makedirs(dir_trabalho, exist_ok=True)
+    os.chdir(dir_trabalho)
+    linhas_who = args.linhas_who if args.linhas_who is not None else args.linhas
+    resultado = executar_pipeline_sintetico(args.linhas, linhas_who, args.semente, args.processos,
+                                            args.tamanho_bloco, args.ligacoes, args.verboso, args.oms_como_dimensao,
+                                            args.sobreposto, args.latencia_api)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2)
+    print(tabela_resultados({str(args.linhas): resultado}).to_string(index=False))
+    if args.sobreposto:
+        totais = resultado["totais"]
+        etapas = [totais[etapa] for etapa in ("extracao", "transformacao", "carga")]
+        print(f"\nEtapa a etapa: {sum(etapas):.2f} s (mais lenta {max(etapas):.2f} s); "
+              f"sobreposto: {totais['sobreposto']:.2f} s ({sum(etapas) / totais['sobreposto']:.2f}x); "
+              f"tabelas iguais: {resultado['sobreposto_igual']}")
+    vazias = tabelas_vazias({str(args.linhas): resultado})
+    for vazia in vazias:
+        print(f"⚠️ Tabela sem linhas carregadas: {vazia}")
+    # Com --sobreposto, tabelas diferentes das da execução etapa a etapa também falham
+    return 1 if vazias or resultado.get("sobreposto_igual") is False else 0
+
+
+def comando_suite(args):
+    # Cada tamanho corre num processo novo, para que o pico de memória seja só o seu
+    resultados = {}
+    for tamanho in args.tamanhos:
+        with tempfile.TemporaryDirectory(prefix="benchmark_") as pasta:
+            saida = os.path.join(pasta, "resultado.json")
+            comando = [sys.executable, os.path.abspath(__file__), "pipeline", "--linhas", str(tamanho),
+                       "--semente", str(args.semente), "--processos", str(args.processos),
+                       "--dir-trabalho", pasta, "--saida", saida]
+            if args.linhas_who is not None:
+                comando += ["--linhas-who", str(args.linhas_who)]
+            if args.tamanho_bloco:
+                comando += ["--tamanho-bloco", str(args.tamanho_bloco)]
+            comando += ["--ligacoes", str(args.ligacoes)]
+            if args.oms_como_dimensao:
+                comando.append("--oms-como-dimensao")
+            print(f"[Benchmark] - {tamanho} linhas...")
+            # Com o resultado guardado, um código de saída não nulo indica tabelas vazias,
+            # verificadas abaixo para todos os tamanhos
+            processo = subprocess.run(comando, stdout=subprocess.DEVNULL)
+            if not os.path.exists(saida):
+                processo.check_returncode()
+            with open(saida, encoding="utf-8") as f:
+                resultados[str(tamanho)] = json.load(f)
+
+    print(tabela_resultados(resultados).to_string(index=False))
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, indent=2)
+    print(f"Resultados guardados em '{args.saida}'.")
+    vazias = tabelas_vazias(resultados)
+    for vazia in vazias:
+        print(f"⚠️ Tabela sem linhas carregadas: {vazia}")
+    if vazias:
+        # Uma execução que não carrega todas as tabelas não serve de baseline nem de comparação
+        return 1
+
+    if args.guardar_baseline or not os.path.exists(args.baseline):
+        # Tamanhos já na baseline e não medidos agora mantêm-se
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(resultados)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline guardada em '{args.baseline}'.")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressoes = comparar_com_baseline(resultados, baseline, args.tolerancia, args.minimo_segundos)
+    for regressao in regressoes:
+        print(f"⚠️ Regressão: {regressao}")
+    if not regressoes:
+        print("✅ Sem regressões em relação à baseline.")
+    return 1 if regressoes else 0
+
+
+def comando_api(args):
+    # Extração completa contra o servidor com falhas, para cada concorrência, comparada
+    # com a extração sem falhas: nenhum indicador pode ficar de fora
+    dir_trabalho = args.dir_trabalho or tempfile.mkdtemp(prefix="benchmark_")
+    os.makedirs(dir_trabalho, exist_ok=True)
+    os.chdir(dir_trabalho)
+    consulta = {
+        "paises": args.paises,
+        "ano_inicio": args.anos[0] if args.anos else None,
+        "ano_fim": args.anos[1] if args.anos else None,
+        "sexos": args.sexo,
+        "projecao": args.projecao,
+    }
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        servidor = iniciar_servidor_gho(args.registos, args.semente)
+        try:
+            # Mesma paginação: os valores sintéticos dependem do início de cada página
+            II.fluxo_extracao_todos_codigos(base_url=f"http://127.0.0.1:{servidor.server_port}/api",
+                                            streaming=args.streaming, tamanho_pagina=args.tamanho_pagina,
+                                            **consulta)
+        finally:
+            servidor.shutdown()
+    referencia = II.ler_intermedio("todos_dados_who")
+
+    linhas = []
+    for concorrencia in args.concorrencia:
+        servidor = iniciar_servidor_gho(args.registos, args.semente, args.falhas, args.latencia)
+        base_url = f"http://127.0.0.1:{servidor.server_port}/api"
+        inicio = time.perf_counter()
+        resumo = {"bytes": 0}
+        try:
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                resumo = II.fluxo_extracao_todos_codigos(
+                    concorrencia=concorrencia, base_url=base_url, streaming=args.streaming,
+                    tamanho_pagina=args.tamanho_pagina, tentativas=args.tentativas,
+                    pedidos_por_segundo=args.pedidos_por_segundo, **consulta,
+                )
+            pd.testing.assert_frame_equal(II.ler_intermedio("todos_dados_who"), referencia)
+            completo = True
+        except (II.ErroAPIGHO, AssertionError):
+            # AssertionError: dados diferentes dos extraídos sem falhas
+            completo = False
+        finally:
+            servidor.shutdown()
+        linhas.append({
+            "concorrencia": concorrencia,
+            "segundos": round(time.perf_counter() - inicio, 3),
+            "pedidos": servidor.pedidos,
+            "falhados": servidor.falhados,
+            "mb_recebidos": round(resumo["bytes"] / 1e6, 3),
+            "linhas": len(referencia),
+            "completo": completo,
+        })
+    print(pd.DataFrame(linhas).to_string(index=False))
+    return 0 if all(linha["completo"] for linha in linhas) else 1
+
+
+def comando_blocos(args):
+    # Transformação em blocos comparada, para cada formato intermédio, com a transformação
+    # em memória. O inquérito é ordenado por região, pelo que cada bloco traz categorias que
+    # os anteriores não tinham (o caso que obriga o Feather a acumular os dicionários).
+    dir_trabalho = args.dir_trabalho or tempfile.mkdtemp(prefix="benchmark_")
+    os.makedirs(dir_trabalho, exist_ok=True)
+    os.chdir(dir_trabalho)
+    inquerito = gerar_inquerito_sintetico(args.linhas, args.semente).sort_values(["Region", "Industry"])
+    inquerito.to_csv(II.CSV_INQUERITO, index=False)
+
+    linhas = []
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        servidor = iniciar_servidor_gho(max(1, args.linhas // len(II.apis_who)), args.semente)
+        try:
+            II.fluxo_extracao_todos_codigos.fn(base_url=f"http://127.0.0.1:{servidor.server_port}/api",
+                                               streaming=True)
+        finally:
+            servidor.shutdown()
+        dados_who = II.ler_intermedio("todos_dados_who")
+        for formato in args.formatos:
+            II.configurar_intermedios(formato)
+            II.guardar_intermedio(dados_who, "todos_dados_who")
+            II.executar_entregavel_2()
+            referencia = {nome: II.ler_intermedio(nome) for nome in II.SAIDAS_ENTREGAVEL_2}
+            for tamanho_bloco in args.tamanho_bloco:
+                try:
+                    II.executar_entregavel_2(tamanho_bloco=tamanho_bloco)
+                    diferentes = []
+                    for nome, esperado in referencia.items():
+                        try:
+                            # Categorias podem vir noutra ordem; os valores têm de coincidir
+                            pd.testing.assert_frame_equal(II.ler_intermedio(nome).astype(object),
+                                                          esperado.astype(object), check_dtype=False)
+                        except AssertionError:
+                            diferentes.append(nome)
+                    erro = None
+                except Exception as excecao:
+                    diferentes, erro = [], f"{type(excecao).__name__}: {excecao}"
+                linhas.append({
+                    "formato": formato,
+                    "tamanho_bloco": tamanho_bloco,
+                    "igual_a_memoria": erro is None and not diferentes,
+                    "diferentes": ", ".join(diferentes) or "-",
+                    "erro": (erro or "-")[:80],
+                })
+    print(pd.DataFrame(linhas).to_string(index=False))
+    return 0 if all(linha["igual_a_memoria"] for linha in linhas) else 1
+
+
+def comando_escalabilidade(args):
+    df, segundos = medir(gerar_inquerito_sintetico, args.linhas, args.semente)
+    print(f"Inquérito sintético: {args.linhas} linhas geradas em {segundos:.1f} s")
+    df = II.limpar_e_normalizar(df)
+    df["Mental_Wellness_Index"] = II.indice_bem_estar(df)
+
+    print("\n[Benchmark] - Tabelas agregadas do inquérito por número de processos:")
+    print(escalabilidade_metricas(df, args.processos).to_string(index=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks do pipeline com dados sintéticos.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    def opcoes_pipeline(sub):
+        sub.add_argument("--linhas-who", type=int, default=None,
+                         help="Registos da WHO no total dos indicadores (por omissão, igual às linhas do inquérito).")
+        sub.add_argument("--processos", type=int, default=1, help="Processos do Entregável 2.")
+        sub.add_argument("--tamanho-bloco", type=int, default=None, help="Transformar o inquérito em blocos.")
+        sub.add_argument("--ligacoes", type=int, default=1, help="Ligações da carga (tabelas em simultâneo).")
+        sub.add_argument("--oms-como-dimensao", action="store_true",
+                         help="Médias da OMS numa tabela por região em vez da tabela larga.")
+        sub.add_argument("--semente", type=int, default=0)
+
+    suite = comandos.add_parser("suite", help="Pipeline completo a vários tamanhos, comparado com a baseline.")
+    suite.add_argument("--tamanhos", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    suite.add_argument("--baseline", default="benchmark_baseline.json")
+    suite.add_argument("--guardar-baseline", action="store_true",
+                       help="Substituir a baseline pelos resultados desta execução.")
+    suite.add_argument("--saida", default="benchmark_resultados.json")
+    suite.add_argument("--tolerancia", type=float, default=0.2,
+                       help="Aumento relativo (tempo ou memória) a partir do qual há regressão.")
+    suite.add_argument("--minimo-segundos", type=float, default=0.05,
+                       help="Diferença de tempo mínima para contar como regressão.")
+    opcoes_pipeline(suite)
+    suite.set_defaults(funcao=comando_suite)
+
+    pipeline = comandos.add_parser("pipeline", help="Uma execução do pipeline completo.")
+    pipeline.add_argument("--linhas", type=int, default=10_000)
+    pipeline.add_argument("--dir-trabalho", default=None, help="Pasta onde correr (por omissão, temporária).")
+    pipeline.add_argument("--saida", default=None, help="Guardar o resultado em JSON.")
+    pipeline.add_argument("--verboso", action="store_true", help="Mostrar o output do pipeline.")
+    pipeline.add_argument("--sobreposto", action="store_true",
+                          help="Correr também com as etapas sobrepostas e comparar tempo e tabelas carregadas.")
+    pipeline.add_argument("--latencia-api", type=float, default=0.0, help="Segundos de latência por pedido à API.")
+    opcoes_pipeline(pipeline)
+    pipeline.set_defaults(funcao=comando_pipeline)
+
+    api = comandos.add_parser("api", help="Extração contra uma API local com falhas e latência.")
+    api.add_argument("--registos", type=int, default=2000, help="Registos por indicador.")
+    api.add_argument("--falhas", type=float, default=0.3, help="Fração de pedidos respondidos com 429/503.")
+    api.add_argument("--latencia", type=float, default=0.0, help="Segundos de latência por pedido.")
+    api.add_argument("--concorrencia", type=int, nargs="+", default=[1, 4, 8])
+    api.add_argument("--streaming", action="store_true", help="Extrair página a página.")
+    api.add_argument("--tamanho-pagina", type=int, default=500)
+    api.add_argument("--tentativas", type=int, default=II.TENTATIVAS_GHO)
+    api.add_argument("--pedidos-por-segundo", type=float, default=None)
+    api.add_argument("--paises", nargs="+", default=None, help="Filtro de países ($filter).")
+    api.add_argument("--anos", nargs=2, type=int, default=None, help="Intervalo de anos ($filter).")
+    api.add_argument("--sexo", nargs="+", default=None, help="Filtro de sexo ($filter).")
+    api.add_argument("--projecao", action="store_true", help="Pedir só os campos usados ($select).")
+    api.add_argument("--dir-trabalho", default=None, help="Pasta onde correr (por omissão, temporária).")
+    api.add_argument("--semente", type=int, default=0)
+    api.set_defaults(funcao=comando_api)
+
+    blocos = comandos.add_parser("blocos", help="Transformação em blocos comparada com a transformação em memória.")
+    blocos.add_argument("--linhas", type=int, default=5000)
+    blocos.add_argument("--tamanho-bloco", type=int, nargs="+", default=[997, 1500])
+    blocos.add_argument("--formatos", nargs="+", default=["parquet", "feather", "csv"])
+    blocos.add_argument("--dir-trabalho", default=None, help="Pasta onde correr (por omissão, temporária).")
+    blocos.add_argument("--semente", type=int, default=0)
+    blocos.set_defaults(funcao=comando_blocos)
+
+    escalabilidade = comandos.add_parser("escalabilidade", help="Tabelas agregadas do inquérito de 1 a N processos.")
+    escalabilidade.add_argument("--linhas", type=int, default=10_000_000)
+    escalabilidade.add_argument("--processos", type=int, nargs="+", default=[1, 2, 4, 8])
+    escalabilidade.add_argument("--semente", type=int, default=0)
+    escalabilidade.set_defaults(funcao=comando_escalabilidade)
+
+    args = parser.parse_args(argv)
+    return args.funcao(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())